@@ -1,9 +1,59 @@
-from flask import Flask, render_template, abort, request, redirect, url_for, session
-from werkzeug.security import generate_password_hash, check_password_hash
-from db import get_db
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import (
+    Flask, render_template, abort, request, redirect, url_for, session, jsonify, make_response,
+    Response, stream_with_context,
+)
+from mysql.connector import IntegrityError, errorcode
+from werkzeug.middleware.proxy_fix import ProxyFix
+from db import get_db, get_pool, get_replicas, init_app
+from cache import get_cache, obter_ou_carregar
+from eventos import canal_restaurante, get_broker, id_evento, publicar
+from carrinhos import get_carrinhos
+from senhas import HashOcupado, gerar_hash, precisa_rehash, verificar, verificar_ficticio
+from limites import permitir
+import cep
+import compressao
+import estoque
+import fragmentos
+import frete
+import metricas
+import pagamentos
+import resumo
+from pedidos import (
+    CONFLITO, NAO_ENCONTRADO, PAGAMENTO_PENDENTE, STATUS_FINAIS, TRANSICAO_INVALIDA, TRANSICOES,
+    carregar_detalhe, transicionar,
+)
 
 app = Flask(__name__)
 app.secret_key = "dev-secret"  # depois coloque isso no .env
+init_app(app)  # devolve a conexão do request ao pool no teardown
+metricas.init_app(app)  # tempo por rota, comandos SQL por request e Server-Timing
+compressao.init_app(app)  # gzip/brotli nas respostas (exceto streaming)
+fragmentos.init_app(app)  # {% cache chave %} nos templates
+
+# Atrás de proxy reverso (ex.: Heroku), confia em N saltos de X-Forwarded-For para obter o IP real
+if int(os.getenv("PROXIES_CONFIAVEIS", "0")):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv("PROXIES_CONFIAVEIS")), x_proto=1)
+
+# Tentativas de login/cadastro por IP e por email, por janela (token bucket)
+LOGIN_LIMITE_IP = int(os.getenv("LOGIN_LIMITE_IP", "20"))
+LOGIN_LIMITE_EMAIL = int(os.getenv("LOGIN_LIMITE_EMAIL", "5"))
+LOGIN_JANELA = int(os.getenv("LOGIN_JANELA", "60"))
+
+# Consultas a pedidos por cliente e por IP, por janela (barra quem varre ids/tokens)
+PEDIDO_LIMITE_CLIENTE = int(os.getenv("PEDIDO_LIMITE_CLIENTE", "120"))
+PEDIDO_LIMITE_IP = int(os.getenv("PEDIDO_LIMITE_IP", "300"))
+PEDIDO_JANELA = int(os.getenv("PEDIDO_JANELA", "60"))
 
 # =========================
 # Helpers de autenticação
@@ -33,6 +83,210 @@ def exigir_login(tipo_necessario=None):
         return "Acesso negado: tipo de usuário inválido.", 403
 
     return None
+
+
+def exigir_token(token):
+    """
+    Rotas operacionais: exige o header "Authorization: Bearer <token>".
+    Sem token configurado a rota fica fechada (403), nunca aberta por descuido.
+    Se tudo OK: retorna None.
+    """
+    if not token:
+        return "Acesso negado: rota operacional sem token configurado.", 403
+
+    if not secrets.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return "Acesso negado: token inválido.", 401, {"WWW-Authenticate": "Bearer"}
+
+    return None
+
+
+# =========================
+# Cache do cardápio
+# =========================
+TTL_CARDAPIO = int(os.getenv("CACHE_TTL_CARDAPIO", "300"))
+
+
+def carregar_cardapio(rid):
+    """
+    Restaurante + itens disponíveis, vindos do cache quando possível.
+    Retorna {"restaurante": {...}, "itens": [...]} ou None se não existir.
+    Só serve para exibição: o checkout sempre confere os preços no banco.
+    """
+    def do_banco():
+        # Do primário: lido de uma réplica atrasada logo após a invalidação, o cardápio
+        # antigo voltaria para o cache por TTL_CARDAPIO segundos
+        db = get_db(primario=True)
+        cur = db.cursor(dictionary=True)
+
+        cur.execute("SELECT usuario_id, nome, status FROM restaurantes WHERE usuario_id=%s", (rid,))
+        rest = cur.fetchone()
+        if not rest:
+            cur.close()
+            return None
+
+        cur.execute("""
+            SELECT id, nome, descricao, preco_base
+            FROM itens_cardapio
+            WHERE restaurante_id=%s AND disponivel=1
+            ORDER BY nome
+        """, (rid,))
+        itens = cur.fetchall()
+        cur.close()
+
+        # Versão dos dados exibidos: chave do trecho de template em cache (fragmentos.py)
+        assinatura = repr((sorted(rest.items()), [sorted(i.items()) for i in itens])).encode("utf-8")
+        return {"restaurante": rest, "itens": itens, "versao": hashlib.sha1(assinatura).hexdigest()}
+
+    return obter_ou_carregar(f"cardapio:{rid}", do_banco, TTL_CARDAPIO)
+
+
+def invalidar_cardapio(rid):
+    get_cache().delete(f"cardapio:{rid}")
+
+
+# =========================
+# Cache da home (restaurantes abertos)
+# =========================
+TTL_HOME = int(os.getenv("CACHE_TTL_HOME", "300"))
+HTTP_MAX_AGE_HOME = int(os.getenv("HTTP_MAX_AGE_HOME", "30"))
+
+
+def carregar_home():
+    """
+    Lista de restaurantes abertos já pronta para a home, com o ETag e a data
+    de geração usados nos cabeçalhos HTTP de cache.
+    """
+    def do_banco():
+        db = get_db(primario=True)  # idem ao cardápio: o cache é invalidado por escritas
+        cur = db.cursor(dictionary=True)
+
+        cur.execute("""
+            SELECT usuario_id, nome, status, tempo_preparo_min, tempo_preparo_max
+            FROM restaurantes
+            WHERE status='ABERTO'
+            ORDER BY nome
+        """)
+        restaurantes = cur.fetchall()
+        cur.close()
+
+        assinatura = repr([sorted(r.items()) for r in restaurantes]).encode("utf-8")
+        return {
+            "restaurantes": restaurantes,
+            "etag": hashlib.sha1(assinatura).hexdigest(),
+            # HTTP só tem precisão de segundos
+            "gerado_em": datetime.now(timezone.utc).replace(microsecond=0),
+        }
+
+    return obter_ou_carregar("home:restaurantes", do_banco, TTL_HOME)
+
+
+def invalidar_home():
+    get_cache().delete("home:restaurantes")
+
+
+# =========================
+# Cache das zonas de entrega
+# =========================
+TTL_FRETE = int(os.getenv("CACHE_TTL_FRETE", "600"))
+
+
+def tabela_frete(rid):
+    """Faixas de CEP já achatadas (frete.py); cotar um endereço não vai ao banco."""
+    def do_banco():
+        db = get_db()
+        cur = db.cursor(dictionary=True)
+        tabela = frete.carregar_tabela(cur, rid)
+        cur.close()
+        return tabela
+
+    return obter_ou_carregar(f"frete:{rid}", do_banco, TTL_FRETE)
+
+
+def invalidar_frete(rid):
+    get_cache().delete(f"frete:{rid}")
+
+
+def nao_modificado(etag, ultima_modificacao):
+    """True se o navegador/proxy já tem esta versão (If-None-Match / If-Modified-Since)."""
+    if request.if_none_match:
+        # Comparação fraca: o ETag sempre sai como W/"..." (ver set_etag nas rotas)
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        return ultima_modificacao <= request.if_modified_since
+    return False
+
+
+# =========================
+# Paginação de pedidos (keyset em realizado_em, id)
+# =========================
+STATUS_PEDIDO = ("ACEITO", "PREPARANDO", "SAIU_ENTREGA", "ENTREGUE", "CANCELADO")
+STATUS_ABERTOS = ("ACEITO", "PREPARANDO", "SAIU_ENTREGA")
+TAMANHO_PAGINA = 50
+TAMANHO_PAGINA_MAX = 200
+
+
+def ler_paginacao():
+    """
+    Lê ?limite=, ?apos=<cursor> e ?status= (um status ou "abertos") da query string.
+    O cursor é "<realizado_em AAAAMMDDhhmmss>-<id>" do último pedido da página anterior.
+    """
+    limite = request.args.get("limite", TAMANHO_PAGINA, type=int)
+    limite = max(1, min(limite, TAMANHO_PAGINA_MAX))
+
+    apos = None
+    cursor = request.args.get("apos")
+    if cursor:
+        try:
+            data, pid = cursor.split("-")
+            apos = (datetime.strptime(data, "%Y%m%d%H%M%S"), int(pid))
+        except ValueError:
+            abort(400)
+
+    status = request.args.get("status") or None
+    if status == "abertos":
+        filtro_status = STATUS_ABERTOS
+    elif status in STATUS_PEDIDO:
+        filtro_status = (status,)
+    elif status is None:
+        filtro_status = None
+    else:
+        abort(400)
+
+    return {"limite": limite, "apos": apos, "status": status, "filtro_status": filtro_status}
+
+
+def filtro_pagina_sql(pagina):
+    """Trecho do WHERE (status + posição do cursor) e seus parâmetros."""
+    sql = ""
+    params = []
+
+    if pagina["filtro_status"]:
+        sql += f" AND p.status_pedido IN ({','.join(['%s'] * len(pagina['filtro_status']))})"
+        params.extend(pagina["filtro_status"])
+
+    if pagina["apos"]:
+        realizado_em, pid = pagina["apos"]
+        sql += " AND (p.realizado_em < %s OR (p.realizado_em = %s AND p.id < %s))"
+        params.extend((realizado_em, realizado_em, pid))
+
+    return sql, params
+
+
+def fechar_pagina(rows, pagina, endpoint):
+    """
+    As consultas buscam limite+1 linhas: se vier a linha extra, existe próxima
+    página. Retorna (pedidos, url da próxima página ou None).
+    """
+    if len(rows) <= pagina["limite"]:
+        return rows, None
+
+    rows = rows[:pagina["limite"]]
+    ultimo = rows[-1]
+    cursor = f'{ultimo["realizado_em"]:%Y%m%d%H%M%S}-{ultimo["id"]}'
+    proxima = url_for(endpoint, apos=cursor, limite=pagina["limite"], status=pagina["status"])
+    return rows, proxima
+
+
 # =========================
 # Home / Cardápio público
 # =========================
@@ -44,137 +298,230 @@ def home():
     if user and user["tipo"] == "RESTAURANTE":
         return redirect(url_for("restaurante_home"))
 
-    db = get_db()
-    cur = db.cursor(dictionary=True)
+    listagem = carregar_home()
 
-    cur.execute("""
-        SELECT usuario_id, nome, status, tempo_preparo_min, tempo_preparo_max
-        FROM restaurantes
-        WHERE status='ABERTO'
-        ORDER BY nome
-    """)
-    restaurantes = cur.fetchall() #retorna tudo
+    # A página muda conforme o visitante (anônimo ou cliente), então isso entra no ETag
+    perfil = user["tipo"] if user else "ANONIMO"
+    etag = f'{listagem["etag"]}-{perfil}'
 
-    cur.close() #fecha cursor
-    db.close() #fecha o banco
-    return render_template("home.html", restaurantes=restaurantes, user=user)
+    if nao_modificado(etag, listagem["gerado_em"]):
+        resp = make_response("", 304)
+    else:
+        resp = make_response(render_template("home.html", restaurantes=listagem["restaurantes"], user=user))
+
+    # Fraco no 200 e no 304: o corpo pode ir comprimido ou não, mas a versão é a mesma
+    resp.set_etag(etag, weak=True)
+    resp.last_modified = listagem["gerado_em"]
+    resp.cache_control.max_age = HTTP_MAX_AGE_HOME
+    if user:
+        resp.cache_control.private = True
+    else:
+        resp.cache_control.public = True
+    resp.vary.add("Cookie")
+    return resp
 
 @app.get("/restaurantes/<int:rid>")
 def ver_restaurante(rid):
     user = get_usuario_logado()
     if user and user["tipo"] == "RESTAURANTE":
         return redirect(url_for("restaurante_home"))
-    db = get_db()
-    cur = db.cursor(dictionary=True)
 
-    cur.execute("SELECT usuario_id, nome, status FROM restaurantes WHERE usuario_id=%s", (rid,))
-    rest = cur.fetchone()
-    if not rest:
-        cur.close()
-        db.close()
+    cardapio = carregar_cardapio(rid)
+    if not cardapio:
         abort(404)
 
-    cur.execute("""
-        SELECT id, nome, descricao, preco_base
-        FROM itens_cardapio
-        WHERE restaurante_id=%s AND disponivel=1
-        ORDER BY nome
-    """, (rid,))
-    itens = cur.fetchall()
-
-    cur.close()
-    db.close()
-
-    return render_template("restaurante.html", restaurante=rest, itens=itens, user=get_usuario_logado())
+    return render_template(
+        "restaurante.html",
+        restaurante=cardapio["restaurante"],
+        itens=cardapio["itens"],
+        versao_cardapio=cardapio.get("versao"),
+        carrinho=montar_carrinho(),
+        user=get_usuario_logado()
+    )
 
 
 # =========================
-# Carrinho
+# Busca (FULLTEXT em restaurantes.nome e itens_cardapio.nome/descricao)
 # =========================
-@app.post("/carrinho/add")
-def carrinho_add():
-    item_id = int(request.form["item_id"])
-    restaurante_id = int(request.form["restaurante_id"])
+TAMANHO_BUSCA = 20
+MAX_PAGINAS_BUSCA = 25
+MAX_TERMOS_BUSCA = 8
+# Palavras que não precisam aparecer no resultado (só contam para a relevância)
+PALAVRAS_OPCIONAIS = {"de", "da", "do", "das", "dos", "com", "sem", "em", "na", "no", "para", "e", "ou"}
+TTL_AUTOCOMPLETAR = int(os.getenv("CACHE_TTL_AUTOCOMPLETAR", "60"))
+# Tamanho (caracteres) do texto aceito no autocompletar; fora disso não há sugestão
+AUTOCOMPLETAR_MIN = 2
+AUTOCOMPLETAR_MAX = 60
+
+
+def termos_busca(texto):
+    """
+    Converte o texto digitado numa busca BOOLEAN MODE: todas as palavras obrigatórias
+    e cada uma como prefixo ("+pizz* +calab*"). A collation utf8mb4_0900_ai_ci dos índices
+    já ignora acentos e maiúsculas; preposições ficam opcionais. Retorna None se não
+    sobrar nenhuma palavra (a busca não vai ao banco).
+    """
+    palavras = re.findall(r"\w+", texto or "")
+    # Letras soltas ("x-burguer", "pão d água") ficam de fora: "+a*" casaria com quase tudo
+    # (ou com nada, conforme as stopwords). Só letras soltas = nenhuma busca, como no
+    # autocompletar do navegador (q.length < 2)
+    palavras = [p for p in palavras if len(p) >= 2]
+    if not palavras:
+        return None
+    return " ".join(
+        f"{p}*" if p.lower() in PALAVRAS_OPCIONAIS else f"+{p}*"
+        for p in palavras[:MAX_TERMOS_BUSCA]
+    )
 
-    carrinho = session.get("carrinho", {})
-    carrinho_rest = session.get("carrinho_restaurante_id")
 
-    # Um carrinho só pode ter itens de 1 restaurante
-    if carrinho_rest and carrinho_rest != restaurante_id:
-        carrinho = {}
+def buscar_restaurantes(cur, termos, limite, offset=0):
+    cur.execute("""
+        SELECT usuario_id, nome, status, tempo_preparo_min, tempo_preparo_max,
+               MATCH(nome) AGAINST (%s IN BOOLEAN MODE) AS relevancia
+        FROM restaurantes
+        WHERE MATCH(nome) AGAINST (%s IN BOOLEAN MODE)
+        ORDER BY status='ABERTO' DESC, relevancia DESC, usuario_id
+        LIMIT %s OFFSET %s
+    """, (termos, termos, limite, offset))
+    return cur.fetchall()
 
-    session["carrinho_restaurante_id"] = restaurante_id
-    carrinho[str(item_id)] = carrinho.get(str(item_id), 0) + 1
-    session["carrinho"] = carrinho
 
-    return redirect(url_for("ver_restaurante", rid=restaurante_id))
+def buscar_itens(cur, termos, limite, offset=0):
+    cur.execute("""
+        SELECT ic.id, ic.nome, ic.descricao, ic.preco_base,
+               r.usuario_id AS restaurante_id, r.nome AS restaurante_nome, r.status AS restaurante_status,
+               MATCH(ic.nome, ic.descricao) AGAINST (%s IN BOOLEAN MODE) AS relevancia
+        FROM itens_cardapio ic
+        JOIN restaurantes r ON r.usuario_id = ic.restaurante_id
+        WHERE MATCH(ic.nome, ic.descricao) AGAINST (%s IN BOOLEAN MODE)
+          AND ic.disponivel=1
+        ORDER BY r.status='ABERTO' DESC, relevancia DESC, ic.id
+        LIMIT %s OFFSET %s
+    """, (termos, termos, limite, offset))
+    return cur.fetchall()
+
+
+@app.get("/busca")
+def busca():
+    """
+    Busca restaurantes e itens disponíveis, ordenados por relevância (restaurantes
+    abertos primeiro). Paginada com ?pagina=N, TAMANHO_BUSCA resultados por página.
+    """
+    q = request.args.get("q", "").strip()
+    pagina = max(1, min(request.args.get("pagina", 1, type=int), MAX_PAGINAS_BUSCA))
+    termos = termos_busca(q)
+
+    restaurantes, itens, tem_mais = [], [], False
+    if termos:
+        db = get_db()
+        cur = db.cursor(dictionary=True)
+        offset = (pagina - 1) * TAMANHO_BUSCA
+        # Busca uma linha a mais para saber se existe próxima página
+        restaurantes = buscar_restaurantes(cur, termos, TAMANHO_BUSCA + 1, offset)
+        itens = buscar_itens(cur, termos, TAMANHO_BUSCA + 1, offset)
+        cur.close()
+        db.close()
 
+        tem_mais = len(restaurantes) > TAMANHO_BUSCA or len(itens) > TAMANHO_BUSCA
+        restaurantes, itens = restaurantes[:TAMANHO_BUSCA], itens[:TAMANHO_BUSCA]
 
-@app.post("/carrinho/remove")
-def carrinho_remove():
-    item_id = request.form["item_id"]
-    carrinho = session.get("carrinho", {})
+    proxima = None
+    if tem_mais and pagina < MAX_PAGINAS_BUSCA:
+        proxima = url_for("busca", q=q, pagina=pagina + 1)
+    anterior = url_for("busca", q=q, pagina=pagina - 1) if pagina > 1 else None
 
-    if item_id in carrinho:
-        del carrinho[item_id]
+    if quer_json():
+        return jsonify({
+            "restaurantes": restaurantes,
+            "itens": [{**i, "preco_base": float(i["preco_base"])} for i in itens],
+            "proxima": proxima,
+        })
 
-    if not carrinho:
-        session.pop("carrinho_restaurante_id", None)
+    return render_template(
+        "busca.html",
+        q=q,
+        restaurantes=restaurantes,
+        itens=itens,
+        pagina=pagina,
+        proxima=proxima,
+        anterior=anterior,
+        user=get_usuario_logado(),
+    )
 
-    session["carrinho"] = carrinho
-    return redirect(url_for("ver_carrinho"))
 
+@app.get("/busca/autocompletar")
+def busca_autocompletar():
+    """
+    Sugestões para o campo de busca (nomes de restaurantes e itens que começam com
+    as palavras digitadas). Respostas ficam em cache por TTL_AUTOCOMPLETAR segundos,
+    pela busca já normalizada (termos_busca) e num espaço próprio do cache.
+    """
+    q = " ".join(request.args.get("q", "").split()).lower()
+    termos = termos_busca(q) if AUTOCOMPLETAR_MIN <= len(q) <= AUTOCOMPLETAR_MAX else None
+    if not termos:
+        return jsonify([])
+
+    def do_banco():
+        db = get_db()
+        cur = db.cursor(dictionary=True)
+        sugestoes = []
+        for r in buscar_restaurantes(cur, termos, 4):
+            sugestoes.append({"tipo": "restaurante", "nome": r["nome"], "url": url_for("ver_restaurante", rid=r["usuario_id"])})
+        for i in buscar_itens(cur, termos, 6):
+            sugestoes.append({
+                "tipo": "item",
+                "nome": i["nome"],
+                "restaurante": i["restaurante_nome"],
+                "url": url_for("ver_restaurante", rid=i["restaurante_id"], _anchor=f"item-{i['id']}"),
+            })
+        cur.close()
+        return sugestoes
 
-@app.post("/carrinho/decrease")
-def carrinho_decrease():
-    item_id = request.form["item_id"]
-    carrinho = session.get("carrinho", {})
+    # "Pizza  Calabresa!" e "pizza calabresa" viram os mesmos termos e a mesma entrada
+    resp = jsonify(obter_ou_carregar(termos, do_banco, TTL_AUTOCOMPLETAR, espaco="autocompletar"))
+    resp.cache_control.public = True
+    resp.cache_control.max_age = TTL_AUTOCOMPLETAR
+    return resp
 
-    if item_id in carrinho:
-        if carrinho[item_id] <= 1:
-            del carrinho[item_id]
-        else:
-            carrinho[item_id] -= 1
 
-    if not carrinho:
-        session.pop("carrinho_restaurante_id", None)
+# =========================
+# Carrinho
+# =========================
+def id_carrinho(criar=False):
+    """
+    O carrinho fica no servidor (carrinhos.py); o cookie de sessão guarda só o id dele.
+    """
+    cid = session.get("carrinho_id")
+    if not cid and criar:
+        cid = secrets.token_urlsafe(16)
+        session["carrinho_id"] = cid
+    return cid
 
-    session["carrinho"] = carrinho
-    return redirect(url_for("ver_carrinho"))
 
+def carrinho_atual():
+    """(restaurante_id, {item_id: qtd}) do carrinho da sessão."""
+    cid = id_carrinho()
+    if not cid:
+        return None, {}
+    return get_carrinhos().obter(cid)
 
-@app.get("/carrinho")
-def ver_carrinho():
-    carrinho = session.get("carrinho", {})
-    restaurante_id = session.get("carrinho_restaurante_id")
 
+def montar_carrinho():
+    """
+    Linhas do carrinho com nome e preço (do cardápio em cache) e o subtotal.
+    Usado tanto pela página do carrinho quanto pelas respostas JSON.
+    """
+    restaurante_id, carrinho = carrinho_atual()
     if not carrinho or not restaurante_id:
-        return render_template(
-            "carrinho.html",
-            itens=[],
-            subtotal=0,
-            restaurante_id=None,
-            user=get_usuario_logado()
-        )
-
-    ids = list(map(int, carrinho.keys()))
-    placeholders = ",".join(["%s"] * len(ids))
-
-    db = get_db()
-    cur = db.cursor(dictionary=True)
+        return {"restaurante_id": None, "itens": [], "qtd_itens": 0, "subtotal": 0}
 
-    cur.execute(f"""
-        SELECT id, nome, preco_base
-        FROM itens_cardapio
-        WHERE id IN ({placeholders})
-    """, tuple(ids))
-    itens_db = {row["id"]: row for row in cur.fetchall()}
+    cardapio = carregar_cardapio(restaurante_id)
+    itens_db = {row["id"]: row for row in cardapio["itens"]} if cardapio else {}
 
     itens = []
     subtotal = 0.0
 
-    for item_id_str, qtd in carrinho.items():
-        item_id = int(item_id_str)
+    for item_id, qtd in carrinho.items():
         row = itens_db.get(item_id)
         if not row:
             continue
@@ -191,14 +538,74 @@ def ver_carrinho():
             "linha_total": linha_total
         })
 
-    cur.close()
-    db.close()
+    return {
+        "restaurante_id": restaurante_id,
+        "itens": itens,
+        "qtd_itens": sum(i["qtd"] for i in itens),
+        "subtotal": subtotal,
+    }
+
+
+def quer_json():
+    """True quando o cliente pediu JSON (Accept: application/json), ex.: fetch() dos templates."""
+    return request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json"
+
+
+@app.post("/carrinho/add")
+def carrinho_add():
+    item_id = request.form.get("item_id", type=int)
+    restaurante_id = request.form.get("restaurante_id", type=int)
+    if item_id is None or restaurante_id is None:
+        abort(400)
+
+    # Um carrinho só pode ter itens de 1 restaurante: o store esvazia se mudar
+    get_carrinhos().adicionar(id_carrinho(criar=True), restaurante_id, item_id)
+
+    if quer_json():
+        return jsonify(montar_carrinho())
+    return redirect(url_for("ver_restaurante", rid=restaurante_id))
+
+
+@app.post("/carrinho/remove")
+def carrinho_remove():
+    # item_id ausente ou inválido: nada a fazer, só devolve o carrinho como está
+    item_id = request.form.get("item_id", type=int)
+    cid = id_carrinho()
+
+    if cid and item_id is not None:
+        get_carrinhos().remover(cid, item_id)
+
+    if quer_json():
+        return jsonify(montar_carrinho())
+    return redirect(url_for("ver_carrinho"))
+
+
+@app.post("/carrinho/decrease")
+def carrinho_decrease():
+    # item_id ausente ou inválido: nada a fazer, só devolve o carrinho como está
+    item_id = request.form.get("item_id", type=int)
+    cid = id_carrinho()
+
+    if cid and item_id is not None:
+        get_carrinhos().diminuir(cid, item_id)
+
+    if quer_json():
+        return jsonify(montar_carrinho())
+    return redirect(url_for("ver_carrinho"))
+
+
+@app.get("/carrinho")
+def ver_carrinho():
+    carrinho = montar_carrinho()
+
+    if quer_json():
+        return jsonify(carrinho)
 
     return render_template(
         "carrinho.html",
-        itens=itens,
-        subtotal=subtotal,
-        restaurante_id=restaurante_id,
+        itens=carrinho["itens"],
+        subtotal=carrinho["subtotal"],
+        restaurante_id=carrinho["restaurante_id"],
         user=get_usuario_logado()
     )
 
@@ -213,8 +620,7 @@ def checkout():
         return bloqueio
 
     cliente_id = session["usuario_id"]
-    carrinho = session.get("carrinho", {})
-    restaurante_id = session.get("carrinho_restaurante_id")
+    restaurante_id, carrinho = carrinho_atual()
 
     if not carrinho or not restaurante_id:
         return redirect(url_for("home"))
@@ -233,7 +639,32 @@ def checkout():
     cur.close()
     db.close()
 
-    return render_template("checkout.html", enderecos=enderecos, user=get_usuario_logado())
+    # Cotação por endereço (None = fora da área de entrega); o POST recalcula com as zonas do banco
+    tabela = tabela_frete(restaurante_id)
+    for e in enderecos:
+        e["taxa_entrega"] = frete.cotar(tabela, e["cep"])
+
+    # Chave de idempotência: reenvios deste formulário (duplo clique, retry da rede) viram o mesmo pedido
+    return render_template(
+        "checkout.html",
+        enderecos=enderecos,
+        chave_idempotencia=secrets.token_hex(16),
+        user=get_usuario_logado()
+    )
+
+
+def pedido_da_chave(cliente_id, chave):
+    """Token público do pedido já criado com esta chave de idempotência (ou None)."""
+    db = get_db()
+    cur = db.cursor()
+    cur.execute("""
+        SELECT token_publico
+        FROM pedidos
+        WHERE cliente_id=%s AND chave_idempotencia=%s
+    """, (cliente_id, chave))
+    row = cur.fetchone()
+    cur.close()
+    return row[0] if row else None
 
 
 @app.post("/checkout")
@@ -243,8 +674,18 @@ def finalizar_checkout():
         return bloqueio
 
     cliente_id = session["usuario_id"]
-    carrinho = session.get("carrinho", {})
-    restaurante_id = session.get("carrinho_restaurante_id")
+
+    # Reenvio de um checkout que já virou pedido: só uma busca pelo índice único, nada é gravado
+    # (vem antes do carrinho, que já foi esvaziado pelo primeiro envio)
+    chave = request.form.get("chave_idempotencia", "")
+    if not re.fullmatch(r"[0-9a-f]{32}", chave):
+        chave = None
+    if chave:
+        token = pedido_da_chave(cliente_id, chave)
+        if token:
+            return redirect(url_for("ver_pedido", token=token))
+
+    restaurante_id, carrinho = carrinho_atual()
 
     if not carrinho or not restaurante_id:
         return redirect(url_for("home"))
@@ -254,57 +695,95 @@ def finalizar_checkout():
     if metodo not in ("PIX", "CARTAO"):
         abort(400)
 
-    taxa_entrega = 7.00  # MVP fixa
-
-    ids = list(map(int, carrinho.keys()))
+    ids = list(carrinho.keys())
     placeholders = ",".join(["%s"] * len(ids))
 
     db = get_db()
     cur = db.cursor(dictionary=True)
 
     try:
+        # Endereço do próprio cliente e frete pelas zonas atuais (nunca do cache)
+        cur.execute("SELECT cep FROM enderecos WHERE id=%s AND cliente_id=%s", (endereco_id, cliente_id))
+        endereco = cur.fetchone()
+        if not endereco:
+            raise ValueError("Endereço inválido.")
+        taxa_entrega = frete.cotar(frete.carregar_tabela(cur, restaurante_id), endereco["cep"])
+        if taxa_entrega is None:
+            raise ValueError("O restaurante não entrega nesse endereço.")
+
+        # Preços conferidos direto no banco (nunca do cache do cardápio)
         cur.execute(f"""
-            SELECT id, preco_base
+            SELECT id, nome, preco_base, disponivel, estoque
             FROM itens_cardapio
             WHERE id IN ({placeholders})
         """, tuple(ids))
-        precos = {row["id"]: float(row["preco_base"]) for row in cur.fetchall()}
+        itens_banco = {row["id"]: row for row in cur.fetchall()}
 
+        # Totais calculados uma única vez; as linhas já ficam prontas para o INSERT em lote
+        linhas = []
         subtotal = 0.0
-        for item_id_str, qtd in carrinho.items():
-            item_id = int(item_id_str)
-            if item_id not in precos:
+        reservas = {}  # itens com estoque controlado: item_id -> quantidade
+        for item_id, qtd in carrinho.items():
+            if item_id not in itens_banco:
                 raise ValueError("Item inválido no carrinho.")
-            subtotal += precos[item_id] * qtd
+            if not itens_banco[item_id]["disponivel"]:
+                raise ValueError(f"Item esgotado: {itens_banco[item_id]['nome']}.")
+            if itens_banco[item_id]["estoque"] is not None:
+                reservas[item_id] = qtd
+            preco_unit = float(itens_banco[item_id]["preco_base"])
+            total_linha = preco_unit * qtd
+            subtotal += total_linha
+            linhas.append((item_id, qtd, preco_unit, total_linha))
 
         total = subtotal + taxa_entrega
+        # Endereço público do pedido: aleatório, para não dar para adivinhar o de outro cliente
+        token = secrets.token_hex(16)
 
+        # Pagamento fica PENDENTE: a cobrança roda em segundo plano (pagamentos.py),
+        # e o tempo deste request não depende do gateway
         cur.execute("""
             INSERT INTO pedidos (
               cliente_id, restaurante_id, endereco_id,
               status_pedido, taxa_entrega, subtotal, total,
-              metodo_pagamento, status_pagamento, valor_pago
+              metodo_pagamento, status_pagamento, valor_pago, chave_idempotencia, token_publico
             )
-            VALUES (%s,%s,%s,'ACEITO',%s,%s,%s,%s,'PAGO',%s)
-        """, (cliente_id, restaurante_id, endereco_id, taxa_entrega, subtotal, total, metodo, total))
+            VALUES (%s,%s,%s,'ACEITO',%s,%s,%s,%s,'PENDENTE',0,%s,%s)
+        """, (cliente_id, restaurante_id, endereco_id, taxa_entrega, subtotal, total, metodo, chave, token))
 
         pedido_id = cur.lastrowid
 
-        for item_id_str, qtd in carrinho.items():
-            item_id = int(item_id_str)
-            preco_unit = precos[item_id]
-            total_linha = preco_unit * qtd
+        # Um único INSERT com várias linhas: 1 ida ao banco, qualquer que seja o tamanho do carrinho
+        valores = ",".join(["(%s,%s,%s,%s,%s)"] * len(linhas))
+        params = []
+        for item_id, qtd, preco_unit, total_linha in linhas:
+            params.extend((pedido_id, item_id, qtd, preco_unit, total_linha))
 
-            cur.execute("""
-                INSERT INTO itens_pedido (
-                  pedido_id, item_cardapio_id, quantidade,
-                  preco_unitario, total_linha
-                )
-                VALUES (%s,%s,%s,%s,%s)
-            """, (pedido_id, item_id, qtd, preco_unit, total_linha))
+        cur.execute(f"""
+            INSERT INTO itens_pedido (
+              pedido_id, item_cardapio_id, quantidade,
+              preco_unitario, total_linha
+            )
+            VALUES {valores}
+        """, tuple(params))
+
+        # As linhas de estoque disputadas entre checkouts simultâneos ficam para o fim,
+        # para o lock delas durar só até o commit. O resumo do restaurante só conta o
+        # pedido quando o pagamento for aprovado (pagamentos.processar).
+        esgotados = estoque.reservar(cur, restaurante_id, reservas)
 
         db.commit()
 
+    except IntegrityError as e:
+        db.rollback()
+        cur.close()
+        # Dois envios simultâneos com a mesma chave: o segundo esbarra no índice único
+        # (uq_pedidos_cliente_chave) e devolve o pedido criado pelo primeiro
+        token = pedido_da_chave(cliente_id, chave) if chave and e.errno == errorcode.ER_DUP_ENTRY else None
+        db.close()
+        if token:
+            return redirect(url_for("ver_pedido", token=token))
+        return f"Erro ao finalizar pedido: {e}", 400
+
     except Exception as e:
         db.rollback()
         cur.close()
@@ -314,41 +793,148 @@ def finalizar_checkout():
     cur.close()
     db.close()
 
-    session["carrinho"] = {}
-    session["carrinho_restaurante_id"] = None
+    if esgotados:
+        invalidar_cardapio(restaurante_id)
 
-    return redirect(url_for("ver_pedido", pid=pedido_id))
+    # O painel da cozinha só recebe o pedido (novo_pedido) quando o pagamento for aprovado
+    pagamentos.enviar(pedido_id)
 
+    get_carrinhos().limpar(id_carrinho())
 
-@app.get("/pedido/<int:pid>")
-def ver_pedido(pid):
-    db = get_db()
-    cur = db.cursor(dictionary=True)
+    return redirect(url_for("ver_pedido", token=token))
 
-    cur.execute("""
-        SELECT p.*, r.nome AS restaurante_nome
-        FROM pedidos p
-        JOIN restaurantes r ON r.usuario_id = p.restaurante_id
-        WHERE p.id=%s
-    """, (pid,))
-    pedido = cur.fetchone()
-    if not pedido:
+
+# =========================
+# Detalhe do pedido
+# =========================
+TTL_PEDIDO = int(os.getenv("CACHE_TTL_PEDIDO", "3600"))
+
+
+def detalhe_pedido(pid=None, cliente_id=None, restaurante_id=None, token=None):
+    """
+    (pedido, itens) para as telas de detalhe, pelo id ou pelo token público, ou None se
+    não existir ou não for do dono informado. Pedidos ENTREGUE/CANCELADO não mudam mais
+    e ficam em cache.
+    """
+    cache = get_cache()
+    chave = f"pedido:t:{token}" if token is not None else f"pedido:{pid}"
+    detalhe = cache.get(chave)
+    if detalhe is None:
+        db = get_db()
+        cur = db.cursor(dictionary=True)
+        detalhe = carregar_detalhe(cur, pid, cliente_id, restaurante_id, token)
         cur.close()
         db.close()
+        if detalhe and detalhe[0]["status_pedido"] in STATUS_FINAIS:
+            cache.set(chave, detalhe, TTL_PEDIDO)
+        return detalhe
+
+    pedido = detalhe[0]
+    if cliente_id is not None and pedido["cliente_id"] != cliente_id:
+        return None
+    if restaurante_id is not None and pedido["restaurante_id"] != restaurante_id:
+        return None
+    return detalhe
+
+
+def responder_detalhe(template, pedido, itens, **contexto):
+    """
+    Renderiza a tela de detalhe. Pedido ENTREGUE/CANCELADO não muda mais: vai com ETag
+    e o navegador revalida com 304, sem renderizar de novo.
+    """
+    if pedido["status_pedido"] not in STATUS_FINAIS:
+        return render_template(
+            template, pedido=pedido, itens=itens, chave_itens=None, user=get_usuario_logado(), **contexto
+        )
+
+    # Itens de pedido finalizado nunca mudam: o trecho renderizado fica em cache (fragmentos.py)
+    contexto["chave_itens"] = f'{template}:{pedido["id"]}:{pedido["versao"]}'
+
+    etag = f'pedido-{pedido["id"]}-{pedido["versao"]}-{session.get("usuario_id", 0)}'
+    if request.if_none_match.contains_weak(etag):
+        resp = make_response("", 304)
+    else:
+        resp = make_response(
+            render_template(template, pedido=pedido, itens=itens, user=get_usuario_logado(), **contexto)
+        )
+    resp.set_etag(etag, weak=True)
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    resp.vary.add("Cookie")
+    return resp
+
+
+MUITAS_CONSULTAS = ("Muitas consultas. Aguarde um pouco e tente novamente.", 429)
+TOKEN_PEDIDO = re.compile(r"[0-9a-f]{32}")
+
+
+def consulta_de_pedido_permitida():
+    """Orçamento de consultas a pedidos do cliente logado e do IP, checado antes do banco."""
+    return (
+        permitir(f"pedido:cliente:{session['usuario_id']}", PEDIDO_LIMITE_CLIENTE, PEDIDO_JANELA)
+        and permitir(f"pedido:ip:{request.remote_addr}", PEDIDO_LIMITE_IP, PEDIDO_JANELA)
+    )
+
+
+@app.get("/pedido/<token>")
+def ver_pedido(token):
+    bloqueio = exigir_login("CLIENTE")
+    if bloqueio:
+        return bloqueio
+
+    # Links antigos, com o id: a tela do cliente confere o dono do pedido
+    if token.isdigit() and len(token) < 32:
+        return redirect(url_for("cliente_pedido_detalhe", pid=int(token)), 301)
+
+    # Token malformado nem chega ao limite nem ao banco
+    if not TOKEN_PEDIDO.fullmatch(token):
         abort(404)
+    if not consulta_de_pedido_permitida():
+        return MUITAS_CONSULTAS
 
-    cur.execute("""
-        SELECT ic.nome, ip.quantidade, ip.total_linha
-        FROM itens_pedido ip
-        JOIN itens_cardapio ic ON ic.id = ip.item_cardapio_id
-        WHERE ip.pedido_id=%s
-    """, (pid,))
-    itens = cur.fetchall()
+    # Token e dono conferidos no mesmo WHERE: pedido de outro cliente é 404, como um inexistente
+    detalhe = detalhe_pedido(token=token, cliente_id=session["usuario_id"])
+    if not detalhe:
+        abort(404)
+    pedido, itens = detalhe
+
+    return responder_detalhe("pedido.html", pedido, itens)
 
+
+@app.get("/pedido/<token>/pagamento")
+def ver_pedido_pagamento(token):
+    """Situação do pagamento, consultada pela página do pedido enquanto está PENDENTE."""
+    bloqueio = exigir_login("CLIENTE")
+    if bloqueio:
+        return bloqueio
+
+    if not TOKEN_PEDIDO.fullmatch(token):
+        abort(404)
+    if not consulta_de_pedido_permitida():
+        return MUITAS_CONSULTAS
+
+    db = get_db()
+    cur = db.cursor(dictionary=True)
+    cur.execute("""
+        SELECT id, status_pedido, status_pagamento,
+               realizado_em < NOW() - INTERVAL %s SECOND AS atrasado
+        FROM pedidos
+        WHERE token_publico=%s AND cliente_id=%s
+    """, (pagamentos.PAGAMENTO_REENVIO, token, session["usuario_id"]))
+    pedido = cur.fetchone()
     cur.close()
     db.close()
 
-    return render_template("pedido.html", pedido=pedido, itens=itens, user=get_usuario_logado())
+    if not pedido:
+        abort(404)
+
+    # Cobrança perdida (ex.: worker reiniciado antes do gateway responder): manda de novo
+    if pedido["status_pagamento"] == "PENDENTE" and pedido["atrasado"]:
+        pagamentos.enviar(pedido["id"])
+
+    resposta = jsonify(status_pedido=pedido["status_pedido"], status_pagamento=pedido["status_pagamento"])
+    resposta.headers["Cache-Control"] = "no-store"
+    return resposta
 
 
 # =========================
@@ -376,7 +962,13 @@ def cadastro_salvar():
     if not email or not senha or not nome:
         return "Erro: email, senha e nome são obrigatórios.", 400
 
-    senha_hash = generate_password_hash(senha)
+    if not permitir(f"cadastro:ip:{request.remote_addr}", LOGIN_LIMITE_IP, LOGIN_JANELA):
+        return "Muitas tentativas. Aguarde um pouco e tente novamente.", 429
+
+    try:
+        senha_hash = gerar_hash(senha)
+    except HashOcupado:
+        return "Servidor ocupado. Tente novamente em instantes.", 503
 
     db = get_db()
     cur = db.cursor(dictionary=True)
@@ -407,6 +999,9 @@ def cadastro_salvar():
 
         db.commit()
 
+        if tipo == "RESTAURANTE":
+            invalidar_home()
+
     except Exception as e:
         db.rollback()
         cur.close()
@@ -434,16 +1029,40 @@ def login_entrar():
     senha = request.form["senha"]
     next_url = request.form.get("next_url", "/")
 
+    # Limites checados antes de qualquer hash ou consulta ao banco
+    if not (
+        permitir(f"login:ip:{request.remote_addr}", LOGIN_LIMITE_IP, LOGIN_JANELA)
+        and permitir(f"login:email:{email}", LOGIN_LIMITE_EMAIL, LOGIN_JANELA)
+    ):
+        return render_template(
+            "login.html",
+            next_url=next_url,
+            erro="Muitas tentativas. Aguarde um pouco e tente novamente.",
+            user=get_usuario_logado()
+        ), 429
+
     db = get_db()
     cur = db.cursor(dictionary=True)
 
     cur.execute("SELECT id, email, senha, tipo FROM usuarios WHERE email=%s", (email,))
     u = cur.fetchone()
 
-    cur.close()
-    db.close()
+    try:
+        # Email desconhecido também paga um hash: senão a resposta rápida entrega quem tem conta
+        senha_ok = verificar(u["senha"], senha) if u is not None else verificar_ficticio(senha)
+    except HashOcupado:
+        cur.close()
+        db.close()
+        return render_template(
+            "login.html",
+            next_url=next_url,
+            erro="Servidor ocupado. Tente novamente em instantes.",
+            user=get_usuario_logado()
+        ), 503
 
-    if not u or not check_password_hash(u["senha"], senha):
+    if not senha_ok:
+        cur.close()
+        db.close()
         return render_template(
             "login.html",
             next_url=next_url,
@@ -451,6 +1070,17 @@ def login_entrar():
             user=get_usuario_logado()
         )
 
+    # Custo do hash mudou (SENHA_METODO): aproveita a senha em mãos para refazer
+    if precisa_rehash(u["senha"]):
+        try:
+            cur.execute("UPDATE usuarios SET senha=%s WHERE id=%s", (gerar_hash(senha), u["id"]))
+            db.commit()
+        except Exception:
+            db.rollback()
+
+    cur.close()
+    db.close()
+
     session["usuario_id"] = u["id"]
     session["tipo"] = u["tipo"]
 
@@ -491,6 +1121,19 @@ def enderecos_listar():
     return render_template("enderecos.html", enderecos=enderecos, user=get_usuario_logado())
 
 
+@app.get("/enderecos/cep")
+def enderecos_cep():
+    """
+    Autocompletar do formulário de endereço: ?q= com 5 a 8 dígitos do CEP. Consulta o
+    índice local de CEPs (cep.py), sem chamar serviço externo. Lista vazia se não houver base.
+    """
+    resp = jsonify(cep.sugerir(request.args.get("q", "")))
+    # A base só muda quando o índice é regerado
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 3600
+    return resp
+
+
 @app.post("/enderecos")
 def enderecos_criar():
     bloqueio = exigir_login("CLIENTE")
@@ -499,19 +1142,22 @@ def enderecos_criar():
 
     cliente_id = session["usuario_id"]
 
-    rua = request.form["rua"].strip()
     numero = request.form["numero"].strip()
-    bairro = request.form.get("bairro", "").strip()
-    cidade = request.form.get("cidade", "").strip()
-    estado = request.form.get("estado", "").strip().upper()
-    cep = request.form["cep"].strip()
     complemento = request.form.get("complemento", "").strip()
 
-    if not rua or not numero or not cep:
+    if not numero:
         return "Erro: rua, número e CEP são obrigatórios.", 400
 
-    if estado and len(estado) != 2:
-        return "Erro: estado deve ter 2 letras (ex: AM).", 400
+    # CEP no formato 00000-000; com a base de CEPs, rua/bairro/cidade/UF vêm dela
+    endereco, erro = cep.normalizar_endereco(
+        request.form.get("rua"),
+        request.form.get("bairro"),
+        request.form.get("cidade"),
+        request.form.get("estado"),
+        request.form["cep"],
+    )
+    if erro:
+        return erro, 400
 
     db = get_db()
     cur = db.cursor(dictionary=True)
@@ -522,7 +1168,10 @@ def enderecos_criar():
               cliente_id, rua, numero, bairro, cidade, estado, cep, complemento
             )
             VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-        """, (cliente_id, rua, numero, bairro or None, cidade or None, estado or None, cep, complemento or None))
+        """, (
+            cliente_id, endereco["rua"], numero, endereco["bairro"] or None, endereco["cidade"] or None,
+            endereco["estado"] or None, endereco["cep"], complemento or None,
+        ))
         db.commit()
     except Exception as e:
         db.rollback()
@@ -571,11 +1220,14 @@ def cliente_pedidos():
         return bloqueio
 
     cliente_id = session["usuario_id"]
+    pagina = ler_paginacao()
+    filtro, params = filtro_pagina_sql(pagina)
 
     db = get_db()
     cur = db.cursor(dictionary=True)
 
-    cur.execute("""
+    # Percorre idx_pedidos_cliente_realizado (cliente_id, realizado_em, id) a partir do cursor
+    cur.execute(f"""
         SELECT
           p.id,
           p.realizado_em,
@@ -585,15 +1237,22 @@ def cliente_pedidos():
           r.nome AS restaurante_nome
         FROM pedidos p
         JOIN restaurantes r ON r.usuario_id = p.restaurante_id
-        WHERE p.cliente_id=%s
-        ORDER BY p.realizado_em DESC
-    """, (cliente_id,))
-    pedidos = cur.fetchall()
+        WHERE p.cliente_id=%s{filtro}
+        ORDER BY p.realizado_em DESC, p.id DESC
+        LIMIT %s
+    """, (cliente_id, *params, pagina["limite"] + 1))
+    pedidos, proxima_url = fechar_pagina(cur.fetchall(), pagina, "cliente_pedidos")
 
     cur.close()
     db.close()
 
-    return render_template("meus_pedidos.html", pedidos=pedidos, user=get_usuario_logado())
+    return render_template(
+        "meus_pedidos.html",
+        pedidos=pedidos,
+        proxima_url=proxima_url,
+        status=pagina["status"],
+        user=get_usuario_logado()
+    )
 
 
 @app.get("/meus-pedidos/<int:pid>")
@@ -602,62 +1261,173 @@ def cliente_pedido_detalhe(pid):
     if bloqueio:
         return bloqueio
 
-    cliente_id = session["usuario_id"]
+    if not consulta_de_pedido_permitida():
+        return MUITAS_CONSULTAS
+
+    detalhe = detalhe_pedido(pid, cliente_id=session["usuario_id"])
+    if not detalhe:
+        abort(404)
+    pedido, itens = detalhe
+
+    return responder_detalhe("meu_pedido_detalhe.html", pedido, itens)
+
+# =========================
+# Painel do restaurante (home)
+# =========================
+@app.get("/restaurante")
+def restaurante_home():
+    bloqueio = exigir_login("RESTAURANTE")
+    if bloqueio:
+        return bloqueio
+
+    rid = session["usuario_id"]
 
     db = get_db()
     cur = db.cursor(dictionary=True)
 
-    cur.execute("""
-        SELECT
-          p.*,
-          r.nome AS restaurante_nome
-        FROM pedidos p
-        JOIN restaurantes r ON r.usuario_id = p.restaurante_id
-        WHERE p.id=%s AND p.cliente_id=%s
-    """, (pid, cliente_id))
-    pedido = cur.fetchone()
-    if not pedido:
-        cur.close()
-        db.close()
-        abort(404)
+    cur.execute("SELECT usuario_id, nome, status FROM restaurantes WHERE usuario_id=%s", (rid,))
+    rest = cur.fetchone()
 
-    cur.execute("""
-        SELECT ic.nome, ip.quantidade, ip.total_linha
-        FROM itens_pedido ip
-        JOIN itens_cardapio ic ON ic.id = ip.item_cardapio_id
-        WHERE ip.pedido_id=%s
-    """, (pid,))
-    itens = cur.fetchall()
+    # Uma linha pela PK, mantida a cada pedido (resumo.py), em vez de agregar os pedidos aqui
+    numeros = resumo.obter(cur, rid) if rest else None
 
     cur.close()
     db.close()
 
-    return render_template("meu_pedido_detalhe.html", pedido=pedido, itens=itens, user=get_usuario_logado())
+    if not rest:
+        return "Restaurante não encontrado para este usuário.", 400
+
+    return render_template("restaurante_home.html", restaurante=rest, resumo=numeros, user=get_usuario_logado())
+
+
+@app.cli.command("reconstruir-resumo")
+def reconstruir_resumo():
+    """Recalcula resumo_restaurante a partir de pedidos (após criar a tabela ou corrigir dados)."""
+    db = get_db()
+    cur = db.cursor()
+    try:
+        resumo.reconstruir(cur)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+        db.close()
+    print("Resumo dos restaurantes reconstruído.")
+
+
+@app.cli.command("importar-zonas")
+@click.argument("arquivo", type=click.File(encoding="utf-8-sig"))
+def importar_zonas(arquivo):
+    """
+    Substitui as zonas de entrega dos restaurantes presentes no CSV
+    (colunas: restaurante_id, cep_inicio, cep_fim, taxa).
+    """
+    zonas = {}
+    for n, linha in enumerate(csv.DictReader(arquivo), start=2):
+        inicio, fim = frete.normalizar_cep(linha["cep_inicio"]), frete.normalizar_cep(linha["cep_fim"])
+        if inicio is None or fim is None or inicio > fim:
+            raise click.ClickException(f"Linha {n}: faixa de CEP inválida.")
+        zonas.setdefault(int(linha["restaurante_id"]), []).append(
+            (inicio, fim, float(linha["taxa"].replace(",", ".")))
+        )
+
+    db = get_db()
+    cur = db.cursor()
+    try:
+        for rid, faixas in zonas.items():
+            cur.execute("DELETE FROM zonas_entrega WHERE restaurante_id=%s", (rid,))
+            cur.executemany("""
+                INSERT INTO zonas_entrega (restaurante_id, cep_inicio, cep_fim, taxa)
+                VALUES (%s,%s,%s,%s)
+            """, [(rid, *f) for f in faixas])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+        db.close()
+
+    for rid in zonas:
+        invalidar_frete(rid)
+    print(f"Zonas de {len(zonas)} restaurante(s) importadas.")
+
+
+@app.cli.command("indexar-ceps")
+@click.argument("arquivo", type=click.File(encoding="utf-8-sig"))
+def indexar_ceps(arquivo):
+    """
+    Gera o índice de CEPs (CEP_INDICE) a partir de um CSV com as colunas
+    cep, rua, bairro, cidade, estado. Linhas com CEP ou UF inválidos são ignoradas.
+    """
+    linhas, ignoradas = [], 0
+    for linha in csv.DictReader(arquivo):
+        numero = frete.normalizar_cep(linha["cep"])
+        estado = (linha["estado"] or "").strip().upper()
+        if numero is None or estado not in cep.UFS:
+            ignoradas += 1
+            continue
+        linhas.append((
+            numero,
+            " ".join((linha["rua"] or "").split()),
+            " ".join((linha["bairro"] or "").split()),
+            " ".join((linha["cidade"] or "").split()),
+            estado,
+        ))
+
+    qtd = cep.construir_indice(linhas)
+    print(f"{qtd} CEP(s) indexados em {cep.CEP_INDICE} ({ignoradas} linha(s) ignorada(s)). Reinicie os workers.")
+
+
+@app.cli.command("reprocessar-pagamentos")
+def reprocessar_pagamentos():
+    """Reenvia ao gateway os pedidos PENDENTE (ex.: depois de um deploy no meio de cobranças)."""
+    qtd = pagamentos.reenviar_pendentes(idade=0)
+    # O processo da CLI termina aqui: espera a fila de cobranças esvaziar
+    pagamentos.aguardar()
+    print(f"{qtd} pedido(s) reenviado(s) ao gateway.")
 
-# =========================
-# Painel do restaurante (home)
-# =========================
-@app.get("/restaurante")
-def restaurante_home():
+
+@app.post("/restaurante/status")
+def restaurante_alterar_status():
+    """
+    Abre ou fecha o restaurante. SUSPENSO não é escolhido pelo próprio restaurante.
+    """
     bloqueio = exigir_login("RESTAURANTE")
     if bloqueio:
         return bloqueio
 
     rid = session["usuario_id"]
 
+    status = request.form["status"]
+    if status not in ("ABERTO", "FECHADO"):
+        abort(400)
+
     db = get_db()
     cur = db.cursor(dictionary=True)
 
-    cur.execute("SELECT usuario_id, nome, status FROM restaurantes WHERE usuario_id=%s", (rid,))
-    rest = cur.fetchone()
+    try:
+        cur.execute("""
+            UPDATE restaurantes
+            SET status=%s
+            WHERE usuario_id=%s AND status <> 'SUSPENSO'
+        """, (status, rid))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        cur.close()
+        db.close()
+        return f"Erro ao alterar status: {e}", 400
 
     cur.close()
     db.close()
 
-    if not rest:
-        return "Restaurante não encontrado para este usuário.", 400
+    invalidar_home()
+    invalidar_cardapio(rid)
 
-    return render_template("restaurante_home.html", restaurante=rest, user=get_usuario_logado())
+    return redirect(url_for("restaurante_home"))
 
 
 # =========================
@@ -670,23 +1440,38 @@ def restaurante_pedidos():
         return bloqueio
 
     rid = session["usuario_id"]
+    pagina = ler_paginacao()
+    filtro, params = filtro_pagina_sql(pagina)
 
     db = get_db()
     cur = db.cursor(dictionary=True)
 
-    cur.execute("""
-        SELECT p.id, p.realizado_em, p.status_pedido, p.total, p.entregue_em, c.nome AS cliente_nome
+    # Percorre idx_pedidos_rest_realizado (restaurante_id, realizado_em, id) a partir do cursor
+    cur.execute(f"""
+        SELECT p.id, p.realizado_em, p.status_pedido, p.versao, p.total, p.entregue_em, c.nome AS cliente_nome
         FROM pedidos p
         JOIN clientes c ON c.usuario_id = p.cliente_id
-        WHERE p.restaurante_id=%s
-        ORDER BY p.realizado_em DESC
-    """, (rid,))
-    pedidos = cur.fetchall()
+        WHERE p.restaurante_id=%s{filtro} AND p.status_pagamento <> 'PENDENTE'
+        ORDER BY p.realizado_em DESC, p.id DESC
+        LIMIT %s
+    """, (rid, *params, pagina["limite"] + 1))
+    pedidos, proxima_url = fechar_pagina(cur.fetchall(), pagina, "restaurante_pedidos")
 
     cur.close()
     db.close()
 
-    return render_template("painel_pedidos.html", pedidos=pedidos, rid=rid, user=get_usuario_logado())
+    return render_template(
+        "painel_pedidos.html",
+        pedidos=pedidos,
+        proxima_url=proxima_url,
+        status=pagina["status"],
+        rid=rid,
+        transicoes=TRANSICOES,
+        recusados=request.args.get("recusados", type=int),
+        # Eventos a partir daqui: o que mudar entre renderizar e abrir o SSE é recuperado
+        desde=id_evento(),
+        user=get_usuario_logado()
+    )
 
 
 @app.get("/restaurante/pedidos/<int:pid>")
@@ -695,36 +1480,88 @@ def restaurante_pedido_detalhe(pid):
     if bloqueio:
         return bloqueio
 
-    rid = session["usuario_id"]
+    detalhe = detalhe_pedido(pid, restaurante_id=session["usuario_id"])
+    if not detalhe:
+        abort(404)
+    pedido, itens = detalhe
+
+    return responder_detalhe("pedido_detalhe_restaurante.html", pedido, itens, transicoes=TRANSICOES)
+
+
+MAX_LOTE_STATUS = 200
+MENSAGENS_RECUSA = {
+    NAO_ENCONTRADO: ("Pedido não encontrado ou não pertence a este restaurante.", 404),
+    CONFLITO: ("O pedido foi alterado em outro aparelho. Recarregue o painel e tente de novo.", 409),
+    TRANSICAO_INVALIDA: ("O pedido não pode ir para esse status a partir do status atual.", 400),
+    PAGAMENTO_PENDENTE: ("O pagamento do pedido ainda não foi confirmado; por enquanto ele só pode ser cancelado.", 409),
+}
 
+
+def aplicar_transicoes(rid, versoes, status):
+    """
+    Roda transicionar (pedidos.py) numa transação e avisa o painel (SSE) dos pedidos alterados.
+    Retorna (aplicados, recusados) ou levanta a exceção do banco.
+    """
     db = get_db()
     cur = db.cursor(dictionary=True)
 
-    cur.execute("""
-        SELECT p.id, p.realizado_em, p.status_pedido, p.total, p.entregue_em, c.nome AS cliente_nome
-        FROM pedidos p
-        JOIN clientes c ON c.usuario_id = p.cliente_id
-        WHERE p.id=%s AND p.restaurante_id=%s
-    """, (pid, rid))
-    pedido = cur.fetchone()
-
-    if not pedido:
+    try:
+        aplicados, recusados = transicionar(cur, rid, versoes, status)
+        db.commit()
+    except Exception:
+        db.rollback()
         cur.close()
         db.close()
-        abort(404)
-
-    cur.execute("""
-        SELECT ic.nome, ip.quantidade, ip.total_linha
-        FROM itens_pedido ip
-        JOIN itens_cardapio ic ON ic.id = ip.item_cardapio_id
-        WHERE ip.pedido_id=%s
-    """, (pid,))
-    itens = cur.fetchall()
+        raise
 
     cur.close()
     db.close()
 
-    return render_template("pedido_detalhe_restaurante.html", pedido=pedido, itens=itens, user=get_usuario_logado())
+    agora = datetime.now().strftime("%d/%m/%Y %H:%M")
+    for a in aplicados:
+        evento = {"id": a["id"], "status_pedido": status, "versao": a["versao"]}
+        if status == "ENTREGUE":
+            evento["entregue_em"] = agora
+        publicar(canal_restaurante(rid), {"tipo": "status", "pedido": evento})
+
+    return aplicados, recusados
+
+
+def responder_transicao(pid, status, versao):
+    """Resposta das rotas de status de um pedido (JSON para fetch, redirect para formulário)."""
+    rid = session["usuario_id"]
+    if status not in STATUS_PEDIDO:
+        abort(400)
+
+    try:
+        aplicados, recusados = aplicar_transicoes(rid, {pid: versao}, status)
+    except Exception as e:
+        return f"Erro ao atualizar pedido: {e}", 400
+
+    if recusados:
+        mensagem, codigo = MENSAGENS_RECUSA[recusados[pid]]
+        if quer_json():
+            return jsonify({"erro": mensagem, "motivo": recusados[pid]}), codigo
+        return mensagem, codigo
+
+    if quer_json():
+        return jsonify({"id": pid, "status_pedido": status, "versao": aplicados[0]["versao"]})
+    if request.form.get("voltar") == "detalhe":
+        return redirect(url_for("restaurante_pedido_detalhe", pid=pid))
+    return redirect(url_for("restaurante_pedidos"))
+
+
+@app.post("/restaurante/pedidos/<int:pid>/status")
+def restaurante_pedido_status(pid):
+    """
+    Muda o status de um pedido. `versao` é a versão que o aparelho exibiu; se outro
+    aparelho mudou o pedido antes, a resposta é 409 em vez de sobrescrever.
+    """
+    bloqueio = exigir_login("RESTAURANTE")
+    if bloqueio:
+        return bloqueio
+
+    return responder_transicao(pid, request.form.get("status"), request.form.get("versao", type=int))
 
 
 @app.post("/restaurante/pedidos/<int:pid>/entregar")
@@ -733,42 +1570,359 @@ def restaurante_marcar_entregue(pid):
     if bloqueio:
         return bloqueio
 
+    return responder_transicao(pid, "ENTREGUE", request.form.get("versao", type=int))
+
+
+@app.post("/restaurante/pedidos/status")
+def restaurante_pedidos_status_lote():
+    """
+    Muda o status de vários pedidos de uma vez (um único UPDATE).
+
+    Formulário: status + campos "pedido" no formato "<id>:<versao>".
+    JSON: {"status": "PREPARANDO", "pedidos": {"<id>": <versao ou null>}}.
+    Pedidos recusados (conflito, transição inválida) não impedem os demais.
+    """
+    bloqueio = exigir_login("RESTAURANTE")
+    if bloqueio:
+        return bloqueio
+
     rid = session["usuario_id"]
 
-    db = get_db()
-    cur = db.cursor(dictionary=True)
+    try:
+        if request.is_json:
+            dados = request.get_json()
+            status = dados.get("status")
+            versoes = {int(pid): (None if v is None else int(v)) for pid, v in dados.get("pedidos", {}).items()}
+        else:
+            status = request.form.get("status")
+            versoes = {}
+            for valor in request.form.getlist("pedido"):
+                pid, _, versao = valor.partition(":")
+                versoes[int(pid)] = int(versao) if versao else None
+    except (AttributeError, TypeError, ValueError):
+        abort(400)
+
+    if status not in STATUS_PEDIDO or len(versoes) > MAX_LOTE_STATUS:
+        abort(400)
 
     try:
-        cur.execute("""
-            UPDATE pedidos
-            SET status_pedido='ENTREGUE', entregue_em=NOW()
-            WHERE id=%s AND restaurante_id=%s
-              AND status_pedido <> 'CANCELADO'
-        """, (pid, rid))
+        aplicados, recusados = aplicar_transicoes(rid, versoes, status)
+    except Exception as e:
+        return f"Erro ao atualizar pedidos: {e}", 400
 
-        if cur.rowcount == 0:
-            db.rollback()
-            cur.close()
-            db.close()
-            return "Pedido não encontrado, não pertence a este restaurante ou não pode ser atualizado.", 400
+    if quer_json() or request.is_json:
+        return jsonify({
+            "status_pedido": status,
+            "aplicados": [{"id": a["id"], "versao": a["versao"]} for a in aplicados],
+            "recusados": {str(pid): motivo for pid, motivo in recusados.items()},
+        })
+    return redirect(url_for("restaurante_pedidos", recusados=len(recusados) or None))
 
-        db.commit()
 
-    except Exception as e:
-        db.rollback()
-        cur.close()
-        db.close()
-        return f"Erro ao atualizar pedido: {e}", 400
+SSE_DURACAO_MAX = int(os.getenv("SSE_DURACAO_MAX", "300"))
+SSE_KEEPALIVE = 10
+# Ao reconectar, o painel recupera do banco o que perdeu até esse tempo (s); mais que
+# isso (ou mais que SSE_MAX_RECUPERADOS pedidos), pede para recarregar a página
+SSE_RECUPERACAO_MAX = int(os.getenv("SSE_RECUPERACAO_MAX", "600"))
+SSE_MAX_RECUPERADOS = 100
+# Folga da recuperação (s): relógios de workers diferentes e commits que terminam
+# depois do UPDATE que marcou atualizado_em
+SSE_MARGEM = 5
+
+
+def eventos_perdidos(rid, ultimo_id):
+    """
+    Eventos do painel desde `ultimo_id` (id_evento, em ms), refeitos a partir de
+    pedidos.atualizado_em. Retorna a lista de eventos ou None se o painel ficou fora
+    tempo demais e precisa recarregar. Pode repetir eventos já entregues: o painel
+    ignora pedido novo que já está na tabela e status é idempotente.
+    """
+    if id_evento() - ultimo_id > SSE_RECUPERACAO_MAX * 1000:
+        return None
 
+    # Do primário: numa réplica atrasada justamente os últimos pedidos faltariam
+    db = get_db(primario=True)
+    cur = db.cursor(dictionary=True)
+    cur.execute("""
+        SELECT p.id, p.status_pedido, p.versao, p.total, p.realizado_em, p.entregue_em,
+               c.nome AS cliente_nome
+        FROM pedidos p
+        JOIN clientes c ON c.usuario_id = p.cliente_id
+        WHERE p.restaurante_id=%s AND p.atualizado_em >= FROM_UNIXTIME(%s)
+          AND p.status_pagamento <> 'PENDENTE'
+        ORDER BY p.atualizado_em, p.id
+        LIMIT %s
+    """, (rid, ultimo_id / 1000 - SSE_MARGEM, SSE_MAX_RECUPERADOS + 1))
+    linhas = cur.fetchall()
     cur.close()
     db.close()
+    if len(linhas) > SSE_MAX_RECUPERADOS:
+        return None
 
-    return redirect(url_for("restaurante_pedidos"))
+    eventos = []
+    for p in linhas:
+        status = {"id": p["id"], "status_pedido": p["status_pedido"], "versao": p["versao"]}
+        if p["entregue_em"]:
+            status["entregue_em"] = p["entregue_em"].strftime("%d/%m/%Y %H:%M")
+        eventos.append({"tipo": "status", "pedido": status})
+        if p["status_pedido"] == "ACEITO":
+            eventos.append({"tipo": "novo_pedido", "pedido": {
+                "id": p["id"],
+                "cliente_nome": p["cliente_nome"],
+                "realizado_em": p["realizado_em"].strftime("%d/%m/%Y %H:%M"),
+                "status_pedido": p["status_pedido"],
+                "versao": p["versao"],
+                "total": float(p["total"]),
+            }})
+    return eventos
+
+
+# =========================
+# Exportação de pedidos (contabilidade)
+# =========================
+LOTE_EXPORTACAO = int(os.getenv("PEDIDOS_LOTE_EXPORTACAO", "1000"))
+MAX_DIAS_EXPORTACAO = 366
+# Tempo (s) que o MySQL espera o worker ler o resultado; o padrão (60) derruba exportações
+# grandes enviadas a clientes lentos
+TIMEOUT_ESCRITA_EXPORTACAO = int(os.getenv("PEDIDOS_TIMEOUT_EXPORTACAO", "600"))
+COLUNAS_EXPORTACAO = (
+    "pedido_id", "realizado_em", "entregue_em", "status_pedido", "metodo_pagamento", "status_pagamento",
+    "subtotal", "taxa_entrega", "total", "item_id", "item_nome", "quantidade", "preco_unitario", "total_linha",
+)
+
+
+def ler_periodo():
+    """?de=AAAA-MM-DD&ate=AAAA-MM-DD (inclusive); padrão: últimos 30 dias."""
+    try:
+        ate = datetime.strptime(request.args["ate"], "%Y-%m-%d") if request.args.get("ate") else datetime.now()
+        de = datetime.strptime(request.args["de"], "%Y-%m-%d") if request.args.get("de") else ate - timedelta(days=30)
+    except ValueError:
+        abort(400)
+    de = de.replace(hour=0, minute=0, second=0, microsecond=0)
+    ate = ate.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    if de >= ate or (ate - de).days > MAX_DIAS_EXPORTACAO:
+        abort(400)
+    return de, ate
+
+
+@app.get("/restaurante/pedidos/exportar")
+def restaurante_pedidos_exportar():
+    """
+    Pedidos do período com os itens, em CSV (uma linha por item) ou NDJSON (?formato=json,
+    um pedido por linha). O cursor é sem buffer: as linhas vêm do MySQL conforme a resposta
+    é enviada, lote a lote, e a memória do worker não cresce com o período.
+    """
+    bloqueio = exigir_login("RESTAURANTE")
+    if bloqueio:
+        return bloqueio
+
+    formato = request.args.get("formato", "csv")
+    if formato not in ("csv", "json"):
+        abort(400)
+
+    rid = session["usuario_id"]
+    de, ate = ler_periodo()
+
+    def linhas_csv(rows):
+        buf = io.StringIO()
+        escritor = csv.writer(buf)
+        for r in rows:
+            escritor.writerow([
+                r["pedido_id"], r["realizado_em"], r["entregue_em"] or "", r["status_pedido"],
+                r["metodo_pagamento"], r["status_pagamento"], r["subtotal"], r["taxa_entrega"], r["total"],
+                r["item_id"], r["item_nome"], r["quantidade"], r["preco_unitario"], r["total_linha"],
+            ])
+        return buf.getvalue()
+
+    def pedido_json(pedido, itens):
+        return json.dumps({
+            "id": pedido["pedido_id"],
+            "realizado_em": pedido["realizado_em"].isoformat(),
+            "entregue_em": pedido["entregue_em"].isoformat() if pedido["entregue_em"] else None,
+            "status_pedido": pedido["status_pedido"],
+            "metodo_pagamento": pedido["metodo_pagamento"],
+            "status_pagamento": pedido["status_pagamento"],
+            "subtotal": float(pedido["subtotal"]),
+            "taxa_entrega": float(pedido["taxa_entrega"]),
+            "total": float(pedido["total"]),
+            "itens": [
+                {"id": i["item_id"], "nome": i["item_nome"], "quantidade": i["quantidade"],
+                 "preco_unitario": float(i["preco_unitario"]), "total_linha": float(i["total_linha"])}
+                for i in itens
+            ],
+        }, ensure_ascii=False) + "\n"
+
+    def gerar():
+        db = get_db()
+        cur = db.cursor(dictionary=True)  # sem buffer (padrão do mysql-connector)
+        completo = False
+        try:
+            cur.execute("SET SESSION net_write_timeout = %s", (TIMEOUT_ESCRITA_EXPORTACAO,))
+            # Percorre idx_pedidos_rest_realizado na ordem do índice (sem filesort);
+            # os itens de cada pedido vêm juntos, pelo idx_itenspedido_pedido
+            cur.execute("""
+                SELECT p.id AS pedido_id, p.realizado_em, p.entregue_em, p.status_pedido,
+                       p.metodo_pagamento, p.status_pagamento, p.subtotal, p.taxa_entrega, p.total,
+                       ip.item_cardapio_id AS item_id, ic.nome AS item_nome, ip.quantidade,
+                       ip.preco_unitario, ip.total_linha
+                FROM pedidos p
+                JOIN itens_pedido ip ON ip.pedido_id = p.id
+                JOIN itens_cardapio ic ON ic.id = ip.item_cardapio_id
+                WHERE p.restaurante_id=%s AND p.realizado_em >= %s AND p.realizado_em < %s
+                ORDER BY p.realizado_em, p.id
+            """, (rid, de, ate))
+
+            if formato == "csv":
+                yield ",".join(COLUNAS_EXPORTACAO) + "\r\n"
+            pedido, itens = None, []  # NDJSON: pedido em montagem (as linhas dele são consecutivas)
+            while True:
+                rows = cur.fetchmany(LOTE_EXPORTACAO)
+                if not rows:
+                    break
+                if formato == "csv":
+                    yield linhas_csv(rows)
+                    continue
+                partes = []
+                for r in rows:
+                    if pedido and r["pedido_id"] != pedido["pedido_id"]:
+                        partes.append(pedido_json(pedido, itens))
+                        itens = []
+                    pedido = r
+                    itens.append(r)
+                yield "".join(partes)
+            if pedido:
+                yield pedido_json(pedido, itens)
+            completo = True
+        finally:
+            if completo:
+                cur.close()
+                # Conexão volta ao pool com o timeout padrão
+                cur = db.cursor()
+                cur.execute("SET SESSION net_write_timeout = DEFAULT")
+                cur.close()
+            else:
+                # Download interrompido (ou erro): fecha o socket e descarta a conexão;
+                # cur.close() leria do MySQL todo o resto do resultado antes de voltar
+                db.invalidar()
+                db.shutdown()
+            db.close()
+
+    extensao, mimetype = ("csv", "text/csv") if formato == "csv" else ("ndjson", "application/x-ndjson")
+    nome = f"pedidos_{de:%Y%m%d}_{(ate - timedelta(days=1)):%Y%m%d}.{extensao}"
+    return Response(
+        stream_with_context(gerar()),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={nome}"},
+    )
+
+
+@app.get("/restaurante/pedidos/eventos")
+def restaurante_pedidos_eventos():
+    """
+    Server-Sent Events com pedidos novos e mudanças de status do restaurante logado.
+
+    Repassa o que pagamentos.processar/aplicar_transicoes publicam; o banco só é
+    consultado na conexão, para recuperar o que o painel perdeu (eventos_perdidos).
+    No worker gevent (gunicorn.conf.py) cada conexão aberta é só um greenlet esperando;
+    o stream termina após SSE_DURACAO_MAX segundos e o navegador reconecta sozinho.
+    """
+    bloqueio = exigir_login("RESTAURANTE")
+    if bloqueio:
+        return bloqueio
+
+    rid = session["usuario_id"]
+    # Último evento recebido (o navegador manda Last-Event-ID ao reconectar) ou, na
+    # primeira conexão, a hora em que a página foi renderizada
+    ultimo_id = request.headers.get("Last-Event-ID", type=int) or request.args.get("desde", type=int)
+
+    # Assina antes de consultar o banco: o que for publicado no meio chega pelos dois
+    # caminhos (repetido), nunca por nenhum
+    assinatura = get_broker().assinar(canal_restaurante(rid))
+    marca = id_evento()
+    try:
+        perdidos = eventos_perdidos(rid, ultimo_id) if ultimo_id else []
+    except Exception:
+        assinatura.fechar()
+        raise
+
+    def gerar():
+        fim = time.monotonic() + SSE_DURACAO_MAX
+        try:
+            yield f"retry: 3000\nid: {marca}\n\n"
+            if perdidos is None:
+                yield "event: desatualizado\ndata: {}\n\n"
+            for evento in perdidos or ():
+                yield f"event: {evento['tipo']}\ndata: {json.dumps(evento['pedido'])}\n\n"
+            while True:
+                restante = fim - time.monotonic()
+                if restante <= 0:
+                    break
+                evento = assinatura.proximo(timeout=min(SSE_KEEPALIVE, restante))
+                if evento is None:
+                    # Sem eventos: avança o Last-Event-ID para a reconexão não recuperar à toa
+                    yield f"id: {id_evento()}\n: keepalive\n\n"
+                    continue
+                yield f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {json.dumps(evento['pedido'])}\n\n"
+        finally:
+            assinatura.fechar()
+
+    return Response(
+        stream_with_context(gerar()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # =========================
 # Cardápio do restaurante (CRUD) - EXIGE RESTAURANTE LOGADO
 # =========================
+def validar_item_cardapio(nome, descricao, preco, disponivel, estoque=None):
+    """
+    Valida um item do cardápio (formulário ou importação em lote).
+    estoque vazio/None = sem controle de estoque; com 0 o item fica indisponível.
+    Retorna (item, None) ou (None, mensagem de erro).
+    """
+    nome = (nome or "").strip()
+    descricao = (descricao or "").strip()
+    if not nome:
+        return None, "nome é obrigatório."
+    if len(nome) > 140:
+        return None, "nome com mais de 140 caracteres."
+
+    try:
+        preco_val = round(float(str(preco).strip().replace(",", ".")), 2)
+    except (TypeError, ValueError):
+        return None, "preço inválido."
+    if not preco_val > 0:
+        return None, "preço deve ser maior que zero."
+    if preco_val >= 10 ** 8:
+        return None, "preço acima do permitido."
+
+    estoque = str(estoque if estoque is not None else "").strip()
+    if estoque:
+        if not estoque.isdigit() or int(estoque) >= 10 ** 9:
+            return None, "estoque deve ser um número inteiro (ou vazio, para não controlar)."
+        estoque = int(estoque)
+        if estoque == 0:
+            disponivel = 0
+    else:
+        estoque = None
+
+    return {
+        "nome": nome, "descricao": descricao or None, "preco_base": preco_val,
+        "disponivel": disponivel, "estoque": estoque,
+    }, None
+
+
+def item_do_restaurante(cur, item_id, rid):
+    """
+    True se o item existe e é do restaurante. Para quando um UPDATE volta rowcount 0:
+    sem a flag FOUND_ROWS ele conta só linhas alteradas, e salvar sem mudar nada também dá 0.
+    """
+    cur.execute("SELECT 1 FROM itens_cardapio WHERE id=%s AND restaurante_id=%s", (item_id, rid))
+    return cur.fetchone() is not None
+
+
 @app.get("/restaurante/cardapio")
 def restaurante_cardapio():
     bloqueio = exigir_login("RESTAURANTE")
@@ -781,7 +1935,7 @@ def restaurante_cardapio():
     cur = db.cursor(dictionary=True)
 
     cur.execute("""
-        SELECT id, nome, descricao, preco_base, disponivel
+        SELECT id, nome, descricao, preco_base, disponivel, estoque
         FROM itens_cardapio
         WHERE restaurante_id=%s
         ORDER BY nome
@@ -811,30 +1965,26 @@ def restaurante_cardapio_criar():
 
     rid = session["usuario_id"]
 
-    nome = request.form["nome"].strip()
-    descricao = request.form.get("descricao", "").strip()
-    preco = request.form["preco_base"].strip()
-    disponivel = 1 if request.form.get("disponivel") == "on" else 0
-
-    if not nome:
-        return "Erro: nome é obrigatório.", 400
-
-    try:
-        preco_val = float(preco)
-        if preco_val <= 0:
-            return "Erro: preço deve ser maior que zero.", 400
-    except:
-        return "Erro: preço inválido.", 400
+    item, erro = validar_item_cardapio(
+        request.form["nome"],
+        request.form.get("descricao", ""),
+        request.form["preco_base"],
+        1 if request.form.get("disponivel") == "on" else 0,
+        request.form.get("estoque"),
+    )
+    if erro:
+        return f"Erro: {erro}", 400
 
     db = get_db()
     cur = db.cursor(dictionary=True)
 
     try:
         cur.execute("""
-            INSERT INTO itens_cardapio (restaurante_id, nome, descricao, preco_base, disponivel)
-            VALUES (%s,%s,%s,%s,%s)
-        """, (rid, nome, descricao or None, preco_val, disponivel))
+            INSERT INTO itens_cardapio (restaurante_id, nome, descricao, preco_base, disponivel, estoque)
+            VALUES (%s,%s,%s,%s,%s,%s)
+        """, (rid, item["nome"], item["descricao"], item["preco_base"], item["disponivel"], item["estoque"]))
         db.commit()
+        invalidar_cardapio(rid)
     except Exception as e:
         db.rollback()
         cur.close()
@@ -859,7 +2009,7 @@ def restaurante_cardapio_editar_form(item_id):
     cur = db.cursor(dictionary=True)
 
     cur.execute("""
-        SELECT id, nome, descricao, preco_base, disponivel
+        SELECT id, nome, descricao, preco_base, disponivel, estoque
         FROM itens_cardapio
         WHERE id=%s AND restaurante_id=%s
     """, (item_id, rid))
@@ -882,38 +2032,48 @@ def restaurante_cardapio_atualizar(item_id):
 
     rid = session["usuario_id"]
 
-    nome = request.form["nome"].strip()
-    descricao = request.form.get("descricao", "").strip()
-    preco = request.form["preco_base"].strip()
-    disponivel = 1 if request.form.get("disponivel") == "on" else 0
-
-    if not nome:
-        return "Erro: nome é obrigatório.", 400
-
-    try:
-        preco_val = float(preco)
-        if preco_val <= 0:
-            return "Erro: preço deve ser maior que zero.", 400
-    except:
-        return "Erro: preço inválido.", 400
+    item, erro = validar_item_cardapio(
+        request.form["nome"],
+        request.form.get("descricao", ""),
+        request.form["preco_base"],
+        1 if request.form.get("disponivel") == "on" else 0,
+        request.form.get("estoque"),
+    )
+    if erro:
+        return f"Erro: {erro}", 400
+
+    # O estoque do formulário é o de quando ele abriu; desde então os checkouts baixaram
+    # unidades (estoque.reservar). Só mexe no estoque se o restaurante alterou o campo,
+    # e então aplica a diferença sobre o valor atual, não o número digitado.
+    original = (request.form.get("estoque_original") or "").strip()
+    original = int(original) if original.isdigit() else None
+    if item["estoque"] == original:
+        ajuste_estoque, params_estoque = "", ()
+    elif item["estoque"] is None or original is None:
+        # Liga ou desliga o controle de estoque: vale o número digitado
+        ajuste_estoque, params_estoque = "estoque=%s,", (item["estoque"],)
+    else:
+        ajuste_estoque = "estoque=IF(estoque IS NULL, %s, GREATEST(estoque + %s, 0)),"
+        params_estoque = (item["estoque"], item["estoque"] - original)
 
     db = get_db()
     cur = db.cursor(dictionary=True)
 
     try:
-        cur.execute("""
+        # SET da esquerda para a direita: disponivel já enxerga o estoque ajustado
+        cur.execute(f"""
             UPDATE itens_cardapio
-            SET nome=%s, descricao=%s, preco_base=%s, disponivel=%s
+            SET nome=%s, descricao=%s, preco_base=%s, {ajuste_estoque}
+                disponivel=IF(estoque = 0, 0, %s)
             WHERE id=%s AND restaurante_id=%s
-        """, (nome, descricao or None, preco_val, disponivel, item_id, rid))
-
-        if cur.rowcount == 0:
-            db.rollback()
-            cur.close()
-            db.close()
-            abort(404)
+        """, (
+            item["nome"], item["descricao"], item["preco_base"], *params_estoque,
+            item["disponivel"], item_id, rid,
+        ))
+        encontrado = cur.rowcount > 0 or item_do_restaurante(cur, item_id, rid)
 
         db.commit()
+        invalidar_cardapio(rid)
     except Exception as e:
         db.rollback()
         cur.close()
@@ -923,6 +2083,10 @@ def restaurante_cardapio_atualizar(item_id):
     cur.close()
     db.close()
 
+    # Fora do try: o 404 não pode virar "Erro ao atualizar item"
+    if not encontrado:
+        abort(404)
+
     return redirect(url_for("restaurante_cardapio"))
 
 
@@ -930,7 +2094,8 @@ def restaurante_cardapio_atualizar(item_id):
 def restaurante_cardapio_desativar(item_id):
     """
     Em vez de DELETE (que pode quebrar por FK em itens_pedido),
-    desativamos: disponivel=0.
+    desativamos: disponivel=0. O estoque deixa de ser controlado, para um
+    cancelamento não devolver unidades e reabrir o item.
     """
     bloqueio = exigir_login("RESTAURANTE")
     if bloqueio:
@@ -944,17 +2109,13 @@ def restaurante_cardapio_desativar(item_id):
     try:
         cur.execute("""
             UPDATE itens_cardapio
-            SET disponivel=0
+            SET disponivel=0, estoque=NULL
             WHERE id=%s AND restaurante_id=%s
         """, (item_id, rid))
-
-        if cur.rowcount == 0:
-            db.rollback()
-            cur.close()
-            db.close()
-            abort(404)
+        encontrado = cur.rowcount > 0 or item_do_restaurante(cur, item_id, rid)
 
         db.commit()
+        invalidar_cardapio(rid)
 
     except Exception as e:
         db.rollback()
@@ -965,8 +2126,311 @@ def restaurante_cardapio_desativar(item_id):
     cur.close()
     db.close()
 
+    if not encontrado:
+        abort(404)
+
     return redirect(url_for("restaurante_cardapio"))
 
 
+# =========================
+# Cardápio em lote (importação / exportação)
+# =========================
+LOTE_IMPORTACAO = int(os.getenv("CARDAPIO_LOTE_IMPORTACAO", "500"))
+MAX_ERROS_IMPORTACAO = 500  # erros detalhados na resposta; além disso só a contagem
+COLUNAS_CARDAPIO = ("id", "nome", "descricao", "preco_base", "disponivel", "estoque")
+
+
+def ler_importacao():
+    """
+    Lê em streaming o arquivo enviado (campo "arquivo") ou o corpo do request:
+    CSV com cabeçalho ou NDJSON (um objeto JSON por linha).
+    Gera (número da linha, dict) ou (número da linha, mensagem de erro).
+    """
+    arquivo = request.files.get("arquivo")
+    if arquivo:
+        fluxo, nome, tipo = arquivo.stream, (arquivo.filename or "").lower(), arquivo.mimetype
+    else:
+        fluxo, nome, tipo = io.BufferedReader(request.stream), "", request.mimetype
+    texto = io.TextIOWrapper(fluxo, encoding="utf-8-sig", newline="")
+
+    if "json" in tipo or nome.endswith((".json", ".ndjson", ".jsonl")):
+        for n, linha in enumerate(texto, start=1):
+            if not linha.strip():
+                continue
+            try:
+                dados = json.loads(linha)
+            except ValueError:
+                yield n, "JSON inválido."
+                continue
+            yield n, dados if isinstance(dados, dict) else "esperado um objeto JSON por linha."
+    else:
+        leitor = csv.DictReader(texto)
+        for dados in leitor:
+            yield leitor.line_num, {(k or "").strip().lower(): v for k, v in dados.items()}
+
+
+def item_da_importacao(dados):
+    """(id ou None, item validado, erro) de uma linha importada."""
+    id_txt = str(dados.get("id") or "").strip()
+    try:
+        item_id = int(id_txt) if id_txt else None
+    except ValueError:
+        return None, None, "id inválido."
+
+    disponivel = dados.get("disponivel")
+    disponivel = "1" if disponivel is None or disponivel == "" else str(disponivel).strip().lower()
+    if disponivel in ("1", "true", "sim", "s"):
+        disponivel = 1
+    elif disponivel in ("0", "false", "não", "nao", "n"):
+        disponivel = 0
+    else:
+        return None, None, "disponivel deve ser 1 ou 0."
+
+    item, erro = validar_item_cardapio(
+        dados.get("nome"), dados.get("descricao"), dados.get("preco_base"), disponivel, dados.get("estoque")
+    )
+    if item and "estoque" not in dados:
+        # Arquivo sem a coluna estoque: o estoque atual do item fica como está
+        del item["estoque"]
+    return item_id, item, erro
+
+
+def gravar_lote_cardapio(cur, rid, lote):
+    """
+    Upsert do lote: linhas com id atualizam o item existente, linhas sem id (id NULL)
+    são inseridas. Um comando para as linhas que trazem estoque (grava o valor do
+    arquivo) e outro para as que não trazem (mantêm o estoque atual). Item com estoque
+    zerado continua indisponível, mesmo que o arquivo diga disponivel=1.
+    """
+    com_estoque = [(item_id, item) for item_id, item in lote if "estoque" in item]
+    sem_estoque = [(item_id, item) for item_id, item in lote if "estoque" not in item]
+
+    for linhas, grava_estoque in ((com_estoque, True), (sem_estoque, False)):
+        if not linhas:
+            continue
+        coluna = "estoque, " if grava_estoque else ""
+        atualiza = "estoque=VALUES(estoque), " if grava_estoque else ""
+        marcador = "(%s,%s,%s,%s,%s,%s,%s)" if grava_estoque else "(%s,%s,%s,%s,%s,%s)"
+        params = []
+        for item_id, item in linhas:
+            params += [item_id, rid, item["nome"], item["descricao"], item["preco_base"]]
+            if grava_estoque:
+                params.append(item["estoque"])
+            params.append(item["disponivel"])
+        # Atribuições da esquerda para a direita: disponivel já enxerga o estoque novo.
+        # VALUES(coluna) e não o alias "AS novo" (só existe a partir do MySQL 8.0.19 e não no MariaDB)
+        cur.execute(f"""
+            INSERT INTO itens_cardapio (id, restaurante_id, nome, descricao, preco_base, {coluna}disponivel)
+            VALUES {",".join([marcador] * len(linhas))}
+            ON DUPLICATE KEY UPDATE
+              nome=VALUES(nome), descricao=VALUES(descricao), preco_base=VALUES(preco_base),
+              {atualiza}disponivel=IF(estoque = 0, 0, VALUES(disponivel))
+        """, tuple(params))
+
+
+@app.get("/restaurante/cardapio/importar")
+def restaurante_cardapio_importar_form():
+    bloqueio = exigir_login("RESTAURANTE")
+    if bloqueio:
+        return bloqueio
+
+    return render_template("restaurante_cardapio_importar.html", resultado=None, user=get_usuario_logado())
+
+
+@app.post("/restaurante/cardapio/importar")
+def restaurante_cardapio_importar():
+    """
+    Importa o cardápio em lote. Cada linha é validada como no formulário de item;
+    linhas com `id` (ou com o mesmo nome de um item existente) atualizam o item,
+    as demais criam itens novos. Grava em transações de LOTE_IMPORTACAO linhas e
+    devolve os erros por linha; linhas válidas são gravadas mesmo se outras falharem.
+    """
+    bloqueio = exigir_login("RESTAURANTE")
+    if bloqueio:
+        return bloqueio
+
+    rid = session["usuario_id"]
+
+    db = get_db()
+    cur = db.cursor(dictionary=True)
+
+    cur.execute("SELECT id, nome FROM itens_cardapio WHERE restaurante_id=%s ORDER BY id", (rid,))
+    ids_por_nome = {}
+    ids_do_restaurante = set()
+    for row in cur.fetchall():
+        ids_por_nome.setdefault(row["nome"].casefold(), row["id"])
+        ids_do_restaurante.add(row["id"])
+
+    resultado = {"inseridos": 0, "atualizados": 0, "erros": [], "total_erros": 0}
+
+    def erro(linha, mensagem):
+        resultado["total_erros"] += 1
+        if len(resultado["erros"]) < MAX_ERROS_IMPORTACAO:
+            resultado["erros"].append({"linha": linha, "erro": mensagem})
+
+    def gravar(lote):
+        """lote: {chave: (linha, id, item)}; a mesma chave repetida no arquivo vale a última."""
+        if not lote:
+            return
+        linhas = list(lote.values())
+        try:
+            gravar_lote_cardapio(cur, rid, [(item_id, item) for _, item_id, item in linhas])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            for linha, _, _ in linhas:
+                erro(linha, f"erro ao gravar: {e}")
+            return
+
+        novos = [item["nome"] for _, item_id, item in linhas if item_id is None]
+        resultado["inseridos"] += len(novos)
+        resultado["atualizados"] += len(linhas) - len(novos)
+        if novos:
+            # Ids dos itens recém-criados, para o mesmo nome mais adiante no arquivo virar atualização
+            cur.execute(f"""
+                SELECT id, nome FROM itens_cardapio
+                WHERE restaurante_id=%s AND nome IN ({",".join(["%s"] * len(novos))})
+                ORDER BY id
+            """, (rid, *novos))
+            for row in cur.fetchall():
+                ids_por_nome.setdefault(row["nome"].casefold(), row["id"])
+                ids_do_restaurante.add(row["id"])
+
+    lote = {}
+    try:
+        for linha, dados in ler_importacao():
+            if isinstance(dados, str):
+                erro(linha, dados)
+                continue
+
+            item_id, item, msg = item_da_importacao(dados)
+            if msg:
+                erro(linha, msg)
+                continue
+            if item_id is None:
+                item_id = ids_por_nome.get(item["nome"].casefold())
+            elif item_id not in ids_do_restaurante:
+                erro(linha, "item não encontrado neste restaurante.")
+                continue
+
+            chave = item_id if item_id is not None else item["nome"].casefold()
+            lote[chave] = (linha, item_id, item)
+            if len(lote) >= LOTE_IMPORTACAO:
+                gravar(lote)
+                lote = {}
+    except (csv.Error, UnicodeDecodeError) as e:
+        erro(None, f"arquivo inválido: {e}")
+
+    gravar(lote)
+
+    cur.close()
+    db.close()
+
+    if resultado["inseridos"] or resultado["atualizados"]:
+        invalidar_cardapio(rid)
+
+    if quer_json():
+        return jsonify(resultado)
+    return render_template("restaurante_cardapio_importar.html", resultado=resultado, user=get_usuario_logado())
+
+
+@app.get("/restaurante/cardapio/exportar")
+def restaurante_cardapio_exportar():
+    """
+    Cardápio completo (inclusive itens desativados) em CSV ou NDJSON (?formato=json),
+    no mesmo formato aceito pela importação. Enviado em streaming, lote a lote.
+    """
+    bloqueio = exigir_login("RESTAURANTE")
+    if bloqueio:
+        return bloqueio
+
+    formato = request.args.get("formato", "csv")
+    if formato not in ("csv", "json"):
+        abort(400)
+
+    rid = session["usuario_id"]
+
+    def gerar():
+        db = get_db()
+        cur = db.cursor(dictionary=True)
+        try:
+            cur.execute("""
+                SELECT id, nome, descricao, preco_base, disponivel, estoque
+                FROM itens_cardapio
+                WHERE restaurante_id=%s
+                ORDER BY id
+            """, (rid,))
+
+            if formato == "csv":
+                yield ",".join(COLUNAS_CARDAPIO) + "\r\n"
+            while True:
+                rows = cur.fetchmany(LOTE_IMPORTACAO)
+                if not rows:
+                    break
+                buf = io.StringIO()
+                if formato == "csv":
+                    escritor = csv.writer(buf)
+                    for r in rows:
+                        escritor.writerow([
+                            r["id"], r["nome"], r["descricao"] or "", r["preco_base"], r["disponivel"],
+                            "" if r["estoque"] is None else r["estoque"],
+                        ])
+                else:
+                    for r in rows:
+                        r["preco_base"] = float(r["preco_base"])
+                        buf.write(json.dumps(r, ensure_ascii=False) + "\n")
+                yield buf.getvalue()
+        finally:
+            cur.close()
+            db.close()
+
+    extensao, mimetype = ("csv", "text/csv") if formato == "csv" else ("ndjson", "application/x-ndjson")
+    return Response(
+        stream_with_context(gerar()),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=cardapio.{extensao}"},
+    )
+
+
+# =========================
+# Status operacional
+# =========================
+# Tokens das rotas operacionais; sem eles /status/pool e /metrics respondem 403
+STATUS_TOKEN = os.getenv("STATUS_TOKEN")
+METRICAS_TOKEN = os.getenv("METRICAS_TOKEN")
+
+
+@app.get("/status/pool")
+def status_pool():
+    """
+    Métricas do pool de conexões deste worker (em uso, livres, espera, timeouts),
+    para dimensionar MYSQL_POOL_SIZE de acordo com a quantidade de workers.
+    """
+    bloqueio = exigir_token(STATUS_TOKEN)
+    if bloqueio:
+        return bloqueio
+
+    estatisticas = get_pool().estatisticas()
+    estatisticas["replicas"] = [r.estatisticas() for r in get_replicas()]
+    return jsonify(estatisticas)
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Métricas deste worker no formato do Prometheus: requests e latência por rota,
+    comandos SQL por rota (quantidade, linhas, lentos, histograma de duração e
+    de comandos por request) e o estado do pool de conexões.
+    """
+    bloqueio = exigir_token(METRICAS_TOKEN)
+    if bloqueio:
+        return bloqueio
+
+    return Response(
+        metricas.exportar(pool=get_pool().estatisticas(), replicas=[r.estatisticas() for r in get_replicas()]),
+        mimetype="text/plain; version=0.0.4",
+    )
+
+
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""
+Benchmark: reserva de estoque com centenas de checkouts simultâneos do mesmo item.
+
+Compara duas formas de baixar o estoque dentro da transação do checkout:
+  for update   SELECT ... FOR UPDATE no começo, confere, faz o resto do checkout e dá
+               UPDATE no estoque
+  condicional  como o finalizar_checkout: faz o resto do checkout e só no fim
+               estoque.reservar() (UPDATE ... WHERE estoque >= qtd)
+
+"O resto do checkout" é um INSERT numa tabela TEMPORARY mais --espera ms (as outras idas
+ao banco do finalizar_checkout). O resumo do restaurante não entra: o checkout não o toca,
+ele só é atualizado quando o pagamento é aprovado (pagamentos.processar). Cada cliente
+repete o checkout até o item esgotar; no fim confere que nada foi vendido além do estoque.
+
+Cria um item de cardápio "bench_estoque" no primeiro restaurante (ou --restaurante) e o
+apaga no fim. Cada cliente abre uma conexão própria: o max_connections do MySQL precisa
+comportar --clientes.
+
+Uso:
+    python benchmarks/bench_estoque.py [--clientes 200] [--estoque 2000] [--espera 2]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+import mysql.connector
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import estoque  # noqa: E402
+from db import _config_conexao, get_db  # noqa: E402
+
+
+def resto_do_checkout(cur, espera):
+    cur.execute("INSERT INTO bench_pedidos (criado_em) VALUES (NOW(6))")
+    time.sleep(espera / 1000)
+
+
+def com_for_update(cur, restaurante_id, item_id, qtd, espera):
+    cur.execute("SELECT estoque FROM itens_cardapio WHERE id=%s FOR UPDATE", (item_id,))
+    if cur.fetchone()["estoque"] < qtd:
+        raise estoque.EstoqueInsuficiente("esgotado")
+    resto_do_checkout(cur, espera)
+    cur.execute("""
+        UPDATE itens_cardapio
+        SET estoque=estoque - %s, disponivel=IF(estoque = 0, 0, disponivel)
+        WHERE id=%s
+    """, (qtd, item_id))
+
+
+def condicional(cur, restaurante_id, item_id, qtd, espera):
+    resto_do_checkout(cur, espera)
+    estoque.reservar(cur, restaurante_id, {item_id: qtd})
+
+
+def cliente(estrategia, restaurante_id, item_id, args, largada, resultado, lock):
+    try:
+        conn = mysql.connector.connect(**_config_conexao())
+        cur = conn.cursor(dictionary=True)
+        cur.execute("CREATE TEMPORARY TABLE bench_pedidos (id int AUTO_INCREMENT PRIMARY KEY, criado_em datetime(6))")
+    except mysql.connector.Error:
+        largada.abort()  # ex.: max_connections menor que --clientes; ninguém fica esperando
+        raise
+    tempos, erros = [], 0
+    try:
+        largada.wait()
+        while True:
+            inicio = time.perf_counter()
+            try:
+                estrategia(cur, restaurante_id, item_id, args.quantidade, args.espera)
+                conn.commit()
+                tempos.append((time.perf_counter() - inicio) * 1000)
+            except estoque.EstoqueInsuficiente:
+                conn.rollback()
+                break
+            except mysql.connector.Error:
+                # Lock wait timeout / deadlock: o checkout falhou, o cliente tenta de novo
+                conn.rollback()
+                erros += 1
+    finally:
+        cur.close()
+        conn.close()
+    with lock:
+        resultado["tempos"].extend(tempos)
+        resultado["erros"] += erros
+
+
+def rodar(nome, estrategia, restaurante_id, item_id, args):
+    db = get_db()
+    cur = db.cursor(dictionary=True)
+    cur.execute("UPDATE itens_cardapio SET estoque=%s, disponivel=1 WHERE id=%s", (args.estoque, item_id))
+    db.commit()
+
+    resultado = {"tempos": [], "erros": 0}
+    lock = threading.Lock()
+    largada = threading.Barrier(args.clientes + 1)
+    threads = [
+        threading.Thread(target=cliente, args=(estrategia, restaurante_id, item_id, args, largada, resultado, lock))
+        for _ in range(args.clientes)
+    ]
+    for t in threads:
+        t.start()
+    largada.wait()
+    inicio = time.perf_counter()
+    for t in threads:
+        t.join()
+    duracao = time.perf_counter() - inicio
+
+    cur.execute("SELECT estoque, disponivel FROM itens_cardapio WHERE id=%s", (item_id,))
+    final = cur.fetchone()
+    db.rollback()
+    cur.close()
+    db.close()
+
+    tempos = resultado["tempos"]
+    vendidos = len(tempos) * args.quantidade
+    p95 = statistics.quantiles(tempos, n=100)[94] if len(tempos) >= 2 else float("nan")
+    esgotou = final["estoque"] < args.quantidade and (final["estoque"] > 0 or not final["disponivel"])
+    confere = "ok" if vendidos + final["estoque"] == args.estoque and esgotou else "ERRO"
+    print(
+        f"{nome:<12} | {len(tempos) / duracao:>10.1f} | {statistics.median(tempos):>8.2f} | {p95:>8.2f} | "
+        f"{resultado['erros']:>6} | {vendidos:>8} | {confere}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clientes", type=int, default=200)
+    parser.add_argument("--estoque", type=int, default=2000)
+    parser.add_argument("--quantidade", type=int, default=1, help="unidades por checkout")
+    parser.add_argument("--espera", type=float, default=2.0, help="ms do resto do checkout dentro da transação")
+    parser.add_argument("--restaurante", type=int)
+    args = parser.parse_args()
+
+    db = get_db()
+    cur = db.cursor(dictionary=True)
+    if args.restaurante is None:
+        cur.execute("SELECT MIN(usuario_id) AS id FROM restaurantes")
+        args.restaurante = cur.fetchone()["id"]
+    cur.execute("""
+        INSERT INTO itens_cardapio (restaurante_id, nome, preco_base, disponivel, estoque)
+        VALUES (%s, 'bench_estoque', 1.00, 1, 0)
+    """, (args.restaurante,))
+    item_id = cur.lastrowid
+    db.commit()
+
+    print(f"{args.clientes} clientes, estoque {args.estoque}, {args.quantidade} un./checkout, espera {args.espera} ms")
+    print(f"{'estratégia':<12} | {'pedidos/s':>10} | {'p50 ms':>8} | {'p95 ms':>8} | {'erros':>6} | {'vendidos':>8} | estoque")
+    print("-" * 80)
+    try:
+        for nome, estrategia in (("for update", com_for_update), ("condicional", condicional)):
+            rodar(nome, estrategia, args.restaurante, item_id, args)
+    finally:
+        cur.execute("DELETE FROM itens_cardapio WHERE id=%s", (item_id,))
+        db.commit()
+        cur.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark: INSERT de itens_pedido linha a linha x INSERT único com várias linhas.
+
+Usa uma tabela TEMPORARY com a mesma estrutura de itens_pedido (sem as FKs),
+então não altera nenhum dado do banco configurado no .env.
+
+Uso:
+    python benchmarks/bench_itens_pedido.py [--repeticoes 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import get_db  # noqa: E402
+
+TAMANHOS_CARRINHO = (1, 10, 50)
+
+
+def inserir_por_linha(cur, pedido_id, linhas):
+    for item_id, qtd, preco_unit, total_linha in linhas:
+        cur.execute("""
+            INSERT INTO bench_itens_pedido (
+              pedido_id, item_cardapio_id, quantidade,
+              preco_unitario, total_linha
+            )
+            VALUES (%s,%s,%s,%s,%s)
+        """, (pedido_id, item_id, qtd, preco_unit, total_linha))
+
+
+def inserir_em_lote(cur, pedido_id, linhas):
+    valores = ",".join(["(%s,%s,%s,%s,%s)"] * len(linhas))
+    params = []
+    for item_id, qtd, preco_unit, total_linha in linhas:
+        params.extend((pedido_id, item_id, qtd, preco_unit, total_linha))
+
+    cur.execute(f"""
+        INSERT INTO bench_itens_pedido (
+          pedido_id, item_cardapio_id, quantidade,
+          preco_unitario, total_linha
+        )
+        VALUES {valores}
+    """, tuple(params))
+
+
+def medir(db, cur, estrategia, n_linhas, repeticoes):
+    linhas = [(i + 1, 2, 10.0, 20.0) for i in range(n_linhas)]
+    tempos = []
+    for pedido_id in range(1, repeticoes + 1):
+        inicio = time.perf_counter()
+        estrategia(cur, pedido_id, linhas)
+        db.commit()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return tempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeticoes", type=int, default=200)
+    args = parser.parse_args()
+
+    db = get_db()
+    cur = db.cursor()
+    cur.execute("DROP TEMPORARY TABLE IF EXISTS bench_itens_pedido")
+    cur.execute("CREATE TEMPORARY TABLE bench_itens_pedido LIKE itens_pedido")
+
+    print(f"{'linhas':>6} | {'estratégia':<10} | {'p50 ms':>8} | {'p95 ms':>8} | {'média ms':>8}")
+    print("-" * 52)
+    try:
+        for n in TAMANHOS_CARRINHO:
+            for nome, estrategia in (("por linha", inserir_por_linha), ("em lote", inserir_em_lote)):
+                cur.execute("TRUNCATE TABLE bench_itens_pedido")
+                tempos = medir(db, cur, estrategia, n, args.repeticoes)
+                p95 = statistics.quantiles(tempos, n=100)[94]
+                print(f"{n:>6} | {nome:<10} | {statistics.median(tempos):>8.3f} | {p95:>8.3f} | {statistics.mean(tempos):>8.3f}")
+    finally:
+        cur.execute("DROP TEMPORARY TABLE IF EXISTS bench_itens_pedido")
+        cur.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
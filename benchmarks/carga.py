@@ -0,0 +1,228 @@
+"""
+Teste de carga das jornadas principais contra um servidor rodando (gunicorn ou python app.py).
+
+Clientes virtuais repetem a jornada:
+    home -> restaurante -> carrinho/add -> checkout -> finalizar checkout -> pedido
+e restaurantes virtuais ficam consultando o painel de pedidos, como as cozinhas fazem.
+
+Os usuários são os criados por benchmarks/gerar_dados.py. Rode o servidor com limites
+de login folgados (ex.: LOGIN_LIMITE_IP=100000), já que todo o tráfego sai de um IP só.
+
+Relata p50/p95/p99 por etapa, vazão e, com --mysql, comandos SQL por request
+(delta de "Questions" no servidor MySQL do .env).
+
+Uso:
+    python benchmarks/carga.py --url http://127.0.0.1:8000 --clientes 20 --restaurantes 5 --duracao 60 --mysql
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gerar_dados import email_cliente, email_restaurante  # noqa: E402
+
+
+class SemRedirect(urllib.request.HTTPRedirectHandler):
+    """Cada redirect vira um request medido separadamente."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Metricas:
+    def __init__(self):
+        self.tempos = {}  # etapa -> [ms]
+        self.erros = {}  # etapa -> quantidade
+        self._lock = threading.Lock()
+
+    def registrar(self, etapa, ms, ok):
+        with self._lock:
+            self.tempos.setdefault(etapa, []).append(ms)
+            if not ok:
+                self.erros[etapa] = self.erros.get(etapa, 0) + 1
+
+    def total(self):
+        return sum(len(t) for t in self.tempos.values())
+
+
+class Sessao:
+    """Navegador simplificado: cookies, sem seguir redirects, mede cada request."""
+
+    def __init__(self, base, metricas):
+        self.base = base.rstrip("/")
+        self.metricas = metricas
+        self.abridor = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            SemRedirect(),
+        )
+
+    def requisitar(self, etapa, caminho, dados=None):
+        corpo = urllib.parse.urlencode(dados).encode() if dados is not None else None
+        req = urllib.request.Request(self.base + caminho, data=corpo)
+        inicio = time.perf_counter()
+        try:
+            with self.abridor.open(req, timeout=30) as resp:
+                status, headers, html = resp.status, resp.headers, resp.read().decode("utf-8", "replace")
+        except urllib.error.HTTPError as e:
+            status, headers, html = e.code, e.headers, e.read().decode("utf-8", "replace")
+        except OSError:
+            self.metricas.registrar(etapa, (time.perf_counter() - inicio) * 1000, False)
+            return None, None, ""
+        self.metricas.registrar(etapa, (time.perf_counter() - inicio) * 1000, status < 400)
+        return status, headers, html
+
+    def login(self, email, senha):
+        status, headers, _ = self.requisitar("login", "/login", {"email": email, "senha": senha, "next_url": "/"})
+        return status == 302
+
+
+def campos_do_form(html, action):
+    """Valores padrão dos campos do formulário com esse action (hidden + primeira opção dos selects)."""
+    m = re.search(r'<form[^>]*action="%s"[^>]*>(.*?)</form>' % re.escape(action), html, re.S)
+    if not m:
+        return None
+    form = m.group(1)
+    campos = dict(re.findall(r'<input[^>]*type="hidden"[^>]*name="([^"]+)"[^>]*value="([^"]*)"', form))
+    for nome, opcoes in re.findall(r'<select[^>]*name="([^"]+)"[^>]*>(.*?)</select>', form, re.S):
+        primeira = re.search(r'<option[^>]*value="([^"]*)"', opcoes)
+        if primeira:
+            campos[nome] = primeira.group(1)
+    return campos
+
+
+def jornada_cliente(sessao):
+    _, _, html = sessao.requisitar("home", "/")
+    restaurantes = re.findall(r'href="/restaurantes/(\d+)"', html)
+    if not restaurantes:
+        return
+
+    rid = random.choice(restaurantes)
+    _, _, html = sessao.requisitar("ver_restaurante", f"/restaurantes/{rid}")
+    itens = re.findall(r'name="item_id" value="(\d+)"', html)
+    if not itens:
+        return
+
+    for item_id in random.sample(itens, min(len(itens), random.randint(1, 3))):
+        sessao.requisitar("carrinho_add", "/carrinho/add", {"item_id": item_id, "restaurante_id": rid})
+
+    _, _, html = sessao.requisitar("checkout", "/checkout")
+    campos = campos_do_form(html, "/checkout")
+    if not campos:
+        return
+
+    status, headers, _ = sessao.requisitar("finalizar_checkout", "/checkout", campos)
+    if status == 302 and headers.get("Location"):
+        destino = urllib.parse.urlsplit(headers["Location"]).path
+        sessao.requisitar("ver_pedido", destino)
+
+
+def cliente_virtual(args, n, metricas, fim):
+    sessao = Sessao(args.url, metricas)
+    if not sessao.login(email_cliente(n % args.total_clientes), args.senha):
+        return
+    while time.monotonic() < fim:
+        jornada_cliente(sessao)
+        time.sleep(args.pausa)
+
+
+def restaurante_virtual(args, n, metricas, fim):
+    sessao = Sessao(args.url, metricas)
+    if not sessao.login(email_restaurante(n % args.total_restaurantes), args.senha):
+        return
+    while time.monotonic() < fim:
+        sessao.requisitar("painel_pedidos", "/restaurante/pedidos")
+        time.sleep(args.intervalo_painel)
+
+
+def questions_mysql():
+    from db import get_db
+
+    db = get_db()
+    cur = db.cursor()
+    cur.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+    valor = int(cur.fetchone()[1])
+    cur.close()
+    db.close()
+    return valor
+
+
+def percentil(valores, p):
+    if len(valores) == 1:
+        return valores[0]
+    return statistics.quantiles(valores, n=100, method="inclusive")[p - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--clientes", type=int, default=10, help="clientes virtuais simultâneos")
+    parser.add_argument("--restaurantes", type=int, default=3, help="painéis de restaurante simultâneos")
+    parser.add_argument("--duracao", type=float, default=30, help="segundos")
+    parser.add_argument("--pausa", type=float, default=0.0, help="pausa entre jornadas de um cliente (s)")
+    parser.add_argument("--intervalo-painel", type=float, default=2.0, help="intervalo entre consultas do painel (s)")
+    parser.add_argument("--total-clientes", type=int, default=500, help="clientes criados pelo gerar_dados.py")
+    parser.add_argument("--total-restaurantes", type=int, default=50, help="restaurantes criados pelo gerar_dados.py")
+    parser.add_argument("--senha", default="123")
+    parser.add_argument("--mysql", action="store_true", help="mede comandos SQL por request no MySQL do .env")
+    parser.add_argument("--json", help="salva o resultado neste arquivo")
+    parser.add_argument("--max-p95", type=float, help="sai com erro se o p95 de alguma etapa passar disso (ms)")
+    args = parser.parse_args()
+
+    metricas = Metricas()
+    questions_antes = questions_mysql() if args.mysql else None
+
+    fim = time.monotonic() + args.duracao
+    threads = [threading.Thread(target=cliente_virtual, args=(args, n, metricas, fim)) for n in range(args.clientes)]
+    threads += [threading.Thread(target=restaurante_virtual, args=(args, n, metricas, fim)) for n in range(args.restaurantes)]
+
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duracao = time.perf_counter() - inicio
+
+    total = metricas.total()
+    resultado = {"duracao_s": round(duracao, 2), "requests": total, "rps": round(total / duracao, 1), "etapas": {}}
+    if args.mysql and total:
+        # Desconta o próprio SHOW STATUS
+        resultado["sql_por_request"] = round((questions_mysql() - questions_antes - 1) / total, 2)
+
+    print(f"{'etapa':<20} | {'n':>6} | {'erros':>5} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8}")
+    print("-" * 70)
+    estourou = False
+    for etapa, tempos in metricas.tempos.items():
+        p50, p95, p99 = percentil(tempos, 50), percentil(tempos, 95), percentil(tempos, 99)
+        erros = metricas.erros.get(etapa, 0)
+        resultado["etapas"][etapa] = {"n": len(tempos), "erros": erros,
+                                      "p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2)}
+        print(f"{etapa:<20} | {len(tempos):>6} | {erros:>5} | {p50:>8.1f} | {p95:>8.1f} | {p99:>8.1f}")
+        if args.max_p95 and p95 > args.max_p95:
+            estourou = True
+
+    print("-" * 70)
+    print(f"{total} requests em {duracao:.1f}s = {resultado['rps']} req/s")
+    if "sql_por_request" in resultado:
+        print(f"{resultado['sql_por_request']} comandos SQL por request")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+    if estourou:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
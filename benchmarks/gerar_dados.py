@@ -0,0 +1,179 @@
+"""
+Gera dados em escala para os testes de carga, no banco configurado no .env.
+
+Cria restaurantes, itens de cardápio, clientes (com endereço) e um histórico de
+pedidos, todos com email "carga_..." e a mesma senha, para o benchmarks/carga.py
+conseguir logar. No fim reconstrói o resumo_restaurante a partir dos pedidos.
+Rodar de novo com --limpar apaga a geração anterior.
+
+Uso:
+    python benchmarks/gerar_dados.py --restaurantes 200 --itens 30 --clientes 2000 --pedidos 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import resumo  # noqa: E402
+from db import get_db  # noqa: E402
+
+LOTE = 1000
+PRATOS = ("Feijoada", "Tambaqui", "Matrinxã", "Pirarucu", "Parmegiana", "Moqueca", "Picanha", "Lasanha", "Risoto", "Salada")
+ACOMPANHAMENTOS = ("arroz", "farofa", "vinagrete", "baião de dois", "purê", "couve", "banana frita", "jambu")
+BAIRROS = ("Centro", "Adrianópolis", "Aleixo", "Flores", "Ponta Negra", "Parque 10", "Chapada", "Cachoeirinha")
+
+
+def email_restaurante(i):
+    return f"carga_rest_{i}@exemplo.com"
+
+
+def email_cliente(i):
+    return f"carga_cliente_{i}@exemplo.com"
+
+
+def inserir_em_lotes(cur, sql_prefixo, colunas, linhas):
+    """INSERT com várias linhas por comando, LOTE linhas de cada vez."""
+    marcadores = "(" + ",".join(["%s"] * colunas) + ")"
+    for i in range(0, len(linhas), LOTE):
+        lote = linhas[i:i + LOTE]
+        params = [v for linha in lote for v in linha]
+        cur.execute(f"{sql_prefixo} VALUES {','.join([marcadores] * len(lote))}", tuple(params))
+
+
+def limpar(db, cur):
+    cur.execute("""
+        DELETE p FROM pedidos p
+        JOIN usuarios u ON u.id = p.cliente_id OR u.id = p.restaurante_id
+        WHERE u.email LIKE 'carga\\_%'
+    """)
+    cur.execute("DELETE FROM usuarios WHERE email LIKE 'carga\\_%'")
+    db.commit()
+
+
+def criar_usuarios(cur, emails, tipo, senha_hash):
+    inserir_em_lotes(cur, "INSERT INTO usuarios (email, senha, tipo)", 3,
+                     [(e, senha_hash, tipo) for e in emails])
+    placeholders = ",".join(["%s"] * len(emails))
+    cur.execute(f"SELECT id FROM usuarios WHERE email IN ({placeholders}) ORDER BY id", tuple(emails))
+    return [row[0] for row in cur.fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--restaurantes", type=int, default=50)
+    parser.add_argument("--itens", type=int, default=30, help="itens de cardápio por restaurante")
+    parser.add_argument("--clientes", type=int, default=500)
+    parser.add_argument("--pedidos", type=int, default=100, help="pedidos históricos por restaurante")
+    parser.add_argument("--senha", default="123")
+    parser.add_argument("--limpar", action="store_true", help="apaga os dados de carga anteriores antes")
+    parser.add_argument("--semente", type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.semente)
+    senha_hash = generate_password_hash(args.senha)
+    inicio = time.perf_counter()
+
+    db = get_db()
+    cur = db.cursor()
+
+    try:
+        if args.limpar:
+            limpar(db, cur)
+
+        rest_ids = criar_usuarios(cur, [email_restaurante(i) for i in range(args.restaurantes)], "RESTAURANTE", senha_hash)
+        inserir_em_lotes(
+            cur,
+            "INSERT INTO restaurantes (usuario_id, nome, telefone, status, tempo_preparo_min, tempo_preparo_max)", 6,
+            [(rid, f"Restaurante Carga {n}", None, "ABERTO", 20, 40 + n % 30) for n, rid in enumerate(rest_ids)],
+        )
+
+        itens = []
+        for rid in rest_ids:
+            for n in range(args.itens):
+                nome = f"{random.choice(PRATOS)} {n}"
+                descricao = "Acompanha " + ", ".join(random.sample(ACOMPANHAMENTOS, 3)) + "."
+                itens.append((rid, nome, descricao, round(random.uniform(15, 220), 2), 1))
+        inserir_em_lotes(cur, "INSERT INTO itens_cardapio (restaurante_id, nome, descricao, preco_base, disponivel)", 5, itens)
+        db.commit()
+
+        cliente_ids = criar_usuarios(cur, [email_cliente(i) for i in range(args.clientes)], "CLIENTE", senha_hash)
+        inserir_em_lotes(cur, "INSERT INTO clientes (usuario_id, nome, telefone)", 3,
+                         [(cid, f"Cliente Carga {n}", None) for n, cid in enumerate(cliente_ids)])
+        inserir_em_lotes(
+            cur, "INSERT INTO enderecos (cliente_id, rua, numero, bairro, cidade, estado, cep, complemento)", 8,
+            [(cid, "Rua de Teste", str(n), random.choice(BAIRROS), "Manaus", "AM", "69000-000", None)
+             for n, cid in enumerate(cliente_ids)],
+        )
+        db.commit()
+
+        if args.pedidos and cliente_ids:
+            placeholders = ",".join(["%s"] * len(cliente_ids))
+            cur.execute(f"SELECT cliente_id, MIN(id) FROM enderecos WHERE cliente_id IN ({placeholders}) GROUP BY cliente_id",
+                        tuple(cliente_ids))
+            endereco_de = dict(cur.fetchall())
+            placeholders = ",".join(["%s"] * len(rest_ids))
+            cur.execute(f"SELECT id, restaurante_id, preco_base FROM itens_cardapio WHERE restaurante_id IN ({placeholders})",
+                        tuple(rest_ids))
+            cardapios = {}
+            for item_id, rid, preco in cur.fetchall():
+                cardapios.setdefault(rid, []).append((item_id, float(preco)))
+
+            status = ("ENTREGUE",) * 8 + ("CANCELADO", "ACEITO", "PREPARANDO", "SAIU_ENTREGA")
+            for rid in rest_ids:
+                pedidos = []
+                linhas = []
+                for _ in range(args.pedidos):
+                    cid = random.choice(cliente_ids)
+                    escolhidos = random.sample(cardapios[rid], min(3, len(cardapios[rid])))
+                    qtds = [random.randint(1, 3) for _ in escolhidos]
+                    subtotal = round(sum(p * q for (_, p), q in zip(escolhidos, qtds)), 2)
+                    st = random.choice(status)
+                    dias = random.randint(0, 365)
+                    total = round(subtotal + 7.00, 2)
+                    pedidos.append((cid, rid, endereco_de[cid], st, dias, st, dias, 7.00, subtotal, total,
+                                    random.choice(("PIX", "CARTAO")), total))
+                    linhas.append([(item_id, q, p, round(p * q, 2)) for (item_id, p), q in zip(escolhidos, qtds)])
+
+                marcador = ("(%s,%s,%s,%s, NOW() - INTERVAL %s DAY,"
+                            " IF(%s = 'ENTREGUE', NOW() - INTERVAL %s DAY + INTERVAL 40 MINUTE, NULL),"
+                            " %s,%s,%s,%s,'PAGO',%s)")
+                cur.execute(f"""
+                    INSERT INTO pedidos (
+                      cliente_id, restaurante_id, endereco_id, status_pedido, realizado_em, entregue_em,
+                      taxa_entrega, subtotal, total, metodo_pagamento, status_pagamento, valor_pago
+                    )
+                    VALUES {",".join([marcador] * len(pedidos))}
+                """, tuple(v for p in pedidos for v in p))
+
+                # Em INSERT de várias linhas, lastrowid é o id da primeira e os demais são sequenciais
+                primeiro_id = cur.lastrowid
+                itens_pedido = [(primeiro_id + n, *linha) for n, ls in enumerate(linhas) for linha in ls]
+                inserir_em_lotes(
+                    cur, "INSERT INTO itens_pedido (pedido_id, item_cardapio_id, quantidade, preco_unitario, total_linha)", 5,
+                    itens_pedido,
+                )
+                db.commit()
+
+        # Os pedidos entram direto na tabela, sem passar pelo resumo.registrar_*:
+        # recalcula o resumo_restaurante de todos os restaurantes a partir deles
+        resumo.reconstruir(cur)
+        db.commit()
+
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+        db.close()
+
+    print(f"{len(rest_ids)} restaurantes, {len(rest_ids) * args.itens} itens, {len(cliente_ids)} clientes, "
+          f"{len(rest_ids) * args.pedidos} pedidos em {time.perf_counter() - inicio:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# =========================
+# Backends
+# =========================
+class CacheMemoria:
+    """
+    Cache local do processo: TTL por chave e limite de itens (LRU).
+    Cada worker do gunicorn tem o seu, então invalidações só valem no worker
+    que as fez; nos outros o TTL limita o tempo de dado velho.
+    """
+
+    def __init__(self, max_itens=1000):
+        self.max_itens = max_itens
+        self._dados = OrderedDict()  # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            entrada = self._dados.get(chave)
+            if entrada is None:
+                return None
+            expira_em, valor = entrada
+            if expira_em is not None and expira_em <= time.monotonic():
+                del self._dados[chave]
+                return None
+            self._dados.move_to_end(chave)
+            return valor
+
+    def set(self, chave, valor, ttl=None):
+        expira_em = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._dados[chave] = (expira_em, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+
+    def delete(self, *chaves):
+        with self._lock:
+            for chave in chaves:
+                self._dados.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+
+class CacheRedis:
+    """
+    Cache compartilhado entre workers em um servidor compatível com Redis
+    (Redis, Valkey, KeyDB...). Os valores são serializados com pickle para
+    preservar Decimal/datetime vindos do MySQL.
+    """
+
+    def __init__(self, url, prefixo="delivery:"):
+        import redis  # dependência opcional: pip install redis
+
+        self.prefixo = prefixo
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, chave):
+        bruto = self._redis.get(self.prefixo + chave)
+        return pickle.loads(bruto) if bruto is not None else None
+
+    def set(self, chave, valor, ttl=None):
+        self._redis.set(self.prefixo + chave, pickle.dumps(valor), ex=ttl or None)
+
+    def delete(self, *chaves):
+        if chaves:
+            self._redis.delete(*(self.prefixo + c for c in chaves))
+
+    def limpar(self):
+        for chave in self._redis.scan_iter(self.prefixo + "*"):
+            self._redis.delete(chave)
+
+
+# =========================
+# Cache do processo
+# =========================
+# Espaços com limite próprio: um trecho de template a mais não expulsa o cardápio
+# do cache geral. espaço -> (variável de ambiente do limite, padrão)
+ESPACOS = {
+    None: ("CACHE_MAX_ITENS", "1000"),
+    "fragmentos": ("CACHE_MAX_FRAGMENTOS", "1000"),
+    "autocompletar": ("CACHE_MAX_AUTOCOMPLETAR", "500"),
+}
+
+_caches = {}
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(espaco=None):
+    """
+    Usa Redis quando REDIS_URL estiver configurada; senão, cache em memória.
+    Criado sob demanda por processo (os workers do gunicorn são forks), um por espaço
+    (ESPACOS). No Redis o espaço vira prefixo das chaves e o limite é o maxmemory dele.
+    """
+    global _caches, _cache_pid
+    pid = os.getpid()
+    if espaco not in _caches or _cache_pid != pid:
+        with _cache_lock:
+            if _cache_pid != pid:
+                _caches = {}
+                _cache_pid = pid
+            if espaco not in _caches:
+                url = os.getenv("REDIS_URL")
+                if url:
+                    _caches[espaco] = CacheRedis(url, prefixo=f"delivery:{espaco}:" if espaco else "delivery:")
+                else:
+                    variavel, padrao = ESPACOS[espaco]
+                    _caches[espaco] = CacheMemoria(max_itens=int(os.getenv(variavel, padrao)))
+    return _caches[espaco]
+
+
+def obter_ou_carregar(chave, carregar, ttl=None, espaco=None):
+    """
+    Devolve o valor em cache ou chama carregar() e guarda o resultado.
+    Resultados None não são guardados (ex.: registro não encontrado).
+    """
+    cache = get_cache(espaco)
+    valor = cache.get(chave)
+    if valor is None:
+        valor = carregar()
+        if valor is not None:
+            cache.set(chave, valor, ttl)
+    return valor
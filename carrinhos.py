@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Carrinhos sem atividade por esse tempo (segundos) são descartados
+TTL_CARRINHO = int(os.getenv("CARRINHO_TTL", str(3 * 24 * 3600)))
+
+
+# =========================
+# Stores de carrinho
+# =========================
+class CarrinhoMemoria:
+    """
+    Carrinhos guardados no processo. Serve para desenvolvimento e testes;
+    com vários workers do gunicorn use o CarrinhoRedis (REDIS_URL).
+    """
+
+    def __init__(self, ttl=TTL_CARRINHO):
+        self.ttl = ttl
+        self._dados = {}  # carrinho_id -> {"restaurante_id", "itens": {item_id: qtd}, "expira_em"}
+        self._lock = threading.Lock()
+        self._proxima_limpeza = time.monotonic() + 60
+
+    def _vivo(self, cid):
+        """Carrinho ainda válido (chamar com o lock)."""
+        agora = time.monotonic()
+        if agora >= self._proxima_limpeza:
+            for chave in [c for c, d in self._dados.items() if d["expira_em"] <= agora]:
+                del self._dados[chave]
+            self._proxima_limpeza = agora + 60
+
+        dados = self._dados.get(cid)
+        if dados is not None and dados["expira_em"] <= agora:
+            del self._dados[cid]
+            return None
+        return dados
+
+    def obter(self, cid):
+        """(restaurante_id, {item_id: qtd}) — (None, {}) se vazio."""
+        with self._lock:
+            dados = self._vivo(cid)
+            if not dados:
+                return None, {}
+            return dados["restaurante_id"], dict(dados["itens"])
+
+    def adicionar(self, cid, restaurante_id, item_id, qtd=1):
+        with self._lock:
+            dados = self._vivo(cid)
+            # Um carrinho só pode ter itens de 1 restaurante
+            if dados is None or dados["restaurante_id"] != restaurante_id:
+                dados = {"restaurante_id": restaurante_id, "itens": {}}
+                self._dados[cid] = dados
+            dados["itens"][item_id] = dados["itens"].get(item_id, 0) + qtd
+            dados["expira_em"] = time.monotonic() + self.ttl
+
+    def diminuir(self, cid, item_id):
+        with self._lock:
+            dados = self._vivo(cid)
+            if not dados or item_id not in dados["itens"]:
+                return
+            if dados["itens"][item_id] <= 1:
+                del dados["itens"][item_id]
+            else:
+                dados["itens"][item_id] -= 1
+            self._finalizar(cid, dados)
+
+    def remover(self, cid, item_id):
+        with self._lock:
+            dados = self._vivo(cid)
+            if not dados:
+                return
+            dados["itens"].pop(item_id, None)
+            self._finalizar(cid, dados)
+
+    def _finalizar(self, cid, dados):
+        if dados["itens"]:
+            dados["expira_em"] = time.monotonic() + self.ttl
+        else:
+            del self._dados[cid]
+
+    def limpar(self, cid):
+        with self._lock:
+            self._dados.pop(cid, None)
+
+
+# Scripts Lua: cada operação roda atômica no servidor, sem corrida entre workers.
+# O hash tem o campo "restaurante" e um campo "i:<item_id>" por item.
+_LUA_ADICIONAR = """
+local atual = redis.call('HGET', KEYS[1], 'restaurante')
+if atual and atual ~= ARGV[1] then
+  redis.call('DEL', KEYS[1])
+end
+redis.call('HSET', KEYS[1], 'restaurante', ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'i:' .. ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+_LUA_DIMINUIR = """
+local campo = 'i:' .. ARGV[1]
+local qtd = redis.call('HGET', KEYS[1], campo)
+if not qtd then
+  return 0
+end
+if tonumber(qtd) <= tonumber(ARGV[2]) then
+  redis.call('HDEL', KEYS[1], campo)
+else
+  redis.call('HINCRBY', KEYS[1], campo, -tonumber(ARGV[2]))
+end
+if redis.call('HLEN', KEYS[1]) <= 1 then
+  redis.call('DEL', KEYS[1])
+else
+  redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return 1
+"""
+
+
+class CarrinhoRedis:
+    """Carrinhos num servidor compatível com Redis, compartilhados entre workers."""
+
+    def __init__(self, url, ttl=TTL_CARRINHO, prefixo="delivery:carrinho:"):
+        import redis  # dependência opcional: pip install redis
+
+        self.ttl = ttl
+        self.prefixo = prefixo
+        self._redis = redis.Redis.from_url(url)
+        self._adicionar = self._redis.register_script(_LUA_ADICIONAR)
+        self._diminuir = self._redis.register_script(_LUA_DIMINUIR)
+
+    def obter(self, cid):
+        dados = self._redis.hgetall(self.prefixo + cid)
+        if not dados:
+            return None, {}
+
+        restaurante_id = None
+        itens = {}
+        for campo, valor in dados.items():
+            campo = campo.decode()
+            if campo == "restaurante":
+                restaurante_id = int(valor)
+            elif campo.startswith("i:"):
+                itens[int(campo[2:])] = int(valor)
+        return restaurante_id, itens
+
+    def adicionar(self, cid, restaurante_id, item_id, qtd=1):
+        self._adicionar(keys=[self.prefixo + cid], args=[restaurante_id, item_id, qtd, self.ttl])
+
+    def diminuir(self, cid, item_id):
+        self._diminuir(keys=[self.prefixo + cid], args=[item_id, 1, self.ttl])
+
+    def remover(self, cid, item_id):
+        # Diminuir pela quantidade "infinita" remove o item inteiro
+        self._diminuir(keys=[self.prefixo + cid], args=[item_id, 2 ** 31, self.ttl])
+
+    def limpar(self, cid):
+        self._redis.delete(self.prefixo + cid)
+
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+
+def get_carrinhos():
+    """Redis se REDIS_URL estiver configurada; senão, carrinhos em memória do processo."""
+    global _store, _store_pid
+    pid = os.getpid()
+    if _store is None or _store_pid != pid:
+        with _store_lock:
+            if _store is None or _store_pid != pid:
+                url = os.getenv("REDIS_URL")
+                _store = CarrinhoRedis(url) if url else CarrinhoMemoria()
+                _store_pid = pid
+    return _store
@@ -0,0 +1,215 @@
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+from dotenv import load_dotenv
+
+from frete import normalizar_cep
+
+load_dotenv()
+
+# Arquivo gerado por `flask --app app indexar-ceps` a partir da base de CEPs
+CEP_INDICE = os.getenv("CEP_INDICE", "dados/ceps.idx")
+# Sugestões devolvidas por busca de prefixo
+CEP_MAX_SUGESTOES = int(os.getenv("CEP_MAX_SUGESTOES", "10"))
+
+UFS = frozenset((
+    "AC", "AL", "AM", "AP", "BA", "CE", "DF", "ES", "GO", "MA", "MG", "MS", "MT", "PA",
+    "PB", "PE", "PI", "PR", "RJ", "RN", "RO", "RR", "RS", "SC", "SE", "SP", "TO",
+))
+
+
+# =========================
+# Formato do índice
+# =========================
+# Cabeçalho: assinatura, ordem dos bytes da máquina que gerou e quantidade de CEPs.
+# Depois vêm três blocos:
+#   ceps    uint32 x n      ordenados (a busca binária roda direto sobre eles)
+#   campos  uint32 x 3n     posições de rua, bairro e "cidade\tUF" nos textos
+#   textos  uint16 tamanho + UTF-8, cada texto distinto gravado uma vez só
+# O arquivo é mapeado em memória (mmap): os workers compartilham as mesmas páginas
+# e só o que é consultado sai do disco.
+ASSINATURA = b"CEP1"
+_CABECALHO = struct.Struct("=4s1s3xI")
+_TAMANHO = struct.Struct("=H")
+
+
+def formatar_cep(numero):
+    """1310100 -> '01310-100'."""
+    texto = f"{numero:08d}"
+    return f"{texto[:5]}-{texto[5:]}"
+
+
+def construir_indice(linhas, caminho=CEP_INDICE):
+    """
+    linhas: [(cep, rua, bairro, cidade, uf)], cep já normalizado (int) e em qualquer ordem;
+    CEP repetido fica com a última linha. Grava em arquivo temporário e troca no fim,
+    para não estragar o mapa de quem já está lendo. Retorna quantos CEPs foram gravados.
+    """
+    por_cep = {}
+    for cep, rua, bairro, cidade, uf in linhas:
+        por_cep[cep] = (rua, bairro, f"{cidade}\t{uf}")
+
+    textos = bytearray()
+    posicoes = {}
+
+    def posicao(texto):
+        if texto not in posicoes:
+            bruto = texto.encode("utf-8")
+            posicoes[texto] = len(textos)
+            textos.extend(_TAMANHO.pack(len(bruto)))
+            textos.extend(bruto)
+        return posicoes[texto]
+
+    ceps = array("I", sorted(por_cep))
+    campos = array("I")
+    for cep in ceps:
+        campos.extend(posicao(t) for t in por_cep[cep])
+
+    pasta = os.path.dirname(caminho)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(_CABECALHO.pack(ASSINATURA, sys.byteorder[0].encode(), len(ceps)))
+        f.write(ceps.tobytes())
+        f.write(campos.tobytes())
+        f.write(textos)
+    os.replace(temporario, caminho)
+    return len(ceps)
+
+
+# =========================
+# Consulta
+# =========================
+class IndiceCep:
+    def __init__(self, caminho):
+        with open(caminho, "rb") as f:
+            self._mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        assinatura, ordem, n = _CABECALHO.unpack_from(self._mapa, 0)
+        if assinatura != ASSINATURA:
+            raise ValueError(f"{caminho} não é um índice de CEPs.")
+        if ordem != sys.byteorder[0].encode():
+            raise ValueError(f"{caminho} foi gerado em outra arquitetura; rode indexar-ceps de novo.")
+
+        inicio = _CABECALHO.size
+        visao = memoryview(self._mapa)
+        self._ceps = visao[inicio:inicio + 4 * n].cast("I")
+        self._campos = visao[inicio + 4 * n:inicio + 16 * n].cast("I")
+        self._textos = inicio + 16 * n
+
+    def __len__(self):
+        return len(self._ceps)
+
+    def _texto(self, posicao):
+        inicio = self._textos + posicao
+        (tamanho,) = _TAMANHO.unpack_from(self._mapa, inicio)
+        inicio += _TAMANHO.size
+        return self._mapa[inicio:inicio + tamanho].decode("utf-8")
+
+    def _endereco(self, i):
+        rua, bairro, local = (self._texto(p) for p in self._campos[3 * i:3 * i + 3])
+        cidade, _, uf = local.rpartition("\t")
+        return {"cep": formatar_cep(self._ceps[i]), "rua": rua, "bairro": bairro, "cidade": cidade, "estado": uf}
+
+    def buscar(self, numero):
+        """Endereço do CEP (int de 8 dígitos) ou None."""
+        i = bisect_left(self._ceps, numero)
+        if i < len(self._ceps) and self._ceps[i] == numero:
+            return self._endereco(i)
+        return None
+
+    def prefixo(self, digitos, limite=CEP_MAX_SUGESTOES):
+        """Até `limite` endereços cujo CEP começa com `digitos` ('6905' -> 69050-000 a 69059-999)."""
+        escala = 10 ** (8 - len(digitos))
+        inicio, fim = int(digitos) * escala, (int(digitos) + 1) * escala
+        i = bisect_left(self._ceps, inicio)
+        achados = []
+        while i < len(self._ceps) and self._ceps[i] < fim and len(achados) < limite:
+            achados.append(self._endereco(i))
+            i += 1
+        return achados
+
+
+_indice = None
+_indice_carregado = False
+_indice_lock = threading.Lock()
+
+
+def get_indice():
+    """
+    Índice mapeado deste processo, aberto na primeira consulta; None se o arquivo não
+    existe (sem base de CEPs, os endereços são validados só no formato). O mapa é
+    somente leitura, então um índice aberto antes do fork continua valendo nos workers.
+    """
+    global _indice, _indice_carregado
+    if not _indice_carregado:
+        with _indice_lock:
+            if not _indice_carregado:
+                _indice = IndiceCep(CEP_INDICE) if os.path.exists(CEP_INDICE) else None
+                _indice_carregado = True
+    return _indice
+
+
+def buscar(cep):
+    """Endereço do CEP digitado (com ou sem hífen) ou None."""
+    indice = get_indice()
+    numero = normalizar_cep(cep)
+    if indice is None or numero is None:
+        return None
+    return indice.buscar(numero)
+
+
+def sugerir(texto, limite=CEP_MAX_SUGESTOES):
+    """Endereços para o CEP parcialmente digitado (a partir de 5 dígitos, o prefixo de região)."""
+    indice = get_indice()
+    digitos = "".join(c for c in texto or "" if c.isdigit())
+    if indice is None or not 5 <= len(digitos) <= 8:
+        return []
+    return indice.prefixo(digitos, limite)
+
+
+# =========================
+# Validação de endereços
+# =========================
+def _limpar(texto):
+    return " ".join((texto or "").split())
+
+
+def normalizar_endereco(rua, bairro, cidade, estado, cep):
+    """
+    Confere o endereço digitado e devolve (endereco, None) ou (None, mensagem de erro).
+    O CEP é gravado como '00000-000'. Com a base de CEPs carregada, o CEP precisa existir
+    e cidade, UF e, quando a base tem, rua e bairro vêm dela (o cliente só digita o número).
+    """
+    numero = normalizar_cep(cep)
+    if numero is None:
+        return None, "Erro: CEP deve ter 8 dígitos (ex: 69050-000)."
+
+    endereco = {
+        "rua": _limpar(rua),
+        "bairro": _limpar(bairro),
+        "cidade": _limpar(cidade),
+        "estado": _limpar(estado).upper(),
+        "cep": formatar_cep(numero),
+    }
+
+    indice = get_indice()
+    if indice is not None:
+        oficial = indice.buscar(numero)
+        if oficial is None:
+            return None, "Erro: CEP não encontrado."
+        # CEP geral de cidade pequena não tem rua nem bairro: fica o que foi digitado
+        for campo in ("rua", "bairro", "cidade", "estado"):
+            endereco[campo] = oficial[campo] or endereco[campo]
+
+    if not endereco["rua"]:
+        return None, "Erro: rua, número e CEP são obrigatórios."
+    if endereco["estado"] and endereco["estado"] not in UFS:
+        return None, "Erro: estado deve ser uma UF válida (ex: AM)."
+    return endereco, None
@@ -0,0 +1,70 @@
+import gzip
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Respostas menores que isso (bytes) vão sem compressão: o ganho não paga o custo
+COMPRESSAO_MINIMO = int(os.getenv("COMPRESSAO_MINIMO", "500"))
+COMPRESSAO_NIVEL_GZIP = int(os.getenv("COMPRESSAO_NIVEL_GZIP", "6"))
+COMPRESSAO_NIVEL_BROTLI = int(os.getenv("COMPRESSAO_NIVEL_BROTLI", "5"))
+
+TIPOS_COMPRIMIVEIS = (
+    "text/html", "text/css", "text/plain", "text/csv", "text/javascript",
+    "application/javascript", "application/json", "application/x-ndjson",
+)
+
+try:
+    import brotli  # dependência opcional: pip install brotli
+except ImportError:
+    brotli = None
+
+
+# =========================
+# Compressão das respostas
+# =========================
+def _codificacao(request):
+    """Melhor codificação aceita pelo cliente: br (se instalado), gzip ou None."""
+    aceitas = request.accept_encodings
+    if brotli is not None and aceitas["br"]:
+        return "br"
+    if aceitas["gzip"]:
+        return "gzip"
+    return None
+
+
+def comprimir(resposta):
+    from flask import request
+
+    if (
+        resposta.status_code < 200
+        or resposta.status_code in (204, 304)
+        or resposta.is_streamed  # SSE e exportações: enviados aos poucos, sem compressão
+        or resposta.direct_passthrough
+        or "Content-Encoding" in resposta.headers
+        or resposta.mimetype not in TIPOS_COMPRIMIVEIS
+    ):
+        return resposta
+
+    resposta.vary.add("Accept-Encoding")
+    codificacao = _codificacao(request)
+    corpo = resposta.get_data()
+    if codificacao is None or len(corpo) < COMPRESSAO_MINIMO:
+        return resposta
+
+    if codificacao == "br":
+        resposta.set_data(brotli.compress(corpo, quality=COMPRESSAO_NIVEL_BROTLI))
+    else:
+        resposta.set_data(gzip.compress(corpo, compresslevel=COMPRESSAO_NIVEL_GZIP))
+    resposta.headers["Content-Encoding"] = codificacao
+
+    # O corpo enviado não é mais o mesmo byte a byte: o ETag vira fraco
+    etag, fraco = resposta.get_etag()
+    if etag and not fraco:
+        resposta.set_etag(etag, weak=True)
+    return resposta
+
+
+def init_app(app):
+    app.after_request(comprimir)
@@ -1,14 +1,481 @@
+import itertools
+import logging
 import os
+import sys
+import threading
+import time
+from collections import deque
+
 from dotenv import load_dotenv
 import mysql.connector
+from mysql.connector import errorcode
+
+from metricas import CursorMedido
 
 load_dotenv()
 
-def get_db():
-    return mysql.connector.connect(
-        host=os.getenv("MYSQL_HOST", "localhost"),
-        user=os.getenv("MYSQL_USER", "root"),
-        password=os.getenv("MYSQL_PASSWORD", ""),
-        database=os.getenv("MYSQL_DB", "sistema_delivery_db"),
-        port=int(os.getenv("MYSQL_PORT", "3306")),
-    )
\ No newline at end of file
+# Réplicas de leitura: "host[:porta],host[:porta]" (mesmo usuário, senha e banco do primário)
+MYSQL_REPLICAS = os.getenv("MYSQL_REPLICAS", "")
+# Réplica mais atrasada que isso (s) deixa de receber leituras; 0 desliga a checagem
+REPLICA_ATRASO_MAX = float(os.getenv("MYSQL_REPLICA_ATRASO_MAX", "5"))
+# De quanto em quanto tempo (s) o atraso é medido e uma réplica fora volta a ser testada
+REPLICA_CHECAGEM = float(os.getenv("MYSQL_REPLICA_CHECAGEM", "5"))
+# Depois de gravar, o mesmo usuário lê do primário por esse tempo (s): vê o que acabou de gravar
+LER_PRIMARIO_APOS_ESCRITA = float(os.getenv("MYSQL_LER_PRIMARIO_APOS_ESCRITA", "5"))
+
+log = logging.getLogger("delivery.db")
+
+
+def _sob_gevent():
+    """True no worker gevent do gunicorn (socket trocado pelo do gevent)."""
+    if "gevent" not in sys.modules:
+        return False
+    from gevent import monkey
+
+    return monkey.is_module_patched("socket")
+
+
+def _config_conexao():
+    return {
+        "host": os.getenv("MYSQL_HOST", "localhost"),
+        "user": os.getenv("MYSQL_USER", "root"),
+        "password": os.getenv("MYSQL_PASSWORD", ""),
+        "database": os.getenv("MYSQL_DB", "sistema_delivery_db"),
+        "port": int(os.getenv("MYSQL_PORT", "3306")),
+        # A extensão C faz o I/O fora do Python e travaria todos os greenlets do worker
+        # durante cada consulta; a implementação pura usa o socket do gevent
+        "use_pure": _sob_gevent(),
+    }
+
+
+def _config_pool():
+    return {
+        "tamanho": int(os.getenv("MYSQL_POOL_SIZE", "5")),
+        "overflow": int(os.getenv("MYSQL_POOL_MAX_OVERFLOW", "10")),
+        "timeout": float(os.getenv("MYSQL_POOL_TIMEOUT", "10")),
+        "reciclar": int(os.getenv("MYSQL_POOL_RECYCLE", "1800")),
+        "pre_ping": os.getenv("MYSQL_POOL_PRE_PING", "1") == "1",
+    }
+
+
+class PoolEsgotado(Exception):
+    """Nenhuma conexão ficou livre dentro do tempo de espera do pool."""
+
+
+# =========================
+# Pool de conexões
+# =========================
+class ConexaoDevolvida(Exception):
+    """Uso de uma conexão depois do close(): ela já pode estar com outro request."""
+
+
+class ConexaoPool:
+    """
+    Conexão emprestada do pool. Repassa tudo para a conexão do mysql-connector,
+    mas close() devolve a conexão ao pool em vez de fechar o socket. Depois do
+    close() o objeto não repassa mais nada (ConexaoDevolvida); rollback() e close()
+    viram no-op, pois a devolução já desfez a transação aberta.
+    """
+
+    def __init__(self, pool, conn, criada_em):
+        self._pool = pool
+        self._conn = conn
+        self._criada_em = criada_em
+        self._devolvida = False
+        self._invalida = False
+
+    def _emprestada(self):
+        if self._devolvida:
+            raise ConexaoDevolvida("Conexão já devolvida ao pool.")
+        return self._conn
+
+    def __getattr__(self, nome):
+        return getattr(self._emprestada(), nome)
+
+    def cursor(self, *args, **kwargs):
+        """Cursor medido: tempo, linhas e rota de cada comando vão para metricas.py."""
+        conn = self._emprestada()
+        return CursorMedido(conn.cursor(*args, **kwargs), conn)
+
+    def commit(self):
+        self._emprestada().commit()
+        if self._pool.primario:
+            _registrar_escrita()
+
+    def rollback(self):
+        if self._devolvida:
+            return
+        self._conn.rollback()
+
+    def invalidar(self):
+        """Marca a conexão para ser descartada (e não reutilizada) na devolução."""
+        self._invalida = True
+
+    def close(self):
+        if self._devolvida:
+            return
+        self._devolvida = True
+        self._pool._devolver(self._conn, self._criada_em, self._invalida)
+
+
+class PoolConexoes:
+    """
+    Pool de conexões MySQL por processo (cada worker do gunicorn tem o seu).
+
+    - tamanho: conexões mantidas abertas e reaproveitadas
+    - overflow: conexões extras abertas em pico e fechadas na devolução
+    - timeout: segundos esperando uma conexão livre antes de PoolEsgotado
+    - reciclar: idade máxima (s) de uma conexão; mais velhas são reabertas
+    - pre_ping: testa a conexão (ping) antes de entregá-la
+    """
+
+    def __init__(self, tamanho=5, overflow=10, timeout=10.0, reciclar=1800, pre_ping=True, primario=True, **config):
+        self.primario = primario
+        self.tamanho = tamanho
+        self.overflow = overflow
+        self.timeout = timeout
+        self.reciclar = reciclar
+        self.pre_ping = pre_ping
+        self.config = config
+
+        self._livres = deque()  # (conn, criada_em)
+        self._abertas = 0
+        self._cond = threading.Condition()
+
+        self._em_uso = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._criadas = 0
+        self._descartadas = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+
+    def _conectar(self):
+        conn = mysql.connector.connect(**self.config)
+        with self._cond:
+            self._criadas += 1
+        return conn, time.monotonic()
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._abertas -= 1
+            self._descartadas += 1
+            self._cond.notify()
+
+    def _saudavel(self, conn, criada_em):
+        if self.reciclar and time.monotonic() - criada_em > self.reciclar:
+            return False
+        if not self.pre_ping:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def obter(self):
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+
+        while True:
+            with self._cond:
+                while not self._livres and self._abertas >= self.tamanho + self.overflow:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self._timeouts += 1
+                        raise PoolEsgotado(
+                            f"Nenhuma conexão livre em {self.timeout}s "
+                            f"({self._abertas} abertas, tamanho={self.tamanho}, overflow={self.overflow})."
+                        )
+                    self._cond.wait(restante)
+
+                if self._livres:
+                    conn, criada_em = self._livres.pop()
+                else:
+                    conn, criada_em = None, None
+                    self._abertas += 1
+
+            if conn is None:
+                try:
+                    conn, criada_em = self._conectar()
+                except Exception:
+                    with self._cond:
+                        self._abertas -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._saudavel(conn, criada_em):
+                self._descartar(conn)
+                continue
+
+            espera = time.monotonic() - inicio
+            with self._cond:
+                self._em_uso += 1
+                self._checkouts += 1
+                self._espera_total += espera
+                self._espera_max = max(self._espera_max, espera)
+            return ConexaoPool(self, conn, criada_em)
+
+    def _devolver(self, conn, criada_em, invalida=False):
+        with self._cond:
+            self._em_uso -= 1
+
+        if not invalida:
+            try:
+                # Transação esquecida aberta não pode vazar para o próximo request
+                if conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                invalida = True
+
+        with self._cond:
+            # Conexões de overflow (além de `tamanho`) são fechadas na devolução
+            if not invalida and len(self._livres) < self.tamanho:
+                self._livres.append((conn, criada_em))
+                self._cond.notify()
+                return
+
+        self._descartar(conn)
+
+    def estatisticas(self):
+        with self._cond:
+            return {
+                "tamanho": self.tamanho,
+                "overflow": self.overflow,
+                "abertas": self._abertas,
+                "em_uso": self._em_uso,
+                "livres": len(self._livres),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "criadas": self._criadas,
+                "descartadas": self._descartadas,
+                "espera_total_s": round(self._espera_total, 6),
+                "espera_max_s": round(self._espera_max, 6),
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Pool do processo atual. Criado sob demanda para que cada worker do gunicorn
+    (processos criados por fork) abra suas próprias conexões.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = PoolConexoes(**_config_pool(), **_config_conexao())
+                _pool_pid = pid
+    return _pool
+
+
+# =========================
+# Réplicas de leitura
+# =========================
+class Replica:
+    """
+    Pool de uma réplica e o estado dela. O atraso da replicação é medido a cada
+    REPLICA_CHECAGEM segundos; réplica atrasada ou inacessível fica fora até a
+    próxima medição, e as leituras vão para outra réplica ou para o primário.
+    """
+
+    def __init__(self, nome, pool):
+        self.nome = nome
+        self.pool = pool
+        self.disponivel = True
+        self.atraso = None  # segundos, na última medição
+        self.falhas = 0
+        self._medida_em = 0.0
+        self._lock = threading.Lock()
+
+    def _medir_atraso(self, conn):
+        """Segundos de atraso, ou None (com o motivo no log) se não dá para medir."""
+        cur = conn.cursor(dictionary=True)
+        try:
+            try:
+                cur.execute("SHOW REPLICA STATUS")
+                coluna = "Seconds_Behind_Source"
+            except mysql.connector.Error as e:
+                if e.errno != errorcode.ER_PARSE_ERROR:
+                    raise
+                # MySQL anterior ao 8.0.22 (e MariaDB) só conhece o nome antigo
+                cur.execute("SHOW SLAVE STATUS")
+                coluna = "Seconds_Behind_Master"
+            status = cur.fetchall()
+        except mysql.connector.Error as e:
+            if e.errno == errorcode.ER_SPECIFIC_ACCESS_DENIED_ERROR:
+                log.warning("réplica %s: o usuário do MySQL precisa do privilégio REPLICATION CLIENT "
+                            "para medir o atraso; réplica fora das leituras", self.nome)
+            else:
+                log.warning("réplica %s: falha ao medir o atraso (%s); réplica fora das leituras", self.nome, e)
+            return None
+        finally:
+            cur.close()
+
+        if not status:
+            log.warning("réplica %s: o servidor não é uma réplica (status de replicação vazio)", self.nome)
+            return None
+        if status[0][coluna] is None:
+            log.warning("réplica %s: replicação parada (%s NULL)", self.nome, coluna)
+        return status[0][coluna]
+
+    def _tirar(self):
+        with self._lock:
+            self.disponivel = False
+            self.falhas += 1
+            self._medida_em = time.monotonic()
+
+    def obter(self):
+        """Conexão da réplica, ou None se ela está fora (atrasada, parada ou inacessível)."""
+        with self._lock:
+            medir = time.monotonic() - self._medida_em >= REPLICA_CHECAGEM
+            if medir:
+                self._medida_em = time.monotonic()
+            elif not self.disponivel:
+                return None
+
+        try:
+            conn = self.pool.obter()
+        except Exception:
+            self._tirar()
+            return None
+
+        if medir and REPLICA_ATRASO_MAX > 0:
+            try:
+                atraso = self._medir_atraso(conn)
+            except Exception:
+                log.warning("réplica %s: falha ao medir o atraso", self.nome, exc_info=True)
+                atraso = None
+            self.atraso = atraso
+            if atraso is None or atraso > REPLICA_ATRASO_MAX:
+                conn.close()
+                self._tirar()
+                return None
+
+        self.disponivel = True
+        return conn
+
+    def estatisticas(self):
+        return dict(self.pool.estatisticas(), replica=self.nome, disponivel=self.disponivel,
+                    atraso_s=self.atraso, falhas=self.falhas)
+
+
+_replicas = None
+_replicas_pid = None
+_rodizio = itertools.count()
+
+
+def get_replicas():
+    """Réplicas de MYSQL_REPLICAS, com um pool por réplica em cada processo (lista vazia se não houver)."""
+    global _replicas, _replicas_pid
+    pid = os.getpid()
+    if _replicas is None or _replicas_pid != pid:
+        with _pool_lock:
+            if _replicas is None or _replicas_pid != pid:
+                replicas = []
+                for endereco in filter(None, (e.strip() for e in MYSQL_REPLICAS.split(","))):
+                    host, _, porta = endereco.partition(":")
+                    config = dict(_config_conexao(), host=host, port=int(porta or 3306),
+                                  connection_timeout=int(os.getenv("MYSQL_REPLICA_TIMEOUT_CONEXAO", "2")))
+                    # Réplica fora não pode segurar o request: espera curta por conexão livre
+                    pool = PoolConexoes(**dict(_config_pool(), timeout=1.0), primario=False, **config)
+                    replicas.append(Replica(endereco, pool))
+                _replicas = replicas
+                _replicas_pid = pid
+    return _replicas
+
+
+def obter_replica():
+    """Conexão de uma réplica disponível (em rodízio), ou None para ler do primário."""
+    replicas = get_replicas()
+    for _ in range(len(replicas)):
+        conn = replicas[next(_rodizio) % len(replicas)].obter()
+        if conn is not None:
+            return conn
+    return None
+
+
+def _registrar_escrita():
+    from flask import g, has_request_context
+
+    if has_request_context():
+        g.escreveu_no_primario = True
+
+
+def _pode_ler_de_replica():
+    """GET/HEAD de quem não gravou nada nos últimos LER_PRIMARIO_APOS_ESCRITA segundos."""
+    from flask import has_request_context, request, session
+
+    return (
+        has_request_context()
+        and request.method in ("GET", "HEAD")
+        and time.time() >= session.get("ler_primario_ate", 0)
+        and bool(get_replicas())
+    )
+
+
+# =========================
+# Conexão por request (flask.g)
+# =========================
+def get_db(primario=False):
+    """
+    Dentro de um request devolve sempre a mesma conexão (guardada em flask.g),
+    devolvida ao pool no teardown. Em GET, a conexão é de uma réplica (se houver
+    réplicas configuradas e disponíveis), salvo primario=True ou escrita recente
+    do mesmo usuário. Fora de um request (scripts, benchmarks, pagamentos)
+    empresta uma conexão do primário; quem chamou deve fechá-la com close().
+    """
+    from flask import g, has_app_context
+
+    if not has_app_context():
+        return get_pool().obter()
+
+    if not primario and _pode_ler_de_replica():
+        conn = g.get("db_leitura")
+        if conn is None or conn._devolvida:
+            conn = obter_replica()
+            if conn is not None:
+                g.db_leitura = conn
+                return conn
+        else:
+            return conn
+
+    conn = g.get("db")
+    if conn is None or conn._devolvida:
+        conn = get_pool().obter()
+        g.db = conn
+    return conn
+
+
+def fechar_db(erro=None):
+    from flask import g
+
+    for chave in ("db", "db_leitura"):
+        conn = g.pop(chave, None)
+        if conn is None:
+            continue
+        if erro is not None:
+            # Após uma exceção não sabemos o estado da sessão: recicla a conexão
+            conn.invalidar()
+        conn.close()
+
+
+def _marcar_leitura_no_primario(resposta):
+    from flask import g, session
+
+    if g.get("escreveu_no_primario") and get_replicas():
+        session["ler_primario_ate"] = time.time() + LER_PRIMARIO_APOS_ESCRITA
+    return resposta
+
+
+def init_app(app):
+    app.teardown_appcontext(fechar_db)
+    app.after_request(_marcar_leitura_no_primario)
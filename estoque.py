@@ -0,0 +1,82 @@
+# =========================
+# Estoque dos itens do cardápio
+# =========================
+# itens_cardapio.estoque NULL = sem controle (o restaurante só liga/desliga disponivel).
+# Com número, cada checkout reserva as quantidades com um único UPDATE condicional:
+# sem SELECT ... FOR UPDATE, o lock de cada linha dura só do UPDATE ao commit, e a
+# condição estoque >= quantidade no próprio WHERE impede vender mais do que há.
+# Chegando a zero o item sai do cardápio (disponivel=0).
+# Os `cur` daqui são cursores dictionary=True.
+
+
+class EstoqueInsuficiente(ValueError):
+    pass
+
+
+def _caso(quantidades):
+    """'CASE id WHEN %s THEN %s ... END' e seus parâmetros."""
+    sql = "CASE id " + " ".join(["WHEN %s THEN %s"] * len(quantidades)) + " END"
+    params = []
+    for item_id, qtd in quantidades.items():
+        params += [item_id, qtd]
+    return sql, params
+
+
+def reservar(cur, restaurante_id, quantidades):
+    """
+    Baixa o estoque dos itens do pedido. quantidades: {item_id: qtd}, só os itens com
+    estoque controlado. Roda na transação do checkout, logo antes do commit, para segurar
+    pouco as linhas mais disputadas.
+    Retorna os ids que esgotaram; levanta EstoqueInsuficiente se algum não tem o bastante
+    (quem chamou desfaz a transação inteira, inclusive as baixas que deram certo).
+    """
+    if not quantidades:
+        return []
+
+    caso, params = _caso(quantidades)
+    em = ",".join(["%s"] * len(quantidades))
+    # No UPDATE de uma tabela o MySQL aplica o SET da esquerda para a direita:
+    # disponivel já enxerga o estoque baixado
+    cur.execute(f"""
+        UPDATE itens_cardapio
+        SET estoque=estoque - {caso},
+            disponivel=IF(estoque = 0, 0, disponivel)
+        WHERE restaurante_id=%s AND id IN ({em}) AND disponivel=1
+          AND estoque >= {caso}
+    """, (*params, restaurante_id, *quantidades, *params))
+    if cur.rowcount < len(quantidades):
+        raise EstoqueInsuficiente("Algum item do carrinho esgotou. Revise o carrinho e tente de novo.")
+
+    # Lê a própria escrita (linhas já travadas por esta transação): quais zeraram
+    cur.execute(f"SELECT id FROM itens_cardapio WHERE id IN ({em}) AND estoque=0", tuple(quantidades))
+    return [row["id"] for row in cur.fetchall()]
+
+
+def devolver(cur, pedido_ids):
+    """
+    Devolve ao estoque os itens de pedidos cancelados antes do preparo. Item que tinha
+    esgotado volta a ficar disponível (o cardápio em cache mostra de novo ao expirar).
+    """
+    if not pedido_ids:
+        return
+
+    em = ",".join(["%s"] * len(pedido_ids))
+    cur.execute(f"""
+        SELECT ip.item_cardapio_id AS id, SUM(ip.quantidade) AS qtd
+        FROM itens_pedido ip
+        JOIN itens_cardapio ic ON ic.id = ip.item_cardapio_id
+        WHERE ip.pedido_id IN ({em}) AND ic.estoque IS NOT NULL
+        GROUP BY ip.item_cardapio_id
+    """, tuple(pedido_ids))
+    quantidades = {row["id"]: int(row["qtd"]) for row in cur.fetchall()}
+    if not quantidades:
+        return
+
+    caso, params = _caso(quantidades)
+    # Aqui o SET lê o estoque de antes: só reabre o que estava zerado
+    cur.execute(f"""
+        UPDATE itens_cardapio
+        SET disponivel=IF(estoque = 0, 1, disponivel),
+            estoque=estoque + {caso}
+        WHERE id IN ({",".join(["%s"] * len(quantidades))}) AND estoque IS NOT NULL
+    """, (*params, *quantidades))
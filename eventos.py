@@ -0,0 +1,139 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# =========================
+# Brokers de eventos (pub/sub)
+# =========================
+class AssinaturaMemoria:
+    def __init__(self, broker, canal, max_pendentes):
+        self._broker = broker
+        self.canal = canal
+        self.fila = queue.Queue(maxsize=max_pendentes)
+
+    def proximo(self, timeout=None):
+        """Próximo evento (dict) ou None se nada chegou dentro do timeout."""
+        try:
+            return self.fila.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def fechar(self):
+        self._broker._remover(self)
+
+
+class BrokerMemoria:
+    """
+    Pub/sub dentro do processo. Só entrega eventos publicados no mesmo worker,
+    então com vários workers use o BrokerRedis (REDIS_URL); o gunicorn.conf.py
+    recusa subir mais de um worker sem ele.
+    """
+
+    def __init__(self, max_pendentes=100):
+        self.max_pendentes = max_pendentes
+        self._assinaturas = {}  # canal -> set(AssinaturaMemoria)
+        self._lock = threading.Lock()
+
+    def publicar(self, canal, evento):
+        with self._lock:
+            assinaturas = list(self._assinaturas.get(canal, ()))
+        for a in assinaturas:
+            try:
+                a.fila.put_nowait(evento)
+            except queue.Full:
+                # Cliente lento: descarta em vez de travar quem publica
+                pass
+
+    def assinar(self, canal):
+        a = AssinaturaMemoria(self, canal, self.max_pendentes)
+        with self._lock:
+            self._assinaturas.setdefault(canal, set()).add(a)
+        return a
+
+    def _remover(self, assinatura):
+        with self._lock:
+            assinaturas = self._assinaturas.get(assinatura.canal)
+            if assinaturas is not None:
+                assinaturas.discard(assinatura)
+                if not assinaturas:
+                    del self._assinaturas[assinatura.canal]
+
+
+class AssinaturaRedis:
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+
+    def proximo(self, timeout=None):
+        msg = self._pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout or 0)
+        if msg is None:
+            return None
+        return json.loads(msg["data"])
+
+    def fechar(self):
+        self._pubsub.close()
+
+
+class BrokerRedis:
+    """Pub/sub compartilhado entre workers num servidor compatível com Redis."""
+
+    def __init__(self, url, prefixo="delivery:eventos:"):
+        import redis  # dependência opcional: pip install redis
+
+        self.prefixo = prefixo
+        self._redis = redis.Redis.from_url(url)
+
+    def publicar(self, canal, evento):
+        self._redis.publish(self.prefixo + canal, json.dumps(evento, default=str))
+
+    def assinar(self, canal):
+        pubsub = self._redis.pubsub()
+        pubsub.subscribe(self.prefixo + canal)
+        return AssinaturaRedis(pubsub)
+
+
+_broker = None
+_broker_pid = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Redis se REDIS_URL estiver configurada; senão, broker em memória do processo."""
+    global _broker, _broker_pid
+    pid = os.getpid()
+    if _broker is None or _broker_pid != pid:
+        with _broker_lock:
+            if _broker is None or _broker_pid != pid:
+                url = os.getenv("REDIS_URL")
+                _broker = BrokerRedis(url) if url else BrokerMemoria()
+                _broker_pid = pid
+    return _broker
+
+
+def id_evento():
+    """
+    Id dos eventos: milissegundos desde a época. Cresce em todos os workers e bate com
+    pedidos.atualizado_em, que é por onde o painel recupera o que perdeu ao reconectar.
+    """
+    return int(time.time() * 1000)
+
+
+def publicar(canal, evento):
+    """
+    Publica sem nunca derrubar quem chamou: o evento é um extra, o dado
+    já está salvo no banco.
+    """
+    try:
+        get_broker().publicar(canal, {**evento, "id": id_evento()})
+    except Exception:
+        pass
+
+
+def canal_restaurante(rid):
+    return f"restaurante:{rid}"
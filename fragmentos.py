@@ -0,0 +1,47 @@
+import os
+
+from dotenv import load_dotenv
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache import obter_ou_carregar
+
+load_dotenv()
+
+TTL_FRAGMENTO = int(os.getenv("CACHE_TTL_FRAGMENTO", "600"))
+
+
+# =========================
+# Cache de trechos de template
+# =========================
+class CacheFragmento(Extension):
+    """
+    {% cache chave %} ... {% endcache %} (ou {% cache chave, ttl %}): guarda o HTML
+    do trecho no cache da aplicação (cache.py) e só renderiza de novo quando a chave
+    muda. A chave deve conter a versão dos dados exibidos (ex.: hash do cardápio),
+    assim uma alteração gera outra chave em vez de exigir invalidação.
+    Chave None renderiza sem cache.
+    """
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        corpo = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(self.call_method("_renderizar", args), [], [], corpo).set_lineno(lineno)
+
+    def _renderizar(self, chave, ttl, caller):
+        if chave is None:
+            return caller()
+        # Espaço próprio no cache (CACHE_MAX_FRAGMENTOS): não disputa o LRU com cardápio e home
+        return Markup(obter_ou_carregar(str(chave), lambda: str(caller()), ttl or TTL_FRAGMENTO, espaco="fragmentos"))
+
+
+def init_app(app):
+    app.jinja_env.add_extension(CacheFragmento)
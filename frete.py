@@ -0,0 +1,76 @@
+import os
+import re
+from bisect import bisect_right
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Taxa de restaurantes que não cadastraram zonas de entrega (a antiga taxa fixa)
+FRETE_PADRAO = float(os.getenv("FRETE_PADRAO", "7.00"))
+
+
+# =========================
+# Tabela de frete por faixa de CEP
+# =========================
+# Cada restaurante cadastra zonas em zonas_entrega (faixa de CEP -> taxa). A tabela
+# é achatada uma vez em faixas disjuntas e ordenadas; cotar um CEP é uma busca
+# binária, sem ir ao banco.
+
+def normalizar_cep(cep):
+    """'01310-100' -> 1310100; None se não tiver 8 dígitos."""
+    digitos = re.sub(r"\D", "", cep or "")
+    return int(digitos) if len(digitos) == 8 else None
+
+
+def montar_tabela(zonas):
+    """
+    zonas: [(cep_inicio, cep_fim, taxa)], podendo se sobrepor (ex.: a cidade toda
+    e um bairro dentro dela). Onde há sobreposição vale a faixa mais estreita.
+    Retorna (inicios, fins, taxas): listas paralelas de faixas disjuntas e ordenadas.
+    """
+    if not zonas:
+        return ((), (), ())
+
+    # Pontos onde a zona vigente pode mudar
+    cortes = sorted({z[0] for z in zonas} | {z[1] + 1 for z in zonas})
+    inicios, fins, taxas = [], [], []
+    for inicio, proximo in zip(cortes, cortes[1:]):
+        dentro = [z for z in zonas if z[0] <= inicio and proximo - 1 <= z[1]]
+        if not dentro:
+            continue
+        taxa = min(dentro, key=lambda z: z[1] - z[0])[2]
+        if fins and fins[-1] == inicio - 1 and taxas[-1] == taxa:
+            fins[-1] = proximo - 1  # junta com a faixa anterior de mesma taxa
+        else:
+            inicios.append(inicio)
+            fins.append(proximo - 1)
+            taxas.append(taxa)
+    return (tuple(inicios), tuple(fins), tuple(taxas))
+
+
+def cotar(tabela, cep):
+    """
+    Taxa de entrega para o CEP. Restaurante sem zonas cobra FRETE_PADRAO;
+    com zonas, None quando o CEP está fora de todas (não entrega).
+    """
+    inicios, fins, taxas = tabela
+    if not inicios:
+        return FRETE_PADRAO
+    numero = normalizar_cep(cep)
+    if numero is None:
+        return None
+    i = bisect_right(inicios, numero) - 1
+    if i < 0 or numero > fins[i]:
+        return None
+    return taxas[i]
+
+
+def carregar_tabela(cur, restaurante_id):
+    """Lê as zonas do restaurante e monta a tabela. `cur` é um cursor dictionary=True."""
+    cur.execute("""
+        SELECT cep_inicio, cep_fim, taxa
+        FROM zonas_entrega
+        WHERE restaurante_id=%s
+    """, (restaurante_id,))
+    return montar_tabela([(z["cep_inicio"], z["cep_fim"], float(z["taxa"])) for z in cur.fetchall()])
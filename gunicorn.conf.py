@@ -0,0 +1,29 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "gevent" (padrão): cada conexão SSE aberta (painel de pedidos) é um greenlet parado
+# no socket, então milhares de painéis cabem num worker sem tirar a vez do resto do
+# site. Sob gevent o db.py usa o mysql-connector em Python puro (use_pure): a extensão
+# C não devolve a vez aos outros greenlets durante as consultas.
+# "gthread" também funciona, mas cada painel ocupa uma das GUNICORN_THREADS threads;
+# com "sync" um único painel aberto prende o worker.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Conexões simultâneas por worker gevent: painéis abertos + requests
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+# Threads por worker gthread
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+
+
+def on_starting(server):
+    # Sem Redis os eventos do painel ficam no worker que os publicou (eventos.BrokerMemoria):
+    # com mais de um worker a cozinha deixaria de ver pedidos aprovados em outro worker
+    if server.cfg.workers > 1 and not os.getenv("REDIS_URL"):
+        raise RuntimeError(
+            f"{server.cfg.workers} workers sem REDIS_URL: os eventos do painel de pedidos não chegariam "
+            "a todos os workers. Configure REDIS_URL ou use WEB_CONCURRENCY=1."
+        )
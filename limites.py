@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# =========================
+# Limitadores (token bucket)
+# =========================
+class LimitadorMemoria:
+    """
+    Token bucket por chave, no processo. Cada chave tem `capacidade` fichas
+    que voltam à razão de `capacidade / janela` por segundo.
+    """
+
+    def __init__(self, max_chaves=100_000):
+        self.max_chaves = max_chaves
+        self._baldes = OrderedDict()  # chave -> (fichas, atualizado_em)
+        self._lock = threading.Lock()
+
+    def permitir(self, chave, capacidade, janela):
+        agora = time.monotonic()
+        taxa = capacidade / janela
+        with self._lock:
+            fichas, atualizado_em = self._baldes.get(chave, (capacidade, agora))
+            fichas = min(capacidade, fichas + (agora - atualizado_em) * taxa)
+            permitido = fichas >= 1
+            if permitido:
+                fichas -= 1
+            self._baldes[chave] = (fichas, agora)
+            self._baldes.move_to_end(chave)
+            while len(self._baldes) > self.max_chaves:
+                self._baldes.popitem(last=False)
+        return permitido
+
+
+_LUA_BALDE = """
+local capacidade = tonumber(ARGV[1])
+local janela = tonumber(ARGV[2])
+local agora = tonumber(ARGV[3])
+local balde = redis.call('HMGET', KEYS[1], 'fichas', 'ts')
+local fichas = tonumber(balde[1]) or capacidade
+local ts = tonumber(balde[2]) or agora
+fichas = math.min(capacidade, fichas + (agora - ts) * capacidade / janela)
+local permitido = 0
+if fichas >= 1 then
+  fichas = fichas - 1
+  permitido = 1
+end
+redis.call('HSET', KEYS[1], 'fichas', fichas, 'ts', agora)
+redis.call('EXPIRE', KEYS[1], math.ceil(janela))
+return permitido
+"""
+
+
+class LimitadorRedis:
+    """Token bucket compartilhado entre workers (script Lua atômico)."""
+
+    def __init__(self, url, prefixo="delivery:limite:"):
+        import redis  # dependência opcional: pip install redis
+
+        self.prefixo = prefixo
+        self._redis = redis.Redis.from_url(url)
+        self._balde = self._redis.register_script(_LUA_BALDE)
+
+    def permitir(self, chave, capacidade, janela):
+        return bool(self._balde(keys=[self.prefixo + chave], args=[capacidade, janela, time.time()]))
+
+
+_limitador = None
+_limitador_pid = None
+_limitador_lock = threading.Lock()
+
+
+def get_limitador():
+    """Redis se REDIS_URL estiver configurada; senão, limitador em memória do processo."""
+    global _limitador, _limitador_pid
+    pid = os.getpid()
+    if _limitador is None or _limitador_pid != pid:
+        with _limitador_lock:
+            if _limitador is None or _limitador_pid != pid:
+                url = os.getenv("REDIS_URL")
+                _limitador = LimitadorRedis(url) if url else LimitadorMemoria()
+                _limitador_pid = pid
+    return _limitador
+
+
+def permitir(chave, capacidade, janela):
+    return get_limitador().permitir(chave, capacidade, janela)
@@ -0,0 +1,326 @@
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Comandos SQL mais lentos que isso (ms) vão para o log com o EXPLAIN
+SQL_LENTO_MS = float(os.getenv("SQL_LENTO_MS", "200"))
+SQL_EXPLAIN = os.getenv("SQL_EXPLAIN", "1") == "1"
+# Header Server-Timing em todas as respostas (no modo debug ele sempre é enviado)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+# Limites (em segundos) dos buckets dos histogramas
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Limites dos buckets de "comandos SQL por request" (N+1 aparece nas faixas altas)
+BUCKETS_QTD = (1, 2, 5, 10, 20, 50, 100)
+
+log = logging.getLogger("delivery.sql")
+
+
+# =========================
+# Histogramas e contadores
+# =========================
+class Histograma:
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * len(limites)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.soma += valor
+        self.total += 1
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.contagens[i] += 1
+                break
+
+
+class Registro:
+    """
+    Métricas do processo (cada worker do gunicorn tem as suas), por rota do Flask.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sql_comandos = {}  # (rota, comando) -> quantidade
+        self.sql_linhas = {}  # rota -> linhas lidas/afetadas
+        self.sql_lentos = {}  # rota -> quantidade
+        self.sql_duracao = {}  # rota -> Histograma
+        self.sql_por_request = {}  # rota -> Histograma
+        self.http_requests = {}  # (rota, metodo, status) -> quantidade
+        self.http_duracao = {}  # rota -> Histograma
+
+    def registrar_sql(self, rota, comando, duracao, linhas, lento):
+        with self._lock:
+            chave = (rota, comando)
+            self.sql_comandos[chave] = self.sql_comandos.get(chave, 0) + 1
+            self.sql_linhas[rota] = self.sql_linhas.get(rota, 0) + max(linhas, 0)
+            if lento:
+                self.sql_lentos[rota] = self.sql_lentos.get(rota, 0) + 1
+            self.sql_duracao.setdefault(rota, Histograma(BUCKETS)).observar(duracao)
+
+    def registrar_request(self, rota, metodo, status, duracao, comandos_sql):
+        with self._lock:
+            chave = (rota, metodo, status)
+            self.http_requests[chave] = self.http_requests.get(chave, 0) + 1
+            self.http_duracao.setdefault(rota, Histograma(BUCKETS)).observar(duracao)
+            self.sql_por_request.setdefault(rota, Histograma(BUCKETS_QTD)).observar(comandos_sql)
+
+
+_registro = None
+_registro_pid = None
+_registro_lock = threading.Lock()
+
+
+def get_registro():
+    """Registro do processo atual (um worker criado por fork começa zerado)."""
+    global _registro, _registro_pid
+    pid = os.getpid()
+    if _registro is None or _registro_pid != pid:
+        with _registro_lock:
+            if _registro is None or _registro_pid != pid:
+                _registro = Registro()
+                _registro_pid = pid
+    return _registro
+
+
+# =========================
+# Cursor instrumentado
+# =========================
+def _rota_atual():
+    from flask import has_request_context, request
+
+    if not has_request_context():
+        return "fora_de_request"
+    return request.endpoint or "desconhecida"
+
+
+def _explain(conn, sql, params):
+    """Plano do comando, uma linha por tabela. Só roda se a conexão não tem resultado pendente."""
+    if not SQL_EXPLAIN or conn.unread_result:
+        return None
+    if sql.lstrip().split(None, 1)[0].upper() not in ("SELECT", "UPDATE", "DELETE", "INSERT", "REPLACE"):
+        return None
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("EXPLAIN " + sql, params)
+        plano = cur.fetchall()
+        cur.close()
+    except Exception as e:
+        return f"(EXPLAIN falhou: {e})"
+    return "\n".join(
+        f"  {p.get('table')}: type={p.get('type')} key={p.get('key')} rows={p.get('rows')} extra={p.get('Extra')}"
+        for p in plano
+    )
+
+
+def _registrar(conn, sql, params, duracao, linhas):
+    rota = _rota_atual()
+    comando = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "?"
+    lento = duracao * 1000 >= SQL_LENTO_MS
+    get_registro().registrar_sql(rota, comando, duracao, linhas, lento)
+
+    from flask import g, has_app_context
+
+    if has_app_context():
+        g.sql_comandos = g.get("sql_comandos", 0) + 1
+        g.sql_tempo = g.get("sql_tempo", 0.0) + duracao
+
+    if lento:
+        plano = _explain(conn, sql, params)
+        log.warning(
+            "SQL lento (%.1f ms, %d linhas) em %s: %s params=%r%s",
+            duracao * 1000, linhas, rota, " ".join(sql.split()), params,
+            "\n" + plano if plano else "",
+        )
+
+
+class CursorMedido:
+    """
+    Cursor do mysql-connector que mede cada comando: tempo do execute mais o tempo
+    dos fetch* seguintes e linhas lidas (ou afetadas). O comando é registrado quando
+    o próximo começa ou quando o cursor é fechado.
+    """
+
+    def __init__(self, cursor, conn):
+        self._cursor = cursor
+        self._conn = conn  # conexão crua, usada no EXPLAIN
+        self._atual = None  # [sql, params, duracao, linhas]
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def _finalizar(self):
+        if self._atual is None:
+            return
+        sql, params, duracao, linhas = self._atual
+        self._atual = None
+        try:
+            _registrar(self._conn, sql, params, duracao, linhas)
+        except Exception:
+            # Métrica nunca derruba o request
+            log.exception("Falha ao registrar métrica de SQL")
+
+    def _executar(self, metodo, sql, params, *args, **kwargs):
+        self._finalizar()
+        inicio = time.perf_counter()
+        try:
+            return metodo(sql, params, *args, **kwargs)
+        finally:
+            duracao = time.perf_counter() - inicio
+            # SELECT: as linhas são contadas nos fetch*; escrita: rowcount já é o total
+            linhas = 0 if self._cursor.with_rows else self._cursor.rowcount
+            self._atual = [sql, params, duracao, linhas]
+            if not self._cursor.with_rows:
+                self._finalizar()
+
+    def execute(self, sql, params=None, *args, **kwargs):
+        return self._executar(self._cursor.execute, sql, params, *args, **kwargs)
+
+    def executemany(self, sql, seq_params, *args, **kwargs):
+        return self._executar(self._cursor.executemany, sql, seq_params, *args, **kwargs)
+
+    def _medir_fetch(self, metodo, *args):
+        inicio = time.perf_counter()
+        resultado = metodo(*args)
+        if self._atual is not None:
+            self._atual[2] += time.perf_counter() - inicio
+            if isinstance(resultado, list):
+                self._atual[3] += len(resultado)
+            elif resultado is not None:
+                self._atual[3] += 1
+        return resultado
+
+    def fetchone(self):
+        return self._medir_fetch(self._cursor.fetchone)
+
+    def fetchmany(self, size=1):
+        return self._medir_fetch(self._cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._medir_fetch(self._cursor.fetchall)
+
+    def close(self):
+        # Fecha antes de registrar: o EXPLAIN precisa da conexão sem resultado pendente
+        try:
+            return self._cursor.close()
+        finally:
+            self._finalizar()
+
+
+# =========================
+# Integração com o Flask
+# =========================
+def _inicio_request():
+    from flask import g
+
+    g.inicio_request = time.perf_counter()
+
+
+def _fim_request(resposta):
+    from flask import current_app, g, request
+
+    inicio = g.get("inicio_request")
+    if inicio is None:
+        return resposta
+    duracao = time.perf_counter() - inicio
+    comandos = g.get("sql_comandos", 0)
+    get_registro().registrar_request(
+        request.endpoint or "desconhecida", request.method, resposta.status_code, duracao, comandos
+    )
+
+    if SERVER_TIMING or current_app.debug:
+        resposta.headers.add(
+            "Server-Timing",
+            f'sql;dur={g.get("sql_tempo", 0.0) * 1000:.1f};desc="{comandos} comandos", app;dur={duracao * 1000:.1f}',
+        )
+    return resposta
+
+
+def init_app(app):
+    app.before_request(_inicio_request)
+    app.after_request(_fim_request)
+
+
+# =========================
+# Exportação (formato texto do Prometheus)
+# =========================
+def _rotulos(**rotulos):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in rotulos.items()) + "}"
+
+
+def _histograma(linhas, nome, rota, h):
+    acumulado = 0
+    for limite, qtd in zip(h.limites, h.contagens):
+        acumulado += qtd
+        linhas.append(f"{nome}_bucket{_rotulos(rota=rota, le=limite)} {acumulado}")
+    linhas.append(f"{nome}_bucket{_rotulos(rota=rota, le='+Inf')} {h.total}")
+    linhas.append(f"{nome}_sum{_rotulos(rota=rota)} {h.soma}")
+    linhas.append(f"{nome}_count{_rotulos(rota=rota)} {h.total}")
+
+
+def exportar(pool=None, replicas=None):
+    """
+    Texto no formato de exposição do Prometheus; `pool` são as estatísticas do pool de
+    conexões do primário e `replicas` as de cada réplica de leitura.
+    """
+    r = get_registro()
+    linhas = []
+    with r._lock:
+        linhas.append("# TYPE delivery_http_requests_total counter")
+        for (rota, metodo, status), qtd in sorted(r.http_requests.items()):
+            linhas.append(f"delivery_http_requests_total{_rotulos(rota=rota, metodo=metodo, status=status)} {qtd}")
+
+        linhas.append("# TYPE delivery_http_duracao_segundos histogram")
+        for rota, h in sorted(r.http_duracao.items()):
+            _histograma(linhas, "delivery_http_duracao_segundos", rota, h)
+
+        linhas.append("# TYPE delivery_sql_comandos_total counter")
+        for (rota, comando), qtd in sorted(r.sql_comandos.items()):
+            linhas.append(f"delivery_sql_comandos_total{_rotulos(rota=rota, comando=comando)} {qtd}")
+
+        linhas.append("# TYPE delivery_sql_linhas_total counter")
+        for rota, qtd in sorted(r.sql_linhas.items()):
+            linhas.append(f"delivery_sql_linhas_total{_rotulos(rota=rota)} {qtd}")
+
+        linhas.append("# TYPE delivery_sql_lentos_total counter")
+        for rota, qtd in sorted(r.sql_lentos.items()):
+            linhas.append(f"delivery_sql_lentos_total{_rotulos(rota=rota)} {qtd}")
+
+        linhas.append("# TYPE delivery_sql_duracao_segundos histogram")
+        for rota, h in sorted(r.sql_duracao.items()):
+            _histograma(linhas, "delivery_sql_duracao_segundos", rota, h)
+
+        linhas.append("# TYPE delivery_sql_por_request histogram")
+        for rota, h in sorted(r.sql_por_request.items()):
+            _histograma(linhas, "delivery_sql_por_request", rota, h)
+
+    for chave, valor in (pool or {}).items():
+        if chave in ("tamanho", "overflow", "abertas", "em_uso", "livres", "espera_max_s"):
+            nome, tipo = f"delivery_pool_{chave}", "gauge"
+        else:
+            nome, tipo = f"delivery_pool_{chave}_total", "counter"
+        linhas.append(f"# TYPE {nome} {tipo}")
+        linhas.append(f"{nome} {valor}")
+
+    if replicas:
+        for nome, campo in (("delivery_replica_disponivel", "disponivel"),
+                            ("delivery_replica_atraso_segundos", "atraso_s"),
+                            ("delivery_replica_em_uso", "em_uso")):
+            linhas.append(f"# TYPE {nome} gauge")
+            for r in replicas:
+                if r[campo] is not None:
+                    linhas.append(f"{nome}{_rotulos(replica=r['replica'])} {int(r[campo])}")
+        linhas.append("# TYPE delivery_replica_falhas_total counter")
+        for r in replicas:
+            linhas.append(f"delivery_replica_falhas_total{_rotulos(replica=r['replica'])} {r['falhas']}")
+
+    return "\n".join(linhas) + "\n"
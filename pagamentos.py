@@ -0,0 +1,221 @@
+import importlib
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from db import get_db
+from eventos import canal_restaurante, publicar
+from pedidos import transicionar
+import resumo
+
+load_dotenv()
+
+# Gateway no formato "modulo:Classe"; o padrão é o gateway falso deste arquivo
+PAGAMENTO_GATEWAY = os.getenv("PAGAMENTO_GATEWAY", "pagamentos:GatewayFalso")
+# Threads por worker conversando com o gateway (o request do checkout não espera por elas)
+PAGAMENTO_THREADS = int(os.getenv("PAGAMENTO_THREADS", "4"))
+# Pedido PENDENTE há mais que isso (s) é reenviado ao gateway (ex.: worker reiniciou no meio)
+PAGAMENTO_REENVIO = int(os.getenv("PAGAMENTO_REENVIO", "60"))
+
+
+# =========================
+# Gateways
+# =========================
+class ResultadoPagamento:
+    def __init__(self, aprovado, referencia=None, motivo=None):
+        self.aprovado = aprovado
+        self.referencia = referencia
+        self.motivo = motivo
+
+
+class GatewayFalso:
+    """
+    Gateway local para desenvolvimento e testes: responde depois de
+    PAGAMENTO_FALSO_ATRASO segundos, aprova tudo e recusa valores terminados
+    em 13 centavos (ex.: R$ 52,13), para testar o caminho da recusa.
+
+    Todo gateway implementa cobrar(pedido_id, valor, metodo) e estornar(pedido_id)
+    e deve ser idempotente por pedido_id: o mesmo pedido pode ser reenviado.
+    """
+
+    def __init__(self):
+        self.atraso = float(os.getenv("PAGAMENTO_FALSO_ATRASO", "1.0"))
+        self._cobrancas = {}  # pedido_id -> ResultadoPagamento
+        self._lock = threading.Lock()
+
+    def cobrar(self, pedido_id, valor, metodo):
+        with self._lock:
+            if pedido_id in self._cobrancas:
+                return self._cobrancas[pedido_id]
+
+        time.sleep(self.atraso)
+        if round(valor * 100) % 100 == 13:
+            resultado = ResultadoPagamento(False, motivo="Pagamento recusado pelo emissor.")
+        else:
+            resultado = ResultadoPagamento(True, referencia=f"falso_{metodo.lower()}_{secrets.token_hex(8)}")
+
+        with self._lock:
+            return self._cobrancas.setdefault(pedido_id, resultado)
+
+    def estornar(self, pedido_id):
+        with self._lock:
+            self._cobrancas.pop(pedido_id, None)
+
+
+def _carregar_gateway():
+    modulo, _, classe = PAGAMENTO_GATEWAY.partition(":")
+    return getattr(importlib.import_module(modulo), classe)()
+
+
+# =========================
+# Processamento em segundo plano
+# =========================
+_executor = None
+_gateway = None
+_em_andamento = set()  # pedidos já na fila deste worker
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor, _gateway, _em_andamento, _executor_pid
+    pid = os.getpid()
+    if _executor_pid != pid:
+        with _executor_lock:
+            if _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=PAGAMENTO_THREADS, thread_name_prefix="pagamento")
+                _gateway = _carregar_gateway()
+                _em_andamento = set()
+                _executor_pid = pid
+    return _executor, _gateway
+
+
+def enviar(pedido_id):
+    """Coloca a cobrança do pedido na fila e retorna na hora."""
+    executor, gateway = _pool()
+    with _executor_lock:
+        if pedido_id in _em_andamento:
+            return
+        _em_andamento.add(pedido_id)
+    executor.submit(_processar, gateway, pedido_id)
+
+
+def aguardar():
+    """Espera as cobranças em andamento neste processo terminarem."""
+    global _executor_pid
+    executor, _ = _pool()
+    executor.shutdown(wait=True)
+    _executor_pid = None  # o próximo enviar() cria outro executor
+
+
+def _processar(gateway, pedido_id):
+    try:
+        processar(gateway, pedido_id)
+    except Exception:
+        # Fica PENDENTE; reenviar_pendentes() tenta de novo depois
+        pass
+    finally:
+        with _executor_lock:
+            _em_andamento.discard(pedido_id)
+
+
+def processar(gateway, pedido_id):
+    """
+    Cobra um pedido PENDENTE e grava o resultado. Aprovado: PAGO e o pedido aparece
+    no painel do restaurante. Recusado: RECUSADO e o pedido é cancelado.
+    """
+    db = get_db()  # fora de request: conexão emprestada do pool
+    cur = db.cursor(dictionary=True)
+    try:
+        cur.execute("""
+            SELECT p.id, p.restaurante_id, p.total, p.metodo_pagamento, p.status_pagamento,
+                   p.realizado_em, c.nome AS cliente_nome
+            FROM pedidos p
+            JOIN clientes c ON c.usuario_id = p.cliente_id
+            WHERE p.id=%s
+        """, (pedido_id,))
+        pedido = cur.fetchone()
+        db.rollback()  # não segura a transação de leitura durante a chamada ao gateway
+        if not pedido or pedido["status_pagamento"] != "PENDENTE":
+            return
+
+        resultado = gateway.cobrar(pedido_id, float(pedido["total"]), pedido["metodo_pagamento"])
+        status = "PAGO" if resultado.aprovado else "RECUSADO"
+
+        # Condicionado a PENDENTE: reenvios e processamentos concorrentes gravam uma vez só.
+        # versao + 1 faz telas com a versão antiga receberem conflito em vez de sobrescrever.
+        cur.execute("""
+            UPDATE pedidos
+            SET status_pagamento=%s,
+                valor_pago=IF(%s = 'PAGO', total, 0),
+                pagamento_ref=%s,
+                versao=versao + 1
+            WHERE id=%s AND status_pagamento='PENDENTE'
+        """, (status, status, resultado.referencia, pedido_id))
+        if cur.rowcount == 0:
+            # Já gravado por outro processamento, ou cancelado enquanto esperava o gateway
+            # (transicionar marca RECUSADO): nesse caso a cobrança aprovada é devolvida
+            cur.execute("SELECT status_pagamento FROM pedidos WHERE id=%s", (pedido_id,))
+            agora = cur.fetchone()
+            db.rollback()
+            if resultado.aprovado and agora and agora["status_pagamento"] == "RECUSADO":
+                gateway.estornar(pedido_id)
+            return
+
+        if resultado.aprovado:
+            # Só agora o pedido conta no resumo do painel; último comando antes do commit
+            resumo.registrar_pedido_novo(cur, pedido["restaurante_id"], pedido["total"], pedido["realizado_em"])
+        else:
+            transicionar(cur, pedido["restaurante_id"], {pedido_id: None}, "CANCELADO")
+        db.commit()
+
+        cur.execute("SELECT status_pedido, versao FROM pedidos WHERE id=%s", (pedido_id,))
+        atual = cur.fetchone()
+        db.rollback()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+        db.close()
+
+    if resultado.aprovado:
+        # Só agora o pedido entra no painel da cozinha
+        publicar(canal_restaurante(pedido["restaurante_id"]), {
+            "tipo": "novo_pedido",
+            "pedido": {
+                "id": pedido_id,
+                "cliente_nome": pedido["cliente_nome"],
+                "realizado_em": pedido["realizado_em"].strftime("%d/%m/%Y %H:%M"),
+                "status_pedido": atual["status_pedido"],
+                "versao": atual["versao"],
+                "total": float(pedido["total"]),
+            },
+        })
+    else:
+        publicar(canal_restaurante(pedido["restaurante_id"]), {
+            "tipo": "status",
+            "pedido": {"id": pedido_id, "status_pedido": atual["status_pedido"], "versao": atual["versao"]},
+        })
+
+
+def reenviar_pendentes(idade=PAGAMENTO_REENVIO):
+    """Reenfileira pedidos PENDENTE há mais de `idade` segundos. Retorna quantos."""
+    db = get_db()
+    cur = db.cursor()
+    cur.execute("""
+        SELECT id
+        FROM pedidos
+        WHERE status_pagamento='PENDENTE' AND realizado_em < NOW() - INTERVAL %s SECOND
+    """, (idade,))
+    ids = [row[0] for row in cur.fetchall()]
+    cur.close()
+    db.close()
+
+    for pedido_id in ids:
+        enviar(pedido_id)
+    return len(ids)
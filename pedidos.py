@@ -0,0 +1,176 @@
+import estoque
+import resumo
+
+# =========================
+# Ciclo de vida do pedido
+# =========================
+# Para onde cada status pode ir. Só se anda para frente; cancelar vale enquanto o
+# pedido não foi entregue. ENTREGUE e CANCELADO são finais.
+TRANSICOES = {
+    "ACEITO": ("PREPARANDO", "SAIU_ENTREGA", "ENTREGUE", "CANCELADO"),
+    "PREPARANDO": ("SAIU_ENTREGA", "ENTREGUE", "CANCELADO"),
+    "SAIU_ENTREGA": ("ENTREGUE", "CANCELADO"),
+    "ENTREGUE": (),
+    "CANCELADO": (),
+}
+
+# Motivos de recusa devolvidos por transicionar()
+NAO_ENCONTRADO = "não encontrado"
+CONFLITO = "alterado em outro aparelho"
+TRANSICAO_INVALIDA = "transição não permitida"
+PAGAMENTO_PENDENTE = "pagamento ainda não confirmado"
+
+
+def pode_transicionar(de, para):
+    return para in TRANSICOES.get(de, ())
+
+
+def transicionar(cur, restaurante_id, versoes, para):
+    """
+    Leva vários pedidos do restaurante para o status `para` com um único UPDATE,
+    sem lock prévio (controle otimista pela coluna versao).
+
+    versoes: {pedido_id: versao que o aparelho viu, ou None para aceitar a atual}
+    Retorna (aplicados, recusados):
+      aplicados: [{"id", "de", "versao"}] com a versão nova de cada pedido
+      recusados: {pedido_id: motivo}
+
+    Roda na transação de quem chamou (que faz o commit) e conta com o REPEATABLE READ
+    do InnoDB: a releitura após o UPDATE enxerga as próprias alterações e a foto tirada
+    na primeira leitura para os demais pedidos.
+    """
+    if para not in TRANSICOES:
+        raise ValueError(f"Status inválido: {para}")
+
+    recusados = {}
+    if not versoes:
+        return [], recusados
+
+    ids = list(versoes)
+    em = ",".join(["%s"] * len(ids))
+
+    # 1) Leitura sem lock do estado atual
+    cur.execute(f"""
+        SELECT id, status_pedido, status_pagamento, versao
+        FROM pedidos
+        WHERE restaurante_id=%s AND id IN ({em})
+    """, (restaurante_id, *ids))
+    atuais = {row["id"]: row for row in cur.fetchall()}
+
+    candidatos = {}
+    for pid in ids:
+        atual = atuais.get(pid)
+        if not atual:
+            recusados[pid] = NAO_ENCONTRADO
+        elif versoes[pid] is not None and versoes[pid] != atual["versao"]:
+            recusados[pid] = CONFLITO
+        elif not pode_transicionar(atual["status_pedido"], para):
+            recusados[pid] = TRANSICAO_INVALIDA
+        elif atual["status_pagamento"] == "PENDENTE" and para != "CANCELADO":
+            # Antes da confirmação do pagamento (pagamentos.py) o pedido só pode ser cancelado
+            recusados[pid] = PAGAMENTO_PENDENTE
+        else:
+            candidatos[pid] = atual
+
+    if not candidatos:
+        return [], recusados
+
+    # 2) Um UPDATE para todos, condicionado a (id, versao) não terem mudado desde a leitura
+    pares = ",".join(["(%s,%s)"] * len(candidatos))
+    params = [para, para, para, restaurante_id]
+    for pid, atual in candidatos.items():
+        params += [pid, atual["versao"]]
+    cur.execute(f"""
+        UPDATE pedidos
+        SET status_pedido=%s,
+            versao=versao + 1,
+            entregue_em=IF(%s = 'ENTREGUE', NOW(), entregue_em),
+            status_pagamento=CASE
+              WHEN %s <> 'CANCELADO' THEN status_pagamento
+              WHEN status_pagamento = 'PAGO' THEN 'ESTORNADO'
+              WHEN status_pagamento = 'PENDENTE' THEN 'RECUSADO'
+              ELSE status_pagamento
+            END
+        WHERE restaurante_id=%s AND (id, versao) IN ({pares})
+    """, tuple(params))
+
+    # 3) Se algum pedido mudou entre a leitura e o UPDATE, descobre quais
+    if cur.rowcount < len(candidatos):
+        cur.execute(f"""
+            SELECT id, versao
+            FROM pedidos
+            WHERE id IN ({",".join(["%s"] * len(candidatos))})
+        """, tuple(candidatos))
+        versao_agora = {row["id"]: row["versao"] for row in cur.fetchall()}
+        for pid, atual in list(candidatos.items()):
+            if versao_agora.get(pid) != atual["versao"] + 1:
+                recusados[pid] = CONFLITO
+                del candidatos[pid]
+
+    aplicados = [
+        {"id": pid, "de": atual["status_pedido"], "versao": atual["versao"] + 1}
+        for pid, atual in candidatos.items()
+    ]
+    if para == "CANCELADO":
+        # Cancelado antes do preparo (inclui pagamento recusado): os itens voltam ao estoque.
+        # Antes do resumo: quem trava as duas linhas trava sempre o estoque primeiro
+        estoque.devolver(cur, [a["id"] for a in aplicados if a["de"] == "ACEITO"])
+    # Pedido sem pagamento confirmado (PENDENTE, ou RECUSADO por pagamentos.processar logo
+    # antes) nunca entrou no resumo: cancelá-lo não mexe nele
+    resumo.registrar_transicoes(cur, restaurante_id, [
+        (a["id"], a["de"], para) for a in aplicados
+        if candidatos[a["id"]]["status_pagamento"] in resumo.PAGAMENTOS_CONTADOS
+    ])
+    return aplicados, recusados
+
+
+# =========================
+# Leitura do pedido com os itens
+# =========================
+# Pedido nesses status não muda mais (nem status, nem pagamento): pode ficar em cache
+STATUS_FINAIS = ("ENTREGUE", "CANCELADO")
+
+
+def carregar_detalhe(cur, pedido_id=None, cliente_id=None, restaurante_id=None, token=None):
+    """
+    Cabeçalho e itens do pedido numa única ida ao banco (uma linha por item, com o
+    cabeçalho repetido), pelo id ou pelo token público. cliente_id/restaurante_id
+    restringem ao dono do pedido no próprio WHERE.
+    Retorna (pedido, itens) ou None se não existir (ou não for de quem pediu).
+    `cur` é um cursor dictionary=True.
+    """
+    if token is not None:
+        filtro = "p.token_publico=%s"
+        params = [token]
+    else:
+        filtro = "p.id=%s"
+        params = [pedido_id]
+    if cliente_id is not None:
+        filtro += " AND p.cliente_id=%s"
+        params.append(cliente_id)
+    if restaurante_id is not None:
+        filtro += " AND p.restaurante_id=%s"
+        params.append(restaurante_id)
+
+    cur.execute(f"""
+        SELECT p.*, r.nome AS restaurante_nome, c.nome AS cliente_nome,
+               ic.nome AS item_nome, ip.quantidade AS item_quantidade, ip.total_linha AS item_total_linha
+        FROM pedidos p
+        JOIN restaurantes r ON r.usuario_id = p.restaurante_id
+        JOIN clientes c ON c.usuario_id = p.cliente_id
+        LEFT JOIN itens_pedido ip ON ip.pedido_id = p.id
+        LEFT JOIN itens_cardapio ic ON ic.id = ip.item_cardapio_id
+        WHERE {filtro}
+        ORDER BY ip.id
+    """, tuple(params))
+    linhas = cur.fetchall()
+    if not linhas:
+        return None
+
+    pedido = {k: v for k, v in linhas[0].items() if not k.startswith("item_")}
+    itens = [
+        {"nome": row["item_nome"], "quantidade": row["item_quantidade"], "total_linha": row["item_total_linha"]}
+        for row in linhas
+        if row["item_quantidade"] is not None
+    ]
+    return pedido, itens
@@ -0,0 +1,161 @@
+# Resumo operacional por restaurante (tabela resumo_restaurante).
+#
+# Atualizado na mesma transação que confirma o pagamento ou muda o status do pedido, para
+# o painel ler uma linha pela PK em vez de agregar todo o histórico de pedidos a cada visita.
+# Conta só pedidos com pagamento confirmado (PAGO ou, se cancelados depois, ESTORNADO), os
+# mesmos que o painel de pedidos mostra: o pedido entra no resumo quando o pagamento é
+# aprovado (pagamentos.processar), não no checkout, e um pagamento recusado nunca entra.
+#
+# A linha do restaurante é tocada por todo pagamento aprovado e toda mudança de status
+# dele, e o lock dela vai até o commit: registrar_* deve ser o último comando da transação,
+# para as transações simultâneas de um restaurante só fazerem fila no commit, não durante
+# o resto do trabalho (pagamentos.processar, pedidos.transicionar).
+# Em caso de divergência (ex.: pedido alterado direto no banco), reconstruir() refaz
+# os números a partir da tabela pedidos.
+
+# Coluna do resumo para cada status_pedido
+COLUNA_STATUS = {
+    "ACEITO": "aceito",
+    "PREPARANDO": "preparando",
+    "SAIU_ENTREGA": "saiu_entrega",
+    "ENTREGUE": "entregue",
+    "CANCELADO": "cancelado",
+}
+# status_pagamento dos pedidos que entram no resumo (os que o painel de pedidos mostra)
+PAGAMENTOS_CONTADOS = ("PAGO", "ESTORNADO")
+
+
+# =========================
+# Atualização incremental
+# =========================
+def registrar_pedido_novo(cur, restaurante_id, total, realizado_em, status="ACEITO"):
+    """
+    Conta um pedido cujo pagamento acabou de ser aprovado; o primeiro pedido de um novo dia
+    zera os números do dia. Pedido feito ontem e aprovado depois da meia-noite não entra nos
+    números de hoje (como no reconstruir()). Chame logo antes do commit (ver o comentário do topo).
+    """
+    coluna = COLUNA_STATUS[status]
+    # VALUES(coluna) e não o alias "AS novo" (só existe a partir do MySQL 8.0.19 e não no MariaDB)
+    cur.execute(f"""
+        INSERT INTO resumo_restaurante (restaurante_id, {coluna}, dia, pedidos_dia, receita_dia)
+        VALUES (%s, 1, CURDATE(), IF(%s >= CURDATE(), 1, 0), IF(%s >= CURDATE(), %s, 0))
+        ON DUPLICATE KEY UPDATE
+          {coluna} = resumo_restaurante.{coluna} + 1,
+          pedidos_dia = IF(resumo_restaurante.dia = CURDATE(), resumo_restaurante.pedidos_dia, 0) + VALUES(pedidos_dia),
+          receita_dia = IF(resumo_restaurante.dia = CURDATE(), resumo_restaurante.receita_dia, 0) + VALUES(receita_dia),
+          dia = CURDATE()
+    """, (restaurante_id, realizado_em, realizado_em, total))
+
+
+def registrar_transicoes(cur, restaurante_id, transicoes):
+    """
+    Aplica ao resumo mudanças de status já gravadas em pedidos (mesma transação), como
+    último comando antes do commit.
+    transicoes: [(pedido_id, status_anterior, status_novo)], todas do mesmo restaurante e
+    só de pedidos que já estão no resumo (pagamento confirmado antes da mudança).
+
+    Um único UPDATE, qualquer que seja a quantidade de pedidos: as contagens vêm
+    prontas daqui; receita cancelada e tempo de entrega são somados no banco a partir
+    dos pedidos já atualizados.
+    """
+    if not transicoes:
+        return
+
+    deltas = {}
+    for _, de, para in transicoes:
+        deltas[COLUNA_STATUS[de]] = deltas.get(COLUNA_STATUS[de], 0) - 1
+        deltas[COLUNA_STATUS[para]] = deltas.get(COLUNA_STATUS[para], 0) + 1
+
+    sets = []
+    params = []
+    for coluna, delta in deltas.items():
+        if delta:
+            sets.append(f"{coluna} = {coluna} + %s")
+            params.append(delta)
+
+    cancelados = [pid for pid, _, para in transicoes if para == "CANCELADO"]
+    if cancelados:
+        # Pedido feito hoje e cancelado sai dos números do dia
+        em = ",".join(["%s"] * len(cancelados))
+        sets.append(f"""pedidos_dia = pedidos_dia - IF(dia = CURDATE(), (
+            SELECT COUNT(*) FROM pedidos WHERE id IN ({em}) AND realizado_em >= CURDATE()), 0)""")
+        sets.append(f"""receita_dia = receita_dia - IF(dia = CURDATE(), (
+            SELECT COALESCE(SUM(total), 0) FROM pedidos WHERE id IN ({em}) AND realizado_em >= CURDATE()), 0)""")
+        params += cancelados + cancelados
+
+    entregues = [pid for pid, _, para in transicoes if para == "ENTREGUE"]
+    if entregues:
+        em = ",".join(["%s"] * len(entregues))
+        sets.append(f"""entregas_medidas = entregas_medidas + (
+            SELECT COUNT(*) FROM pedidos WHERE id IN ({em}) AND entregue_em IS NOT NULL)""")
+        sets.append(f"""segundos_entrega = segundos_entrega + (
+            SELECT COALESCE(SUM(TIMESTAMPDIFF(SECOND, realizado_em, entregue_em)), 0)
+            FROM pedidos WHERE id IN ({em}) AND entregue_em IS NOT NULL)""")
+        params += entregues + entregues
+
+    if not sets:
+        return
+
+    cur.execute(f"UPDATE resumo_restaurante SET {', '.join(sets)} WHERE restaurante_id=%s",
+                (*params, restaurante_id))
+    if cur.rowcount == 0:
+        # Restaurante sem linha de resumo (pedidos anteriores à tabela): monta a partir do histórico
+        reconstruir(cur, restaurante_id)
+
+
+# =========================
+# Leitura e reconstrução
+# =========================
+def obter(cur, restaurante_id):
+    """Resumo para o painel; números do dia zerados se o último pedido foi em outro dia."""
+    cur.execute("""
+        SELECT aceito, preparando, saiu_entrega, entregue, cancelado,
+               IF(dia = CURDATE(), pedidos_dia, 0) AS pedidos_dia,
+               IF(dia = CURDATE(), receita_dia, 0) AS receita_dia,
+               IF(entregas_medidas > 0, segundos_entrega / entregas_medidas / 60, NULL) AS minutos_entrega
+        FROM resumo_restaurante
+        WHERE restaurante_id=%s
+    """, (restaurante_id,))
+    resumo = cur.fetchone()
+    if not resumo:
+        resumo = {coluna: 0 for coluna in COLUNA_STATUS.values()}
+        resumo.update(pedidos_dia=0, receita_dia=0, minutos_entrega=None)
+    resumo["em_aberto"] = resumo["aceito"] + resumo["preparando"] + resumo["saiu_entrega"]
+    return resumo
+
+
+def reconstruir(cur, restaurante_id=None):
+    """Recalcula o resumo a partir de pedidos (de um restaurante ou de todos)."""
+    filtro = "WHERE r.usuario_id = %s" if restaurante_id is not None else ""
+    hoje = "p.realizado_em >= CURDATE() AND p.status_pedido <> 'CANCELADO'"
+    entregue = "p.status_pedido = 'ENTREGUE' AND p.entregue_em IS NOT NULL"
+    cur.execute(f"""
+        INSERT INTO resumo_restaurante (
+          restaurante_id, aceito, preparando, saiu_entrega, entregue, cancelado,
+          dia, pedidos_dia, receita_dia, entregas_medidas, segundos_entrega
+        )
+        SELECT * FROM (
+          SELECT r.usuario_id AS restaurante_id,
+                 COALESCE(SUM(p.status_pedido = 'ACEITO'), 0) AS aceito,
+                 COALESCE(SUM(p.status_pedido = 'PREPARANDO'), 0) AS preparando,
+                 COALESCE(SUM(p.status_pedido = 'SAIU_ENTREGA'), 0) AS saiu_entrega,
+                 COALESCE(SUM(p.status_pedido = 'ENTREGUE'), 0) AS entregue,
+                 COALESCE(SUM(p.status_pedido = 'CANCELADO'), 0) AS cancelado,
+                 CURDATE() AS dia,
+                 COALESCE(SUM({hoje}), 0) AS pedidos_dia,
+                 COALESCE(SUM(IF({hoje}, p.total, 0)), 0) AS receita_dia,
+                 COALESCE(SUM({entregue}), 0) AS entregas_medidas,
+                 COALESCE(SUM(IF({entregue}, TIMESTAMPDIFF(SECOND, p.realizado_em, p.entregue_em), 0)), 0)
+                   AS segundos_entrega
+          FROM restaurantes r
+          LEFT JOIN pedidos p ON p.restaurante_id = r.usuario_id
+            AND p.status_pagamento IN ({",".join(f"'{s}'" for s in PAGAMENTOS_CONTADOS)})
+          {filtro}
+          GROUP BY r.usuario_id
+        ) AS calc
+        ON DUPLICATE KEY UPDATE
+          aceito = calc.aceito, preparando = calc.preparando, saiu_entrega = calc.saiu_entrega,
+          entregue = calc.entregue, cancelado = calc.cancelado, dia = calc.dia,
+          pedidos_dia = calc.pedidos_dia, receita_dia = calc.receita_dia,
+          entregas_medidas = calc.entregas_medidas, segundos_entrega = calc.segundos_entrega
+    """, (restaurante_id,) if restaurante_id is not None else ())
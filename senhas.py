@@ -0,0 +1,131 @@
+import multiprocessing
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from dotenv import load_dotenv
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+load_dotenv()
+
+# Custo do hash no formato do werkzeug ("scrypt:N:r:p" ou "pbkdf2:sha256:iterações").
+# Ao mudar, as senhas antigas são refeitas no próximo login (precisa_rehash).
+METODO_SENHA = os.getenv("SENHA_METODO", "scrypt:32768:8:1")
+# Processos dedicados ao hash (0 = calcula no próprio worker, útil em testes)
+SENHA_PROCESSOS = int(os.getenv("SENHA_PROCESSOS", "2"))
+# Hashes aguardando ou em execução por worker; acima disso o request é recusado
+SENHA_FILA_MAX = int(os.getenv("SENHA_FILA_MAX", "8"))
+SENHA_TIMEOUT = float(os.getenv("SENHA_TIMEOUT", "5"))
+
+
+class HashOcupado(Exception):
+    """Fila de hash cheia: melhor recusar rápido do que empilhar requests."""
+
+
+_executor = None
+_vagas = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor, _vagas, _executor_pid
+    pid = os.getpid()
+    if _executor_pid != pid:
+        with _executor_lock:
+            if _executor_pid != pid:
+                if SENHA_PROCESSOS > 0:
+                    # spawn: não herda threads/conexões do worker (fork com threads pode travar)
+                    _executor = ProcessPoolExecutor(
+                        max_workers=SENHA_PROCESSOS,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                _vagas = threading.BoundedSemaphore(SENHA_FILA_MAX)
+                _executor_pid = pid
+    return _executor, _vagas
+
+
+def _executar(fn, *args):
+    executor, vagas = _pool()
+    if not vagas.acquire(blocking=False):
+        raise HashOcupado("Muitas verificações de senha em andamento.")
+    if executor is None:
+        try:
+            return fn(*args)
+        finally:
+            vagas.release()
+
+    try:
+        futuro = executor.submit(fn, *args)
+    except (BrokenProcessPool, RuntimeError):
+        # Pool quebrado ou já desligado por outra thread: recria na próxima chamada
+        vagas.release()
+        _descartar_pool(executor)
+        raise HashOcupado("Pool de hash reiniciando.")
+    # A vaga só volta quando o hash termina de verdade: depois de um timeout ele
+    # continua ocupando um processo do pool e precisa continuar contando na fila
+    futuro.add_done_callback(lambda _: vagas.release())
+    try:
+        return futuro.result(timeout=SENHA_TIMEOUT)
+    except BrokenProcessPool:
+        # Um processo do pool morreu: recria o pool na próxima chamada
+        _descartar_pool(executor)
+        raise HashOcupado("Pool de hash reiniciando.")
+    except FuturesTimeout:
+        raise HashOcupado(f"Hash não terminou em {SENHA_TIMEOUT}s.")
+
+
+def _descartar_pool(executor):
+    global _executor_pid
+    with _executor_lock:
+        if _executor is executor:
+            _executor_pid = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def gerar_hash(senha):
+    return _executar(generate_password_hash, senha, METODO_SENHA)
+
+
+def verificar(senha_hash, senha):
+    return _executar(check_password_hash, senha_hash, senha)
+
+
+_hash_ficticio = None
+
+
+def verificar_ficticio(senha):
+    """
+    Para email sem conta: verifica contra um hash do método configurado e retorna False.
+    Custa o mesmo que verificar(), então o tempo de resposta não revela quem tem conta.
+    """
+    global _hash_ficticio
+    if _hash_ficticio is None:
+        _hash_ficticio = gerar_hash(secrets.token_hex(16))
+    _executar(check_password_hash, _hash_ficticio, senha)
+    return False
+
+
+def _metodo_completo(metodo):
+    """
+    Método com todos os parâmetros, como o werkzeug grava no hash: "scrypt" ->
+    "scrypt:32768:8:1", "pbkdf2" -> "pbkdf2:sha256:<iterações padrão>".
+    """
+    nome, *args = metodo.split(":")
+    if nome == "scrypt" and not args:
+        args = ["32768", "8", "1"]
+    elif nome == "pbkdf2":
+        args = (args or ["sha256"])[:2]
+        if len(args) == 1:
+            args.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ":".join([nome, *args])
+
+
+_METODO_ATUAL = _metodo_completo(METODO_SENHA)
+
+
+def precisa_rehash(senha_hash):
+    """True se o hash foi gerado com outro método/custo que o configurado."""
+    return _metodo_completo(senha_hash.split("$", 1)[0]) != _METODO_ATUAL